@@ -0,0 +1,92 @@
+-- Compact storage layout for a daily price database. Run it once, after CREATES.sql, on a new or existing database
+-- (existing rows are copied over); everything else, including the updater, works unchanged on either layout.
+--
+-- * PriceBar holds one row per daily bar: no surrogate key, no DataSourceID (it is in SecurityMetaData), a DATE
+--   SampleTime, an integer Volume, and only the price columns daily data actually has.
+-- * Splits and dividends, which only a handful of bars carry, live in the sparse CorporateAction side table.
+-- * Both tables use InnoDB page compression (ROW_FORMAT=COMPRESSED, needs innodb_file_per_table).
+-- * DataSourcePriceObservation becomes a view with the original columns, so every read works as before. Writes go
+--   through MergePriceObservations (see STOREDPROCS.sql), which the updater and the procedures call for this layout.
+
+CREATE TABLE PriceBar (
+    SecurityMetaDataID MEDIUMINT UNSIGNED NOT NULL,
+    SampleTime DATE NOT NULL,
+    OpenPrice FLOAT,
+    HighPrice FLOAT,
+    LowPrice FLOAT,
+    ClosePrice FLOAT,
+    AdjustedClosePrice FLOAT,
+    Volume BIGINT UNSIGNED,
+    PRIMARY KEY (SecurityMetaDataID, SampleTime)
+) ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
+
+CREATE TABLE CorporateAction (
+    SecurityMetaDataID MEDIUMINT UNSIGNED NOT NULL,
+    SampleTime DATE NOT NULL,
+    DividendAmount FLOAT,
+    SplitCoefficient FLOAT,
+    PRIMARY KEY (SecurityMetaDataID, SampleTime)
+) ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
+
+-- Copy any existing rows, then swap the table for the compatibility view.
+INSERT INTO PriceBar (
+    SecurityMetaDataID,
+    SampleTime,
+    OpenPrice,
+    HighPrice,
+    LowPrice,
+    ClosePrice,
+    AdjustedClosePrice,
+    Volume)
+SELECT
+    dspo.SecurityMetaDataID,
+    dspo.SampleTime,
+    dspo.OpenPrice,
+    dspo.HighPrice,
+    dspo.LowPrice,
+    dspo.ClosePrice,
+    dspo.AdjustedClosePrice,
+    ROUND(dspo.Volume)
+FROM
+    DataSourcePriceObservation AS dspo;
+
+INSERT INTO CorporateAction (
+    SecurityMetaDataID,
+    SampleTime,
+    DividendAmount,
+    SplitCoefficient)
+SELECT
+    dspo.SecurityMetaDataID,
+    dspo.SampleTime,
+    dspo.DividendAmount,
+    dspo.SplitCoefficient
+FROM
+    DataSourcePriceObservation AS dspo
+WHERE
+    COALESCE(dspo.DividendAmount, 0) <> 0
+    OR
+    COALESCE(dspo.SplitCoefficient, 1) <> 1;
+
+DROP TABLE DataSourcePriceObservation;
+
+CREATE VIEW DataSourcePriceObservation AS
+SELECT
+    NULL AS DataSourcePriceObservationID,
+    pb.SampleTime,
+    pb.OpenPrice,
+    pb.HighPrice,
+    pb.LowPrice,
+    pb.ClosePrice,
+    pb.AdjustedClosePrice,
+    pb.Volume,
+    ca.DividendAmount,
+    ca.SplitCoefficient,
+    NULL AS OpenInterest,
+    smd.DataSourceID,
+    pb.SecurityMetaDataID
+FROM
+    PriceBar AS pb
+JOIN
+    SecurityMetaData AS smd ON smd.SecurityMetaDataID=pb.SecurityMetaDataID
+LEFT JOIN
+    CorporateAction AS ca ON ca.SecurityMetaDataID=pb.SecurityMetaDataID AND ca.SampleTime=pb.SampleTime;
@@ -1,4 +1,14 @@
 -- First drop any existing tables. Order matters because of foreign key dependencies!
+DROP TABLE IF EXISTS DataGeneration;
+DROP TABLE IF EXISTS SymbolSyncStaging;
+DROP TABLE IF EXISTS AdjustmentFactorStaging;
+DROP TABLE IF EXISTS TickerLease;
+DROP TABLE IF EXISTS MonthEndCalendar;
+DROP TABLE IF EXISTS PriceRollup;
+DROP TABLE IF EXISTS TradingSession;
+DROP TABLE IF EXISTS SecurityPriceSummary;
+DROP TABLE IF EXISTS CorporateAction;
+DROP TABLE IF EXISTS PriceBar;
 DROP TABLE IF EXISTS DataSourcePriceObservation;
 DROP TABLE IF EXISTS SecurityMetadata;
 DROP TABLE IF EXISTS DataSource;
@@ -27,9 +37,13 @@ CREATE TABLE SecurityMetaData (
 );
 
 -- Table that stores individual observations of data for each security.
+-- Rows are clustered on (SecurityMetaDataID, SampleTime): every lookup reads one symbol over a time range, and
+-- the key guarantees a bar is only stored once (writers use INSERT ... ON DUPLICATE KEY UPDATE).
+-- DataSourceID and SecurityMetaDataID carry no REFERENCES clauses: MariaDB 10.5+ turns those into foreign keys,
+-- which partitioned InnoDB tables cannot have (see PARTITIONS_INTRADAY.sql).
 CREATE TABLE DataSourcePriceObservation (
     -- required fields:
-    DataSourcePriceObservationID INT AUTO_INCREMENT PRIMARY KEY NOT NULL,
+    DataSourcePriceObservationID INT AUTO_INCREMENT NOT NULL,
     SampleTime DATETIME NOT NULL,
     OpenPrice FLOAT,
     HighPrice FLOAT,
@@ -41,11 +55,102 @@ CREATE TABLE DataSourcePriceObservation (
     DividendAmount FLOAT,
     SplitCoefficient FLOAT,
     OpenInterest FLOAT,
-    -- foreign keys:
-    DataSourceID INT REFERENCES DataSource(DataSourceID),
-    SecurityMetaDataID INT REFERENCES SecurityMetaData(SecurityMetaDataID)
+    -- references DataSource and SecurityMetaData:
+    DataSourceID INT,
+    SecurityMetaDataID INT NOT NULL,
+    -- keys:
+    PRIMARY KEY (SecurityMetaDataID, SampleTime),
+    KEY PriceObservationIDIndex (DataSourcePriceObservationID)
 );
 
+-- Summary of each security's observations (first/last sample, row count and latest close). It is maintained by
+-- RefreshPriceSummaries in the same transaction as every price insert, so reports can read it in O(symbols).
+CREATE TABLE SecurityPriceSummary (
+    SecurityMetaDataID INT PRIMARY KEY NOT NULL REFERENCES SecurityMetaData(SecurityMetaDataID),
+    FirstSampleTime DATETIME,
+    LastSampleTime DATETIME,
+    ObservationCount INT NOT NULL DEFAULT 0,
+    LastClosePrice FLOAT,
+    LastAdjustedClosePrice FLOAT,
+    KEY LastSampleTimeIndex (LastSampleTime)
+);
+
+-- OHLCV bars of IntervalMinutes (15, 60, 1440 for whole sessions) built from the regular-hours intraday bars in
+-- DataSourcePriceObservation. Buckets are cut from each TradingSession's open (see GetRollupBucketStart()), and
+-- RefreshPriceRollups recomputes only the buckets a write touched, in the same transaction.
+CREATE TABLE PriceRollup (
+    SecurityMetaDataID INT NOT NULL REFERENCES SecurityMetaData(SecurityMetaDataID),
+    IntervalMinutes INT NOT NULL,
+    BucketStart DATETIME NOT NULL,
+    OpenPrice FLOAT,
+    HighPrice FLOAT,
+    LowPrice FLOAT,
+    ClosePrice FLOAT,
+    Volume DOUBLE,
+    BarCount INT NOT NULL,
+    FirstSampleTime DATETIME NOT NULL,
+    LastSampleTime DATETIME NOT NULL,
+    PRIMARY KEY (SecurityMetaDataID, IntervalMinutes, BucketStart)
+);
+
+-- Regular-hours open and close (exchange time) of every NYSE session, early closes included, which bucket the
+-- rollups. Filled by the updater from its exchange calendar (updater.store_trading_sessions()).
+CREATE TABLE TradingSession (
+    SessionDate DATE PRIMARY KEY NOT NULL,
+    OpenTime DATETIME NOT NULL,
+    CloseTime DATETIME NOT NULL
+);
+
+-- The last SampleTime of each calendar month across all securities, also maintained by RefreshPriceSummaries.
+CREATE TABLE MonthEndCalendar (
+    MonthStart DATE PRIMARY KEY NOT NULL,
+    SampleTime DATETIME NOT NULL
+);
+
+-- Work queue shared by updater processes running with --leases: one row per (run, ticker), leased to one
+-- process at a time until LeaseExpires.
+CREATE TABLE TickerLease (
+    RunID VARCHAR(100) NOT NULL,
+    SecuritySymbol VARCHAR(50) NOT NULL,
+    State VARCHAR(10) NOT NULL,
+    Owner VARCHAR(100),
+    LeaseExpires DATETIME,
+    Attempts INT NOT NULL DEFAULT 0,
+    NextEligible DATETIME NOT NULL,
+    LastError VARCHAR(1000),
+    Updated DATETIME NOT NULL,
+    PRIMARY KEY (RunID, SecuritySymbol),
+    KEY ClaimIndex (RunID, State, NextEligible)
+);
+
+-- Scratch space for ApplyAdjustmentFactors: runs of bars sharing one backward adjustment factor, staged by the
+-- updater after a split or dividend and cleared again by the procedure.
+CREATE TABLE AdjustmentFactorStaging (
+    SecurityMetaDataID INT NOT NULL,
+    FromTime DATETIME NOT NULL,
+    ToTime DATETIME NOT NULL,
+    Factor DOUBLE NOT NULL,
+    PRIMARY KEY (SecurityMetaDataID, FromTime)
+);
+
+-- Scratch space for SyncSymbols: the symbols an updater connection (CONNECTION_ID()) is about to add or remove.
+CREATE TABLE SymbolSyncStaging (
+    ConnectionID BIGINT UNSIGNED NOT NULL,
+    SecuritySymbol VARCHAR(50) NOT NULL,
+    Action VARCHAR(10) NOT NULL,
+    DataSourceID INT,
+    PRIMARY KEY (ConnectionID, SecuritySymbol)
+);
+
+-- Data generation counter: one row whose Generation the updater increments (BumpDataGeneration) in every
+-- transaction that changes prices or symbols, so clients caching query results know when they went stale.
+CREATE TABLE DataGeneration (
+    DataGenerationID TINYINT NOT NULL PRIMARY KEY,
+    Generation BIGINT UNSIGNED NOT NULL,
+    Updated DATETIME NOT NULL
+);
+
+INSERT INTO DataGeneration VALUES (1, 0, NOW());
 
 -- Index between MetaData ID and Symbol
 -- DROP INDEX MetaDataIDAndSymbolIndex ON SecurityMetaData;
@@ -55,3 +160,8 @@ CREATE UNIQUE INDEX
 ON
     SecurityMetaData (SecurityMetaDataID, SecuritySymbol);
 
+-- Symbol lookups (GetMetaDataIDForSymbol) are by SecuritySymbol alone.
+CREATE UNIQUE INDEX
+    SymbolIndex
+ON
+    SecurityMetaData (SecuritySymbol);
@@ -49,9 +49,9 @@ NOT DETERMINISTIC READS SQL DATA
 BEGIN
     DECLARE ANSWER DATETIME;
     SELECT
-        MAX(SampleTime) INTO ANSWER
+        LastSampleTime INTO ANSWER
     FROM
-        DataSourcePriceObservation
+        SecurityPriceSummary
 	WHERE
 		SecurityMetaDataID=GetMetaDataIDForSymbol(symbol);
     RETURN ANSWER;
@@ -131,26 +131,34 @@ BEGIN
 END $$
 DELIMITER ;
 
--- Get the average adjusted closing price for @symbol over the last @length periods.
+-- Get the average adjusted closing price for @symbol over the last @length periods (bars with an adjusted close).
+-- Reads only those bars, backwards along the primary key, rather than the symbol's whole history.
 DROP FUNCTION IF EXISTS GetAvgPrice;
 
 DELIMITER $$
 CREATE FUNCTION GetAvgPrice(
     _symbol VARCHAR(30),
     _length INT)
-RETURNS FLOAT
+RETURNS DOUBLE
 NOT DETERMINISTIC READS SQL DATA
 BEGIN
-    DECLARE answer FLOAT;
+    DECLARE answer DOUBLE;
+    DECLARE SecurityID INT;
+    SET SecurityID=GetMetaDataIDForSymbol(_symbol);
     SELECT
-        AVG(AdjustedClosePrice) INTO answer
-    FROM
-        DataSourcePriceObservation
-    WHERE
-        SecurityMetaDataID=GetMetaDataIDForSymbol(_symbol)
-    ORDER BY
-        SampleTime DESC
-    LIMIT _length;
+        AVG(recent.AdjustedClosePrice) INTO answer
+    FROM (
+        SELECT
+            AdjustedClosePrice
+        FROM
+            DataSourcePriceObservation
+        WHERE
+            SecurityMetaDataID=SecurityID
+            AND
+            AdjustedClosePrice IS NOT NULL
+        ORDER BY
+            SampleTime DESC
+        LIMIT _length) AS recent;
     RETURN answer;
 END $$
 DELIMITER ;
@@ -175,7 +183,9 @@ BEGIN
 	FROM
 		DataSourcePriceObservation
 	WHERE
-		YEAR(Sampletime) = refyear
+		SampleTime >= MAKEDATE(refyear, 1)
+        AND
+		SampleTime < MAKEDATE(refyear + 1, 1)
         AND
 		SecurityMetaDataID=GetMetaDataIDForSymbol(symbol)
         AND
@@ -201,6 +211,88 @@ BEGIN
 END $$
 DELIMITER ;
 
+-- Storage layout of the price data: 'STANDARD' (the DataSourcePriceObservation table of CREATES.sql), or
+-- 'COMPACT_DAILY' / 'COMPACT_INTRADAY' (PriceBar and CorporateAction behind a DataSourcePriceObservation view, see
+-- COMPACT_DAILY.sql and COMPACT_INTRADAY.sql). Procedures that write prices branch on it.
+DROP FUNCTION IF EXISTS GetPriceLayout;
+
+DELIMITER $$
+CREATE FUNCTION GetPriceLayout()
+RETURNS VARCHAR(20)
+NOT DETERMINISTIC READS SQL DATA
+BEGIN
+    DECLARE answer VARCHAR(20);
+    SELECT
+        CASE
+            WHEN COUNT(*)=0 THEN 'STANDARD'
+            WHEN SUM(COLUMN_NAME='AdjustedClosePrice') > 0 THEN 'COMPACT_DAILY'
+            ELSE 'COMPACT_INTRADAY'
+        END INTO answer
+    FROM
+        information_schema.COLUMNS
+    WHERE
+        TABLE_SCHEMA=DATABASE()
+        AND
+        TABLE_NAME='PriceBar';
+    RETURN answer;
+END $$
+DELIMITER ;
+
+-- Start of the PriceRollup bucket of _IntervalMinutes that a bar stamped _SampleTime belongs to. Buckets cover the
+-- regular-hours NYSE session of the bar's day only (TradingSession, filled by the updater from its exchange calendar):
+-- intraday buckets are whole intervals counted from the session open, and daily (1440 minute) buckets start at the
+-- session date. Pre- and post-market bars and bars on holidays belong to no bucket (NULL).
+DROP FUNCTION IF EXISTS GetRollupBucketStart;
+
+DELIMITER $$
+CREATE FUNCTION GetRollupBucketStart(
+    _SampleTime DATETIME,
+    _IntervalMinutes INT)
+RETURNS DATETIME
+NOT DETERMINISTIC READS SQL DATA
+BEGIN
+    DECLARE _OpenTime DATETIME;
+
+    SET _OpenTime=(
+        SELECT
+            OpenTime
+        FROM
+            TradingSession
+        WHERE
+            SessionDate=DATE(_SampleTime)
+            AND
+            _SampleTime >= OpenTime
+            AND
+            _SampleTime < CloseTime);
+    IF _OpenTime IS NULL OR _IntervalMinutes >= 1440
+    THEN
+        RETURN IF(_OpenTime IS NULL, NULL, DATE(_SampleTime));
+    END IF;
+    RETURN DATE_ADD(
+        _OpenTime,
+        INTERVAL TIMESTAMPDIFF(MINUTE, _OpenTime, _SampleTime) DIV _IntervalMinutes * _IntervalMinutes MINUTE);
+END $$
+DELIMITER ;
+
+-- Current value of the DataGeneration counter, which changes whenever an update commits new data.
+DROP FUNCTION IF EXISTS GetDataGeneration;
+
+DELIMITER $$
+CREATE FUNCTION GetDataGeneration()
+RETURNS BIGINT UNSIGNED
+NOT DETERMINISTIC READS SQL DATA
+BEGIN
+    DECLARE answer BIGINT UNSIGNED;
+    SELECT
+        Generation INTO answer
+    FROM
+        DataGeneration
+    WHERE
+        DataGenerationID=1;
+    RETURN answer;
+END $$
+DELIMITER ;
+
 -- Get DataSourceID associated with DataSourceName
 DROP FUNCTION IF EXISTS GetDataSourceIDFromDataSourceName;
 
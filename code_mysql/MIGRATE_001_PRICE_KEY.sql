@@ -0,0 +1,84 @@
+-- Rebuild DataSourcePriceObservation of an existing database in place so it matches CREATES.sql:
+-- a clustered PRIMARY KEY (SecurityMetaDataID, SampleTime) instead of the surrogate DataSourcePriceObservationID.
+-- Duplicate bars are removed first, keeping the first one inserted. Running it again is a no-op.
+DROP PROCEDURE IF EXISTS MigratePriceObservationKey;
+
+DELIMITER $$
+CREATE PROCEDURE MigratePriceObservationKey()
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    -- A compact database (COMPACT_DAILY.sql / COMPACT_INTRADAY.sql) has a view by that name, keyed already.
+    IF EXISTS (
+            SELECT
+                1
+            FROM
+                information_schema.TABLES
+            WHERE
+                TABLE_SCHEMA=DATABASE()
+                AND
+                TABLE_NAME='DataSourcePriceObservation'
+                AND
+                TABLE_TYPE='BASE TABLE')
+        AND NOT EXISTS (
+            SELECT
+                1
+            FROM
+                information_schema.KEY_COLUMN_USAGE
+            WHERE
+                TABLE_SCHEMA=DATABASE()
+                AND
+                TABLE_NAME='DataSourcePriceObservation'
+                AND
+                CONSTRAINT_NAME='PRIMARY'
+                AND
+                COLUMN_NAME='SampleTime')
+    THEN
+        BEGIN
+            -- Rows that never resolved to a symbol can't be keyed.
+            DELETE FROM
+                DataSourcePriceObservation
+            WHERE
+                SecurityMetaDataID IS NULL;
+
+            -- Temporary index so the duplicate search below isn't a nested full scan.
+            ALTER TABLE DataSourcePriceObservation
+                ADD INDEX MigrateSymbolTimeIndex (SecurityMetaDataID, SampleTime);
+
+            DELETE
+                newer
+            FROM
+                DataSourcePriceObservation AS newer
+            JOIN
+                DataSourcePriceObservation AS older
+                ON newer.SecurityMetaDataID=older.SecurityMetaDataID
+                AND newer.SampleTime=older.SampleTime
+                AND newer.DataSourcePriceObservationID > older.DataSourcePriceObservationID;
+
+            ALTER TABLE DataSourcePriceObservation
+                DROP INDEX MigrateSymbolTimeIndex,
+                DROP PRIMARY KEY,
+                MODIFY SecurityMetaDataID INT NOT NULL,
+                ADD PRIMARY KEY (SecurityMetaDataID, SampleTime),
+                ADD KEY PriceObservationIDIndex (DataSourcePriceObservationID);
+        END;
+    END IF;
+
+    IF NOT EXISTS (
+            SELECT
+                1
+            FROM
+                information_schema.STATISTICS
+            WHERE
+                TABLE_SCHEMA=DATABASE()
+                AND
+                TABLE_NAME='SecurityMetaData'
+                AND
+                INDEX_NAME='SymbolIndex')
+    THEN
+        CREATE UNIQUE INDEX SymbolIndex ON SecurityMetaData (SecuritySymbol);
+    END IF;
+END $$
+DELIMITER ;
+
+CALL MigratePriceObservationKey();
+DROP PROCEDURE MigratePriceObservationKey;
@@ -0,0 +1,93 @@
+-- Add SecurityPriceSummary and MonthEndCalendar (see CREATES.sql) to an existing database and backfill them with
+-- one pass over DataSourcePriceObservation. The updater keeps them current from then on. Running it again is a no-op.
+DROP PROCEDURE IF EXISTS MigratePriceSummaries;
+
+DELIMITER $$
+CREATE PROCEDURE MigratePriceSummaries()
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    IF NOT EXISTS (
+            SELECT
+                1
+            FROM
+                information_schema.TABLES
+            WHERE
+                TABLE_SCHEMA=DATABASE()
+                AND
+                TABLE_NAME='SecurityPriceSummary')
+    THEN
+        BEGIN
+            CREATE TABLE SecurityPriceSummary (
+                SecurityMetaDataID INT PRIMARY KEY NOT NULL REFERENCES SecurityMetaData(SecurityMetaDataID),
+                FirstSampleTime DATETIME,
+                LastSampleTime DATETIME,
+                ObservationCount INT NOT NULL DEFAULT 0,
+                LastClosePrice FLOAT,
+                LastAdjustedClosePrice FLOAT,
+                KEY LastSampleTimeIndex (LastSampleTime)
+            );
+
+            INSERT INTO SecurityPriceSummary (
+                SecurityMetaDataID,
+                FirstSampleTime,
+                LastSampleTime,
+                ObservationCount,
+                LastClosePrice,
+                LastAdjustedClosePrice)
+            SELECT
+                summary.SecurityMetaDataID,
+                summary.FirstSampleTime,
+                summary.LastSampleTime,
+                summary.ObservationCount,
+                dspo.ClosePrice,
+                dspo.AdjustedClosePrice
+            FROM (
+                SELECT
+                    SecurityMetaDataID,
+                    MIN(SampleTime) AS FirstSampleTime,
+                    MAX(SampleTime) AS LastSampleTime,
+                    COUNT(*) AS ObservationCount
+                FROM
+                    DataSourcePriceObservation
+                GROUP BY
+                    SecurityMetaDataID) AS summary
+            JOIN
+                DataSourcePriceObservation AS dspo
+                ON dspo.SecurityMetaDataID=summary.SecurityMetaDataID
+                AND dspo.SampleTime=summary.LastSampleTime;
+        END;
+    END IF;
+
+    IF NOT EXISTS (
+            SELECT
+                1
+            FROM
+                information_schema.TABLES
+            WHERE
+                TABLE_SCHEMA=DATABASE()
+                AND
+                TABLE_NAME='MonthEndCalendar')
+    THEN
+        BEGIN
+            CREATE TABLE MonthEndCalendar (
+                MonthStart DATE PRIMARY KEY NOT NULL,
+                SampleTime DATETIME NOT NULL
+            );
+
+            INSERT INTO MonthEndCalendar (
+                MonthStart,
+                SampleTime)
+            SELECT
+                DATE_FORMAT(SampleTime, '%Y-%m-01') AS MonthStart,
+                MAX(SampleTime)
+            FROM
+                DataSourcePriceObservation
+            GROUP BY
+                MonthStart;
+        END;
+    END IF;
+END $$
+DELIMITER ;
+
+CALL MigratePriceSummaries();
+DROP PROCEDURE MigratePriceSummaries;
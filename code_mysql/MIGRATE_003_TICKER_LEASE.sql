@@ -0,0 +1,15 @@
+-- Add the TickerLease table (see CREATES.sql) used by updater processes running with --leases.
+-- Running it again is a no-op.
+CREATE TABLE IF NOT EXISTS TickerLease (
+    RunID VARCHAR(100) NOT NULL,
+    SecuritySymbol VARCHAR(50) NOT NULL,
+    State VARCHAR(10) NOT NULL,
+    Owner VARCHAR(100),
+    LeaseExpires DATETIME,
+    Attempts INT NOT NULL DEFAULT 0,
+    NextEligible DATETIME NOT NULL,
+    LastError VARCHAR(1000),
+    Updated DATETIME NOT NULL,
+    PRIMARY KEY (RunID, SecuritySymbol),
+    KEY ClaimIndex (RunID, State, NextEligible)
+);
@@ -0,0 +1,9 @@
+-- Add the AdjustmentFactorStaging table (see CREATES.sql) used by ApplyAdjustmentFactors to re-adjust stored
+-- history after splits and dividends. Running it again is a no-op.
+CREATE TABLE IF NOT EXISTS AdjustmentFactorStaging (
+    SecurityMetaDataID INT NOT NULL,
+    FromTime DATETIME NOT NULL,
+    ToTime DATETIME NOT NULL,
+    Factor DOUBLE NOT NULL,
+    PRIMARY KEY (SecurityMetaDataID, FromTime)
+);
@@ -0,0 +1,9 @@
+-- Add the SymbolSyncStaging table (see CREATES.sql) used by SyncSymbols to add and remove symbols in bulk.
+-- Running it again is a no-op.
+CREATE TABLE IF NOT EXISTS SymbolSyncStaging (
+    ConnectionID BIGINT UNSIGNED NOT NULL,
+    SecuritySymbol VARCHAR(50) NOT NULL,
+    Action VARCHAR(10) NOT NULL,
+    DataSourceID INT,
+    PRIMARY KEY (ConnectionID, SecuritySymbol)
+);
@@ -0,0 +1,23 @@
+-- Add the PriceRollup and TradingSession tables (see CREATES.sql). They start out empty: fill them with
+-- "python updater.py --intraday --rebuild-rollups" once the functions and stored procedures are recreated. Running
+-- it again is a no-op.
+CREATE TABLE IF NOT EXISTS PriceRollup (
+    SecurityMetaDataID INT NOT NULL REFERENCES SecurityMetaData(SecurityMetaDataID),
+    IntervalMinutes INT NOT NULL,
+    BucketStart DATETIME NOT NULL,
+    OpenPrice FLOAT,
+    HighPrice FLOAT,
+    LowPrice FLOAT,
+    ClosePrice FLOAT,
+    Volume DOUBLE,
+    BarCount INT NOT NULL,
+    FirstSampleTime DATETIME NOT NULL,
+    LastSampleTime DATETIME NOT NULL,
+    PRIMARY KEY (SecurityMetaDataID, IntervalMinutes, BucketStart)
+);
+
+CREATE TABLE IF NOT EXISTS TradingSession (
+    SessionDate DATE PRIMARY KEY NOT NULL,
+    OpenTime DATETIME NOT NULL,
+    CloseTime DATETIME NOT NULL
+);
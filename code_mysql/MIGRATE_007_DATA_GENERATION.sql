@@ -0,0 +1,9 @@
+-- Add the DataGeneration counter (see CREATES.sql), which the updater bumps on every commit that changes data and
+-- updater.QueryCache reads to invalidate cached report results. Running it again is a no-op.
+CREATE TABLE IF NOT EXISTS DataGeneration (
+    DataGenerationID TINYINT NOT NULL PRIMARY KEY,
+    Generation BIGINT UNSIGNED NOT NULL,
+    Updated DATETIME NOT NULL
+);
+
+INSERT IGNORE INTO DataGeneration VALUES (1, 0, NOW());
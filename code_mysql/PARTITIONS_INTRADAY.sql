@@ -0,0 +1,46 @@
+-- Optional RANGE partitioning of DataSourcePriceObservation by SampleTime, used for the intraday database.
+-- Each year of bars lives in its own partition, so time-bounded scans only touch the years they need and old
+-- years can be archived with ALTER TABLE ... DROP PARTITION. Safe to run on a new or migrated table, since the
+-- partitioning column is part of the primary key. Extend the list (REORGANIZE PARTITION pmax) as years pass.
+-- Partitioned InnoDB tables cannot have foreign keys: on MariaDB, drop any that an older CREATES.sql left on the
+-- table (SHOW CREATE TABLE DataSourcePriceObservation) before running this.
+ALTER TABLE DataSourcePriceObservation
+PARTITION BY RANGE COLUMNS(SampleTime) (
+    PARTITION p2000 VALUES LESS THAN ('2001-01-01'),
+    PARTITION p2001 VALUES LESS THAN ('2002-01-01'),
+    PARTITION p2002 VALUES LESS THAN ('2003-01-01'),
+    PARTITION p2003 VALUES LESS THAN ('2004-01-01'),
+    PARTITION p2004 VALUES LESS THAN ('2005-01-01'),
+    PARTITION p2005 VALUES LESS THAN ('2006-01-01'),
+    PARTITION p2006 VALUES LESS THAN ('2007-01-01'),
+    PARTITION p2007 VALUES LESS THAN ('2008-01-01'),
+    PARTITION p2008 VALUES LESS THAN ('2009-01-01'),
+    PARTITION p2009 VALUES LESS THAN ('2010-01-01'),
+    PARTITION p2010 VALUES LESS THAN ('2011-01-01'),
+    PARTITION p2011 VALUES LESS THAN ('2012-01-01'),
+    PARTITION p2012 VALUES LESS THAN ('2013-01-01'),
+    PARTITION p2013 VALUES LESS THAN ('2014-01-01'),
+    PARTITION p2014 VALUES LESS THAN ('2015-01-01'),
+    PARTITION p2015 VALUES LESS THAN ('2016-01-01'),
+    PARTITION p2016 VALUES LESS THAN ('2017-01-01'),
+    PARTITION p2017 VALUES LESS THAN ('2018-01-01'),
+    PARTITION p2018 VALUES LESS THAN ('2019-01-01'),
+    PARTITION p2019 VALUES LESS THAN ('2020-01-01'),
+    PARTITION p2020 VALUES LESS THAN ('2021-01-01'),
+    PARTITION p2021 VALUES LESS THAN ('2022-01-01'),
+    PARTITION p2022 VALUES LESS THAN ('2023-01-01'),
+    PARTITION p2023 VALUES LESS THAN ('2024-01-01'),
+    PARTITION p2024 VALUES LESS THAN ('2025-01-01'),
+    PARTITION p2025 VALUES LESS THAN ('2026-01-01'),
+    PARTITION p2026 VALUES LESS THAN ('2027-01-01'),
+    PARTITION p2027 VALUES LESS THAN ('2028-01-01'),
+    PARTITION p2028 VALUES LESS THAN ('2029-01-01'),
+    PARTITION p2029 VALUES LESS THAN ('2030-01-01'),
+    PARTITION p2030 VALUES LESS THAN ('2031-01-01'),
+    PARTITION p2031 VALUES LESS THAN ('2032-01-01'),
+    PARTITION p2032 VALUES LESS THAN ('2033-01-01'),
+    PARTITION p2033 VALUES LESS THAN ('2034-01-01'),
+    PARTITION p2034 VALUES LESS THAN ('2035-01-01'),
+    PARTITION p2035 VALUES LESS THAN ('2036-01-01'),
+    PARTITION pmax VALUES LESS THAN (MAXVALUE)
+);
@@ -27,6 +27,424 @@ BEGIN
 END $$
 DELIMITER ;
 
+-- Increment the DataGeneration counter. The updater calls it right before committing a transaction that changed
+-- prices or symbols, so the new generation becomes visible together with the data.
+DROP PROCEDURE IF EXISTS BumpDataGeneration;
+
+DELIMITER $$
+CREATE PROCEDURE BumpDataGeneration ()
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    UPDATE
+        DataGeneration
+    SET
+        Generation=Generation + 1,
+        Updated=NOW()
+    WHERE
+        DataGenerationID=1;
+END $$
+DELIMITER ;
+
+-- Create (if needed) and empty this session's PriceObservationStaging, a temporary table with the columns the
+-- updater writes. Prices for the compact layouts are inserted there and moved into place by MergePriceObservations.
+DROP PROCEDURE IF EXISTS PreparePriceObservationStaging;
+
+DELIMITER $$
+CREATE PROCEDURE PreparePriceObservationStaging ()
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    CREATE TEMPORARY TABLE IF NOT EXISTS PriceObservationStaging (
+        SampleTime DATETIME NOT NULL,
+        OpenPrice FLOAT,
+        HighPrice FLOAT,
+        LowPrice FLOAT,
+        ClosePrice FLOAT,
+        AdjustedClosePrice FLOAT,
+        Volume DOUBLE,
+        DividendAmount FLOAT,
+        SplitCoefficient FLOAT,
+        DataSourceID INT,
+        SecurityMetaDataID INT NOT NULL,
+        PRIMARY KEY (SecurityMetaDataID, SampleTime));
+
+    DELETE FROM PriceObservationStaging;
+END $$
+DELIMITER ;
+
+-- Upsert the rows in this session's PriceObservationStaging into the price tables of whichever layout the database
+-- uses (see GetPriceLayout()), then empty it. In the compact layouts the bars go to PriceBar, and their splits and
+-- dividends replace those stored in CorporateAction. Call it in the same transaction as the staging insert.
+DROP PROCEDURE IF EXISTS MergePriceObservations;
+
+DELIMITER $$
+CREATE PROCEDURE MergePriceObservations ()
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    DECLARE Layout VARCHAR(20);
+    SET Layout=GetPriceLayout();
+
+    IF Layout='STANDARD'
+    THEN
+        INSERT INTO DataSourcePriceObservation (
+            SampleTime,
+            OpenPrice,
+            HighPrice,
+            LowPrice,
+            ClosePrice,
+            AdjustedClosePrice,
+            Volume,
+            DividendAmount,
+            SplitCoefficient,
+            DataSourceID,
+            SecurityMetaDataID)
+        SELECT
+            SampleTime,
+            OpenPrice,
+            HighPrice,
+            LowPrice,
+            ClosePrice,
+            AdjustedClosePrice,
+            Volume,
+            DividendAmount,
+            SplitCoefficient,
+            DataSourceID,
+            SecurityMetaDataID
+        FROM
+            PriceObservationStaging
+        ON DUPLICATE KEY UPDATE
+            OpenPrice=VALUES(OpenPrice),
+            HighPrice=VALUES(HighPrice),
+            LowPrice=VALUES(LowPrice),
+            ClosePrice=VALUES(ClosePrice),
+            AdjustedClosePrice=VALUES(AdjustedClosePrice),
+            Volume=VALUES(Volume),
+            DividendAmount=VALUES(DividendAmount),
+            SplitCoefficient=VALUES(SplitCoefficient),
+            DataSourceID=VALUES(DataSourceID);
+    ELSE
+        BEGIN
+            IF Layout='COMPACT_DAILY'
+            THEN
+                INSERT INTO PriceBar (
+                    SecurityMetaDataID,
+                    SampleTime,
+                    OpenPrice,
+                    HighPrice,
+                    LowPrice,
+                    ClosePrice,
+                    AdjustedClosePrice,
+                    Volume)
+                SELECT
+                    SecurityMetaDataID,
+                    DATE(SampleTime),
+                    OpenPrice,
+                    HighPrice,
+                    LowPrice,
+                    ClosePrice,
+                    AdjustedClosePrice,
+                    ROUND(Volume)
+                FROM
+                    PriceObservationStaging
+                ON DUPLICATE KEY UPDATE
+                    OpenPrice=VALUES(OpenPrice),
+                    HighPrice=VALUES(HighPrice),
+                    LowPrice=VALUES(LowPrice),
+                    ClosePrice=VALUES(ClosePrice),
+                    AdjustedClosePrice=VALUES(AdjustedClosePrice),
+                    Volume=VALUES(Volume);
+            ELSE
+                INSERT INTO PriceBar (
+                    SecurityMetaDataID,
+                    SampleTime,
+                    OpenPrice,
+                    HighPrice,
+                    LowPrice,
+                    ClosePrice,
+                    Volume)
+                SELECT
+                    SecurityMetaDataID,
+                    SampleTime,
+                    OpenPrice,
+                    HighPrice,
+                    LowPrice,
+                    ClosePrice,
+                    ROUND(Volume)
+                FROM
+                    PriceObservationStaging
+                ON DUPLICATE KEY UPDATE
+                    OpenPrice=VALUES(OpenPrice),
+                    HighPrice=VALUES(HighPrice),
+                    LowPrice=VALUES(LowPrice),
+                    ClosePrice=VALUES(ClosePrice),
+                    Volume=VALUES(Volume);
+            END IF;
+
+            DELETE
+                ca
+            FROM
+                CorporateAction AS ca
+            JOIN
+                PriceObservationStaging AS pos
+                ON pos.SecurityMetaDataID=ca.SecurityMetaDataID
+                AND pos.SampleTime=ca.SampleTime;
+
+            INSERT INTO CorporateAction (
+                SecurityMetaDataID,
+                SampleTime,
+                DividendAmount,
+                SplitCoefficient)
+            SELECT
+                SecurityMetaDataID,
+                SampleTime,
+                DividendAmount,
+                SplitCoefficient
+            FROM
+                PriceObservationStaging
+            WHERE
+                COALESCE(DividendAmount, 0) <> 0
+                OR
+                COALESCE(SplitCoefficient, 1) <> 1;
+        END;
+    END IF;
+
+    DELETE FROM PriceObservationStaging;
+END $$
+DELIMITER ;
+
+-- Delete every stored price of one security, whichever layout the database uses.
+DROP PROCEDURE IF EXISTS DeletePriceObservations;
+
+DELIMITER $$
+CREATE PROCEDURE DeletePriceObservations (
+    _SecurityMetaDataID INT)
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    IF GetPriceLayout()='STANDARD'
+    THEN
+        DELETE FROM
+            DataSourcePriceObservation
+        WHERE
+            SecurityMetaDataID=_SecurityMetaDataID;
+    ELSE
+        BEGIN
+            DELETE FROM
+                PriceBar
+            WHERE
+                SecurityMetaDataID=_SecurityMetaDataID;
+
+            DELETE FROM
+                CorporateAction
+            WHERE
+                SecurityMetaDataID=_SecurityMetaDataID;
+        END;
+    END IF;
+END $$
+DELIMITER ;
+
+-- Bring SecurityPriceSummary and MonthEndCalendar up to date after prices for one security were written between
+-- _FromTime and _ToTime. Only that window is read: _CountBefore is the number of rows it held before the write, so
+-- ObservationCount grows by the rows that were actually new. Call it in the same transaction as the insert.
+DROP PROCEDURE IF EXISTS RefreshPriceSummaries;
+
+DELIMITER $$
+CREATE PROCEDURE RefreshPriceSummaries (
+    _SecurityMetaDataID INT,
+    _FromTime DATETIME,
+    _ToTime DATETIME,
+    _CountBefore INT)
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    DECLARE WindowFirst DATETIME;
+    DECLARE WindowLast DATETIME;
+    DECLARE WindowCount INT;
+
+    SELECT
+        MIN(SampleTime),
+        MAX(SampleTime),
+        COUNT(*) INTO WindowFirst, WindowLast, WindowCount
+    FROM
+        DataSourcePriceObservation
+    WHERE
+        SecurityMetaDataID=_SecurityMetaDataID
+        AND
+        SampleTime BETWEEN _FromTime AND _ToTime;
+
+    IF WindowCount > 0
+    THEN
+        BEGIN
+            INSERT INTO SecurityPriceSummary (
+                SecurityMetaDataID,
+                FirstSampleTime,
+                LastSampleTime,
+                ObservationCount)
+            VALUES (
+                _SecurityMetaDataID,
+                WindowFirst,
+                WindowLast,
+                WindowCount - _CountBefore)
+            ON DUPLICATE KEY UPDATE
+                FirstSampleTime=LEAST(COALESCE(FirstSampleTime, VALUES(FirstSampleTime)), VALUES(FirstSampleTime)),
+                LastSampleTime=GREATEST(COALESCE(LastSampleTime, VALUES(LastSampleTime)), VALUES(LastSampleTime)),
+                ObservationCount=ObservationCount + VALUES(ObservationCount);
+
+            -- The latest bar may have been rewritten even if LastSampleTime didn't move, so always re-read it.
+            UPDATE
+                SecurityPriceSummary AS sps
+            JOIN
+                DataSourcePriceObservation AS dspo
+                ON dspo.SecurityMetaDataID=sps.SecurityMetaDataID
+                AND dspo.SampleTime=sps.LastSampleTime
+            SET
+                sps.LastClosePrice=dspo.ClosePrice,
+                sps.LastAdjustedClosePrice=dspo.AdjustedClosePrice
+            WHERE
+                sps.SecurityMetaDataID=_SecurityMetaDataID;
+
+            INSERT INTO MonthEndCalendar (
+                MonthStart,
+                SampleTime)
+            SELECT
+                MonthStart,
+                MonthEnd
+            FROM (
+                SELECT
+                    DATE_FORMAT(SampleTime, '%Y-%m-01') AS MonthStart,
+                    MAX(SampleTime) AS MonthEnd
+                FROM
+                    DataSourcePriceObservation
+                WHERE
+                    SecurityMetaDataID=_SecurityMetaDataID
+                    AND
+                    SampleTime BETWEEN _FromTime AND _ToTime
+                GROUP BY
+                    MonthStart) AS months
+            ON DUPLICATE KEY UPDATE
+                SampleTime=GREATEST(MonthEndCalendar.SampleTime, VALUES(SampleTime));
+        END;
+    END IF;
+END $$
+DELIMITER ;
+
+-- Rewrite AdjustedClosePrice for one security from the factor runs staged in AdjustmentFactorStaging, then clear
+-- them. Rows whose adjusted close already matches (to float precision) are left alone, so only the history before
+-- a new split or dividend is written. SecurityPriceSummary's latest adjusted close is re-read in case it changed.
+DROP PROCEDURE IF EXISTS ApplyAdjustmentFactors;
+
+DELIMITER $$
+CREATE PROCEDURE ApplyAdjustmentFactors (
+    _SecurityMetaDataID INT)
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    -- The compact intraday layout has no adjusted closes to maintain.
+    IF GetPriceLayout()='STANDARD'
+    THEN
+        UPDATE
+            DataSourcePriceObservation AS dspo
+        JOIN
+            AdjustmentFactorStaging AS afs
+            ON afs.SecurityMetaDataID=dspo.SecurityMetaDataID
+            AND dspo.SampleTime BETWEEN afs.FromTime AND afs.ToTime
+        SET
+            dspo.AdjustedClosePrice=dspo.ClosePrice * afs.Factor
+        WHERE
+            dspo.SecurityMetaDataID=_SecurityMetaDataID
+            AND
+            dspo.ClosePrice IS NOT NULL
+            AND (
+                dspo.AdjustedClosePrice IS NULL
+                OR
+                ABS(dspo.AdjustedClosePrice - dspo.ClosePrice * afs.Factor) > 1e-6 * ABS(dspo.ClosePrice));
+    ELSEIF GetPriceLayout()='COMPACT_DAILY'
+    THEN
+        UPDATE
+            PriceBar AS dspo
+        JOIN
+            AdjustmentFactorStaging AS afs
+            ON afs.SecurityMetaDataID=dspo.SecurityMetaDataID
+            AND dspo.SampleTime BETWEEN afs.FromTime AND afs.ToTime
+        SET
+            dspo.AdjustedClosePrice=dspo.ClosePrice * afs.Factor
+        WHERE
+            dspo.SecurityMetaDataID=_SecurityMetaDataID
+            AND
+            dspo.ClosePrice IS NOT NULL
+            AND (
+                dspo.AdjustedClosePrice IS NULL
+                OR
+                ABS(dspo.AdjustedClosePrice - dspo.ClosePrice * afs.Factor) > 1e-6 * ABS(dspo.ClosePrice));
+    END IF;
+
+    DELETE FROM
+        AdjustmentFactorStaging
+    WHERE
+        SecurityMetaDataID=_SecurityMetaDataID;
+
+    UPDATE
+        SecurityPriceSummary AS sps
+    JOIN
+        DataSourcePriceObservation AS dspo
+        ON dspo.SecurityMetaDataID=sps.SecurityMetaDataID
+        AND dspo.SampleTime=sps.LastSampleTime
+    SET
+        sps.LastAdjustedClosePrice=dspo.AdjustedClosePrice
+    WHERE
+        sps.SecurityMetaDataID=_SecurityMetaDataID;
+END $$
+DELIMITER ;
+
+-- Rebuild SecurityPriceSummary and MonthEndCalendar from scratch with one pass over DataSourcePriceObservation.
+-- Only needed to repair them, e.g. after prices were changed outside the updater or a symbol was deleted.
+DROP PROCEDURE IF EXISTS RebuildPriceSummaries;
+
+DELIMITER $$
+CREATE PROCEDURE RebuildPriceSummaries ()
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    DELETE FROM SecurityPriceSummary;
+    DELETE FROM MonthEndCalendar;
+
+    INSERT INTO SecurityPriceSummary (
+        SecurityMetaDataID,
+        FirstSampleTime,
+        LastSampleTime,
+        ObservationCount,
+        LastClosePrice,
+        LastAdjustedClosePrice)
+    SELECT
+        summary.SecurityMetaDataID,
+        summary.FirstSampleTime,
+        summary.LastSampleTime,
+        summary.ObservationCount,
+        dspo.ClosePrice,
+        dspo.AdjustedClosePrice
+    FROM (
+        SELECT
+            SecurityMetaDataID,
+            MIN(SampleTime) AS FirstSampleTime,
+            MAX(SampleTime) AS LastSampleTime,
+            COUNT(*) AS ObservationCount
+        FROM
+            DataSourcePriceObservation
+        GROUP BY
+            SecurityMetaDataID) AS summary
+    JOIN
+        DataSourcePriceObservation AS dspo
+        ON dspo.SecurityMetaDataID=summary.SecurityMetaDataID
+        AND dspo.SampleTime=summary.LastSampleTime;
+
+    INSERT INTO MonthEndCalendar (
+        MonthStart,
+        SampleTime)
+    SELECT
+        DATE_FORMAT(SampleTime, '%Y-%m-01') AS MonthStart,
+        MAX(SampleTime)
+    FROM
+        DataSourcePriceObservation
+    GROUP BY
+        MonthStart;
+END $$
+DELIMITER ;
+
 -- Insert a new row of price data. This makes the insertion easier to implement.
 DROP PROCEDURE IF EXISTS InsertSecurityPrices;
 
@@ -45,6 +463,9 @@ CREATE PROCEDURE InsertSecurityPrices (
     _DataSourceID INT)
 NOT DETERMINISTIC MODIFIES SQL DATA
 BEGIN
+    DECLARE SecurityID INT;
+    SET SecurityID=GetMetaDataIDForSymbol(_Symbol);
+
     -- Make sure the sample time doesn't already exist before inserting!
     IF NOT EXISTS (
             SELECT
@@ -52,12 +473,14 @@ BEGIN
             FROM
                 DataSourcePriceObservation
             WHERE
-                SecurityMetaDataID=GetMetaDataIDForSymbol(_Symbol)
+                SecurityMetaDataID=SecurityID
                 AND
                 SampleTime=_SampleTime)
     THEN
 		BEGIN
-	        INSERT INTO DataSourcePriceObservation (
+	        CALL PreparePriceObservationStaging();
+
+	        INSERT INTO PriceObservationStaging (
 	            SampleTime,
 	            OpenPrice,
 	            HighPrice,
@@ -80,12 +503,170 @@ BEGIN
 	            _DividendAmount,
 	            _SplitCoefficient,
 	            _DataSourceID,
-	            GetMetaDataIDForSymbol(_Symbol));
+	            SecurityID);
+
+	        CALL MergePriceObservations();
+
+	        CALL RefreshPriceSummaries(SecurityID, _SampleTime, _SampleTime, 0);
 	    END;
 	END IF;
 END $$
 DELIMITER ;
 
+-- Recompute the _IntervalMinutes bars of PriceRollup for one security after prices were written between _FromTime
+-- and _ToTime. Only the buckets overlapping that window are re-aggregated (open and close come from the first and
+-- last bar of each bucket). Buckets come from GetRollupBucketStart(): the regular-hours NYSE session of each day, cut
+-- into intervals from its open. Call it in the same transaction as the insert.
+DROP PROCEDURE IF EXISTS RefreshPriceRollups;
+
+DELIMITER $$
+CREATE PROCEDURE RefreshPriceRollups (
+    _SecurityMetaDataID INT,
+    _FromTime DATETIME,
+    _ToTime DATETIME,
+    _IntervalMinutes INT)
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    DECLARE BucketFrom DATETIME;
+    DECLARE BucketTo DATETIME;
+
+    -- No bucket spans two days, so the window's whole days cover every bucket it touches.
+    SET BucketFrom=DATE(_FromTime);
+    SET BucketTo=DATE_ADD(DATE(_ToTime), INTERVAL 1 DAY);
+
+    INSERT INTO PriceRollup (
+        SecurityMetaDataID,
+        IntervalMinutes,
+        BucketStart,
+        OpenPrice,
+        HighPrice,
+        LowPrice,
+        ClosePrice,
+        Volume,
+        BarCount,
+        FirstSampleTime,
+        LastSampleTime)
+    SELECT
+        buckets.SecurityMetaDataID,
+        _IntervalMinutes,
+        buckets.BucketStart,
+        first_bar.OpenPrice,
+        buckets.HighPrice,
+        buckets.LowPrice,
+        last_bar.ClosePrice,
+        buckets.Volume,
+        buckets.BarCount,
+        buckets.FirstSampleTime,
+        buckets.LastSampleTime
+    FROM (
+        SELECT
+            SecurityMetaDataID,
+            GetRollupBucketStart(SampleTime, _IntervalMinutes) AS BucketStart,
+            MAX(HighPrice) AS HighPrice,
+            MIN(LowPrice) AS LowPrice,
+            SUM(Volume) AS Volume,
+            COUNT(*) AS BarCount,
+            MIN(SampleTime) AS FirstSampleTime,
+            MAX(SampleTime) AS LastSampleTime
+        FROM
+            DataSourcePriceObservation
+        WHERE
+            SecurityMetaDataID=_SecurityMetaDataID
+            AND
+            SampleTime >= BucketFrom
+            AND
+            SampleTime < BucketTo
+        GROUP BY
+            SecurityMetaDataID,
+            BucketStart
+        HAVING
+            BucketStart IS NOT NULL) AS buckets
+    JOIN
+        DataSourcePriceObservation AS first_bar
+        ON first_bar.SecurityMetaDataID=buckets.SecurityMetaDataID
+        AND first_bar.SampleTime=buckets.FirstSampleTime
+    JOIN
+        DataSourcePriceObservation AS last_bar
+        ON last_bar.SecurityMetaDataID=buckets.SecurityMetaDataID
+        AND last_bar.SampleTime=buckets.LastSampleTime
+    ON DUPLICATE KEY UPDATE
+        OpenPrice=VALUES(OpenPrice),
+        HighPrice=VALUES(HighPrice),
+        LowPrice=VALUES(LowPrice),
+        ClosePrice=VALUES(ClosePrice),
+        Volume=VALUES(Volume),
+        BarCount=VALUES(BarCount),
+        FirstSampleTime=VALUES(FirstSampleTime),
+        LastSampleTime=VALUES(LastSampleTime);
+END $$
+DELIMITER ;
+
+-- Rebuild the _IntervalMinutes bars of PriceRollup for every security with one pass over
+-- DataSourcePriceObservation, e.g. to fill the table for an existing database.
+DROP PROCEDURE IF EXISTS RebuildPriceRollups;
+
+DELIMITER $$
+CREATE PROCEDURE RebuildPriceRollups (
+    _IntervalMinutes INT)
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    DELETE FROM
+        PriceRollup
+    WHERE
+        IntervalMinutes=_IntervalMinutes;
+
+    INSERT INTO PriceRollup (
+        SecurityMetaDataID,
+        IntervalMinutes,
+        BucketStart,
+        OpenPrice,
+        HighPrice,
+        LowPrice,
+        ClosePrice,
+        Volume,
+        BarCount,
+        FirstSampleTime,
+        LastSampleTime)
+    SELECT
+        buckets.SecurityMetaDataID,
+        _IntervalMinutes,
+        buckets.BucketStart,
+        first_bar.OpenPrice,
+        buckets.HighPrice,
+        buckets.LowPrice,
+        last_bar.ClosePrice,
+        buckets.Volume,
+        buckets.BarCount,
+        buckets.FirstSampleTime,
+        buckets.LastSampleTime
+    FROM (
+        SELECT
+            SecurityMetaDataID,
+            GetRollupBucketStart(SampleTime, _IntervalMinutes) AS BucketStart,
+            MAX(HighPrice) AS HighPrice,
+            MIN(LowPrice) AS LowPrice,
+            SUM(Volume) AS Volume,
+            COUNT(*) AS BarCount,
+            MIN(SampleTime) AS FirstSampleTime,
+            MAX(SampleTime) AS LastSampleTime
+        FROM
+            DataSourcePriceObservation
+        GROUP BY
+            SecurityMetaDataID,
+            BucketStart
+        HAVING
+            BucketStart IS NOT NULL) AS buckets
+    JOIN
+        DataSourcePriceObservation AS first_bar
+        ON first_bar.SecurityMetaDataID=buckets.SecurityMetaDataID
+        AND first_bar.SampleTime=buckets.FirstSampleTime
+    JOIN
+        DataSourcePriceObservation AS last_bar
+        ON last_bar.SecurityMetaDataID=buckets.SecurityMetaDataID
+        AND last_bar.SampleTime=buckets.LastSampleTime;
+END $$
+DELIMITER ;
+
 -- Add a new symbol to the database, assuming the data soure exists and the symbol does not.
 DROP PROCEDURE IF EXISTS AddNewSymbol;
 
@@ -145,8 +726,16 @@ BEGIN
 	WHERE
 		SecuritySymbol=_Symbol;
 
+    CALL DeletePriceObservations(SecurityID);
+
+    -- MonthEndCalendar is shared by all symbols and left as is; RebuildPriceSummaries() recomputes it if needed.
     DELETE FROM
-        DataSourcePriceObservation
+        SecurityPriceSummary
+    WHERE
+        SecurityMetaDataID=SecurityID;
+
+    DELETE FROM
+        PriceRollup
     WHERE
         SecurityMetaDataID=SecurityID;
 
@@ -158,6 +747,135 @@ END $$
 DELIMITER ;
 
 
+-- Add and remove the symbols this connection staged in SymbolSyncStaging (Action 'ADD' with a DataSourceID, or
+-- 'REMOVE'), with one set-based statement per table rather than a call per symbol, then clear the staged rows.
+-- Symbols that already exist are not added again. Call it in a transaction and commit once.
+DROP PROCEDURE IF EXISTS SyncSymbols;
+
+DELIMITER $$
+CREATE PROCEDURE SyncSymbols (
+    _SecurityType VARCHAR(50),
+    _SecurityTimeZone VARCHAR(50),
+    _SecurityContractSize FLOAT,
+    _SecurityDenominationCurrency VARCHAR(3))
+NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    IF GetPriceLayout()='STANDARD'
+    THEN
+        DELETE
+            dspo
+        FROM
+            DataSourcePriceObservation AS dspo
+        JOIN
+            SecurityMetaData AS smd ON smd.SecurityMetaDataID=dspo.SecurityMetaDataID
+        JOIN
+            SymbolSyncStaging AS sss ON sss.SecuritySymbol=smd.SecuritySymbol
+        WHERE
+            sss.ConnectionID=CONNECTION_ID()
+            AND
+            sss.Action='REMOVE';
+    ELSE
+        BEGIN
+            DELETE
+                pb
+            FROM
+                PriceBar AS pb
+            JOIN
+                SecurityMetaData AS smd ON smd.SecurityMetaDataID=pb.SecurityMetaDataID
+            JOIN
+                SymbolSyncStaging AS sss ON sss.SecuritySymbol=smd.SecuritySymbol
+            WHERE
+                sss.ConnectionID=CONNECTION_ID()
+                AND
+                sss.Action='REMOVE';
+
+            DELETE
+                ca
+            FROM
+                CorporateAction AS ca
+            JOIN
+                SecurityMetaData AS smd ON smd.SecurityMetaDataID=ca.SecurityMetaDataID
+            JOIN
+                SymbolSyncStaging AS sss ON sss.SecuritySymbol=smd.SecuritySymbol
+            WHERE
+                sss.ConnectionID=CONNECTION_ID()
+                AND
+                sss.Action='REMOVE';
+        END;
+    END IF;
+
+    -- MonthEndCalendar is shared by all symbols and left as is, as in DeleteSymbol.
+    DELETE
+        sps
+    FROM
+        SecurityPriceSummary AS sps
+    JOIN
+        SecurityMetaData AS smd ON smd.SecurityMetaDataID=sps.SecurityMetaDataID
+    JOIN
+        SymbolSyncStaging AS sss ON sss.SecuritySymbol=smd.SecuritySymbol
+    WHERE
+        sss.ConnectionID=CONNECTION_ID()
+        AND
+        sss.Action='REMOVE';
+
+    DELETE
+        pr
+    FROM
+        PriceRollup AS pr
+    JOIN
+        SecurityMetaData AS smd ON smd.SecurityMetaDataID=pr.SecurityMetaDataID
+    JOIN
+        SymbolSyncStaging AS sss ON sss.SecuritySymbol=smd.SecuritySymbol
+    WHERE
+        sss.ConnectionID=CONNECTION_ID()
+        AND
+        sss.Action='REMOVE';
+
+    DELETE
+        smd
+    FROM
+        SecurityMetaData AS smd
+    JOIN
+        SymbolSyncStaging AS sss ON sss.SecuritySymbol=smd.SecuritySymbol
+    WHERE
+        sss.ConnectionID=CONNECTION_ID()
+        AND
+        sss.Action='REMOVE';
+
+    INSERT INTO SecurityMetaData (
+        SecuritySymbol,
+        SecurityType,
+        SecurityTimeZone,
+        SecurityContractSize,
+        SecurityDenominationCurrency,
+        DataSourceID)
+    SELECT
+        sss.SecuritySymbol,
+        _SecurityType,
+        _SecurityTimeZone,
+        _SecurityContractSize,
+        _SecurityDenominationCurrency,
+        sss.DataSourceID
+    FROM
+        SymbolSyncStaging AS sss
+    JOIN
+        DataSource AS ds ON ds.DataSourceID=sss.DataSourceID
+    LEFT JOIN
+        SecurityMetaData AS smd ON smd.SecuritySymbol=sss.SecuritySymbol
+    WHERE
+        sss.ConnectionID=CONNECTION_ID()
+        AND
+        sss.Action='ADD'
+        AND
+        smd.SecurityMetaDataID IS NULL;
+
+    DELETE FROM
+        SymbolSyncStaging
+    WHERE
+        ConnectionID=CONNECTION_ID();
+END $$
+DELIMITER ;
+
 -- Get the highest and lowest close for all securities between @start_date and @end_date
 DROP PROCEDURE IF EXISTS GetTrailingHighestAndLowestClose;
 
@@ -282,14 +1000,16 @@ CREATE PROCEDURE GetSecuritiesAboveAvg(
     _length INT)
 NOT DETERMINISTIC READS SQL DATA
 BEGIN
+    -- The latest closes come from SecurityPriceSummary (via GetLatestClosePrices), and HAVING filters on the
+    -- computed average, so GetAvgPrice reads each symbol's last _length bars only once.
     SELECT
         SecuritySymbol,
         AdjustedClosePrice AS Price,
         GetAvgPrice(SecuritySymbol, _length) AS Avg
     FROM
-        GetLatestClosePrices as tmp
-    WHERE
-        AdjustedClosePrice > GetAvgPrice(SecuritySymbol, _length);
+        GetLatestClosePrices AS tmp
+    HAVING
+        Price > Avg;
 END $$
 DELIMITER ;
 
@@ -301,13 +1021,14 @@ CREATE PROCEDURE GetSecuritiesBelowAvg(
     _length INT)
 NOT DETERMINISTIC READS SQL DATA
 BEGIN
+    -- See GetSecuritiesAboveAvg.
     SELECT
         SecuritySymbol,
         AdjustedClosePrice AS Price,
         GetAvgPrice(SecuritySymbol, _length) AS Avg
     FROM
         GetLatestClosePrices AS tmp
-    WHERE
-        AdjustedClosePrice < GetAvgPrice(SecuritySymbol, _length);
+    HAVING
+        Price < Avg;
 END $$
 DELIMITER ;
@@ -3,19 +3,19 @@ DROP VIEW IF EXISTS GetLatestClosePrices;
 
 CREATE VIEW GetLatestClosePrices AS
 SELECT
-	dspo.SampleTime,
-	dspo.AdjustedClosePrice,
+	sps.LastSampleTime AS SampleTime,
+	sps.LastAdjustedClosePrice AS AdjustedClosePrice,
 	smd.SecuritySymbol
 FROM
-	DataSourcePriceObservation AS dspo
+	SecurityPriceSummary AS sps
 JOIN
-	SecurityMetaData AS smd ON dspo.SecurityMetaDataID=smd.SecurityMetaDataID
+	SecurityMetaData AS smd ON sps.SecurityMetaDataID=smd.SecurityMetaDataID
 WHERE
-	dspo.Sampletime=(
+	sps.LastSampleTime=(
 		SELECT
-            MAX(SampleTime)
+            MAX(LastSampleTime)
         FROM
-            DataSourcePriceObservation);
+            SecurityPriceSummary);
 
 -- Get a list of all the symbols in the database
 DROP VIEW IF EXISTS GetSymbolsInDatabase;
@@ -32,17 +32,8 @@ JOIN
 DROP VIEW IF EXISTS GetMonthEndDates;
 
 CREATE VIEW GetMonthEndDates AS
-SELECT DISTINCT
+SELECT
     SampleTime
 FROM
-    DataSourcePriceObservation
-WHERE SampleTime IN (
-    SELECT
-        MAX(SampleTime)
-    FROM
-        DataSourcePriceObservation
-    GROUP BY
-        MONTH(SampleTime),
-        YEAR(SampleTime)
-    );
+    MonthEndCalendar;
 
@@ -0,0 +1,114 @@
+import pandas as pd
+
+
+# Vectorized versions of the reporting stored procedures (GetSecuritiesAboveAvg/BelowAvg,
+# GetPriceRangeOverDateRange, GetTrailingHighestAndLowestClose). The procedures call scalar functions per symbol,
+# each of which rescans the price table; here every function works on one long-format frame of prices, fetched
+# once, with pandas group operations across all symbols at the same time.
+#
+# `prices` is always a dataframe with columns SecuritySymbol, SampleTime and AdjustedClosePrice, as returned by
+# updater.load_adjusted_closes(). The results have the same columns as the corresponding stored procedures.
+
+
+def _sorted(prices):
+    # Drop missing closes (the SQL aggregates ignore NULLs too) and order each symbol's bars in time.
+    return prices.dropna(subset=["AdjustedClosePrice"]).sort_values(
+        ["SecuritySymbol", "SampleTime"], kind="mergesort")
+
+
+def latest_close_prices(prices):
+    """ Closing price of every symbol that has a bar at the most recent SampleTime (the GetLatestClosePrices view).
+
+    :param prices: long-format price frame.
+    :return: dataframe with columns SampleTime, AdjustedClosePrice, SecuritySymbol.
+    """
+    prices = prices.dropna(subset=["AdjustedClosePrice"])
+    latest = prices[prices["SampleTime"] == prices["SampleTime"].max()]
+    return latest[["SampleTime", "AdjustedClosePrice", "SecuritySymbol"]].reset_index(drop=True)
+
+
+def price_relative_to_avg(prices, above_or_below, length=30):
+    """ Symbols whose latest close is above (or below) their average close over their last `length` bars.
+
+    :param prices: long-format price frame holding at least the last `length` bars of every symbol.
+    :param above_or_below: "Above" or "Below".
+    :param length: number of bars in the average.
+    :return: dataframe with columns SecuritySymbol, Price, Avg.
+    """
+    prices = _sorted(prices)
+    averages = prices.groupby("SecuritySymbol", sort=False).tail(length).groupby(
+        "SecuritySymbol")["AdjustedClosePrice"].mean()
+
+    latest = latest_close_prices(prices)
+    result = pd.DataFrame({
+        "SecuritySymbol": latest["SecuritySymbol"].values,
+        "Price": latest["AdjustedClosePrice"].values,
+        "Avg": averages.reindex(latest["SecuritySymbol"]).values,
+    })
+    if above_or_below.lower() == "above":
+        result = result[result["Price"] > result["Avg"]]
+    elif above_or_below.lower() == "below":
+        result = result[result["Price"] < result["Avg"]]
+    else:
+        raise ValueError("above_or_below must be 'Above' or 'Below'")
+    return result.reset_index(drop=True)
+
+
+def range_summary(prices):
+    """ Price range, and range as a fraction of the average price, for every symbol over the frame's window.
+
+    :param prices: long-format price frame restricted to the window of interest.
+    :return: dataframe with columns Symbol, PriceRange, PctRange.
+    """
+    stats = prices.dropna(subset=["AdjustedClosePrice"]).groupby("SecuritySymbol")["AdjustedClosePrice"].agg(
+        ["min", "max", "mean"])
+    price_range = stats["max"] - stats["min"]
+    return pd.DataFrame({
+        "Symbol": stats.index.values,
+        "PriceRange": price_range.values,
+        "PctRange": (price_range / stats["mean"]).values,
+    })
+
+
+def highest_lowest_close(prices, symbols=None):
+    """ Last, lowest and highest close of every symbol over the frame's window.
+
+    :param prices: long-format price frame restricted to the window of interest.
+    :param symbols: optional list of every symbol to report (symbols with no bars get NaNs), e.g. all symbols in
+        the database, like the stored procedure does.
+    :return: dataframe with columns SecuritySymbol, LastPrice, MinPrice, MaxPrice.
+    """
+    prices = _sorted(prices)
+    grouped = prices.groupby("SecuritySymbol")["AdjustedClosePrice"]
+    stats = pd.DataFrame({"LastPrice": grouped.last(), "MinPrice": grouped.min(), "MaxPrice": grouped.max()})
+    if symbols is not None:
+        stats = stats.reindex(sorted(symbols))
+    stats.index.name = "SecuritySymbol"
+    return stats.reset_index()
+
+
+def moving_average(prices, length):
+    """ Trailing `length`-bar moving average of every symbol at every SampleTime.
+
+    :param prices: long-format price frame.
+    :param length: number of bars in the average.
+    :return: the sorted frame with an extra MovingAverage column.
+    """
+    prices = _sorted(prices).copy()
+    rolling = prices.groupby("SecuritySymbol", sort=False)["AdjustedClosePrice"].rolling(length, min_periods=1)
+    prices["MovingAverage"] = rolling.mean().values
+    return prices
+
+
+def trailing_high_low(prices, length):
+    """ Trailing `length`-bar highest and lowest close of every symbol at every SampleTime.
+
+    :param prices: long-format price frame.
+    :param length: number of bars in the window.
+    :return: the sorted frame with extra TrailingHigh and TrailingLow columns.
+    """
+    prices = _sorted(prices).copy()
+    rolling = prices.groupby("SecuritySymbol", sort=False)["AdjustedClosePrice"].rolling(length, min_periods=1)
+    prices["TrailingHigh"] = rolling.max().values
+    prices["TrailingLow"] = rolling.min().values
+    return prices
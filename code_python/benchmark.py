@@ -0,0 +1,663 @@
+import pandas as pd
+import numpy as np
+import pymysql
+from datetime import datetime as dt
+from contextlib import contextmanager
+import http.server
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import jobqueue
+import streaming
+import tradingcalendar
+import updater
+
+
+# Reproducible benchmarks of the update pipeline that spend no API quota: a local stand-in for the AlphaVantage
+# query endpoint serves synthetic time series, and the update is run against a throwaway database built from
+# code_mysql/*.sql, which is dropped again afterwards. Every run appends its results to a JSON-lines file, keyed by
+# git commit, so a run can be compared with an earlier commit and regressions show up.
+#
+#     python benchmark.py --tickers 50 --workers 4 --writers 2
+#     python benchmark.py --tickers 50 --workers 4 --writers 2 --compare master
+#     python benchmark.py --tickers 50 --layouts standard compact
+#
+# With --layouts, the database benchmarks run once per storage layout (compact results are prefixed "compact_"),
+# including bytes per stored row and the rate of a full streaming scan of the prices.
+#
+# Without a reachable MySQL/MariaDB server (see --host/--user/--password, by default the PRICES_DAILY login in
+# creds.yaml), only the parser benchmark runs.
+
+
+##########################
+##### Synthetic Data #####
+##########################
+
+
+# AlphaVantage field names per time series function, in payload order.
+SYNTHETIC_FIELDS = {
+    "TIME_SERIES_DAILY": ["open", "high", "low", "close", "volume"],
+    "TIME_SERIES_DAILY_ADJUSTED": [
+        "open", "high", "low", "close", "adjusted close", "volume", "dividend amount", "split coefficient"],
+    "TIME_SERIES_INTRADAY": ["open", "high", "low", "close", "volume"],
+}
+
+
+def synthetic_sample_times(rows, interval=None, end=None):
+    """ The last `rows` sample times up to `end`: NYSE sessions, or regular-hours intraday bars (stamped at the end
+    of the bar, exchange time, stopping at early closes) if an interval such as "5min" is given.
+
+    :return: a DatetimeIndex, ascending.
+    """
+    calendar = tradingcalendar.nyse_calendar()
+    end = pd.Timestamp(end or dt.now()).normalize()
+    sessions = calendar.sessions[calendar.sessions <= end]
+    if interval is None:
+        return sessions[-rows:]
+    bars = pd.timedelta_range(start="09:30:00", end="16:00:00", freq=interval)[1:]
+    days = sessions[-(-rows // len(bars) + 1):]
+    closes = calendar.closes[calendar.sessions.get_indexer(days)].tz_localize(None)
+    times = days.values[:, None] + bars.values[None, :]
+    times = times[times <= closes.values[:, None]]
+    return pd.DatetimeIndex(times[-rows:])
+
+
+def synthetic_time_series(function, symbol, rows, interval="5min", end=None):
+    """ A payload in the format of the AlphaVantage time series functions, with a random walk of prices seeded by
+    the symbol, so the same request always gets the same answer.
+
+    :param function: one of SYNTHETIC_FIELDS.
+    :param symbol: ticker symbol.
+    :param rows: number of bars.
+    :param interval: bar length for TIME_SERIES_INTRADAY.
+    :param end: last day of the series, today by default (bars of a session still in progress included).
+    :return: the JSON payload as bytes (newest bar first, like the API).
+    """
+    intraday = function == "TIME_SERIES_INTRADAY"
+    times = synthetic_sample_times(rows, interval=interval if intraday else None, end=end)
+    rows = len(times)
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows)))
+    open_ = close * (1 + rng.normal(0, 0.002, rows))
+    values = {
+        "open": open_,
+        "high": np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.003, rows))),
+        "low": np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.003, rows))),
+        "close": close,
+        "adjusted close": close,
+        "volume": rng.integers(1e4, 1e7, rows),
+        "dividend amount": np.where(np.arange(rows) % 63 == 62, 0.25, 0.0),
+        "split coefficient": np.ones(rows),
+    }
+    fields = SYNTHETIC_FIELDS[function]
+    columns = [
+        values[field].astype(str) if field == "volume" else np.char.mod("%.4f", values[field]) for field in fields]
+    stamps = times.strftime("%Y-%m-%d %H:%M:%S" if intraday else "%Y-%m-%d")
+
+    template = '"{}": {{' + ", ".join('"{}. {}": "{{}}"'.format(i + 1, field) for i, field in enumerate(fields)) + "}}"
+    records = [template.format(*record) for record in zip(stamps, *columns)]
+    records.reverse()
+
+    section = "Time Series ({})".format(interval if intraday else "Daily")
+    meta = {"1. Information": "Synthetic {} data".format(function), "2. Symbol": symbol,
+            "3. Last Refreshed": stamps[-1]}
+    return '{{"Meta Data": {}, "{}": {{{}}}}}'.format(json.dumps(meta), section, ", ".join(records)).encode()
+
+
+####################################
+##### Fake AlphaVantage Server #####
+####################################
+
+
+class _FakeAlphaVantageHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        fake = self.server.fake
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        time.sleep(fake.latency)
+        body = fake.payload(
+            query.get("function"), query.get("symbol", ""), query.get("outputsize", "compact"),
+            query.get("interval", "5min"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        fake.served(len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAlphaVantage(object):
+    """ Local HTTP stand-in for https://www.alphavantage.co/query, serving synthetic_time_series() payloads.
+
+    Point the updater at it with data_source_info["AlphaVantage"]["api_url"] = fake.url. Unknown functions get
+    the API's "Error Message" reply, also with HTTP 200.
+    """
+
+    def __init__(self, full_rows=5000, compact_rows=100, intraday_rows=None, latency=0.0, port=0, end=None):
+        """
+        :param full_rows: bars per outputsize=full daily payload.
+        :param compact_rows: bars per outputsize=compact payload (100 on the real API).
+        :param intraday_rows: bars per outputsize=full intraday payload, full_rows by default.
+        :param latency: seconds each response is delayed, to model the round trip to the API.
+        :param port: port to listen on, any free one by default.
+        :param end: last day of every series, today by default.
+        """
+        self.full_rows = full_rows
+        self.compact_rows = compact_rows
+        self.intraday_rows = intraday_rows or full_rows
+        self.latency = latency
+        self.end = end
+        self.requests = 0
+        self.bytes_sent = 0
+        self._payloads = {}
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", port), _FakeAlphaVantageHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-alphavantage", daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/query".format(self._server.server_address[1])
+
+    def payload(self, function, symbol, outputsize="compact", interval="5min"):
+        """ :return: the response body for a request, generated once and then served from memory. """
+        key = (function, symbol, outputsize, interval)
+        with self._lock:
+            body = self._payloads.get(key)
+        if body is None:
+            if function not in SYNTHETIC_FIELDS:
+                return json.dumps({"Error Message": "Invalid API call: {}".format(function)}).encode()
+            if outputsize == "compact":
+                rows = self.compact_rows
+            else:
+                rows = self.intraday_rows if function == "TIME_SERIES_INTRADAY" else self.full_rows
+            body = synthetic_time_series(function, symbol, rows, interval=interval, end=self.end)
+            with self._lock:
+                self._payloads[key] = body
+        return body
+
+    def set_end(self, end):
+        """ Move the last day of every series (None for today), e.g. so a later update pass finds new bars. """
+        with self._lock:
+            self.end = end
+            self._payloads.clear()
+
+    def prepare(self, function, symbols, interval="5min"):
+        """ Generate the full and compact payloads of symbols ahead of a timed run. """
+        for symbol in symbols:
+            for outputsize in ["full", "compact"]:
+                self.payload(function, symbol, outputsize=outputsize, interval=interval)
+
+    def served(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+##############################
+##### Throwaway Database #####
+##############################
+
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code_mysql")
+
+# Scripts run by create_daily.sh / create_intraday.sh, in their order (the optional PARTITIONS_INTRADAY only for a
+# partitioned standard intraday layout, COMPACT_DAILY / COMPACT_INTRADAY only for the compact layouts).
+SCHEMA_SCRIPTS = [
+    "CREATES.sql", "PARTITIONS_INTRADAY.sql", "COMPACT_DAILY.sql", "COMPACT_INTRADAY.sql", "VIEWS.sql",
+    "FUNCTIONS.sql", "STOREDPROCS.sql"]
+
+STORAGE_LAYOUTS = ["standard", "compact"]
+
+# Tables holding the price data of each layout, whose size benchmark_storage() measures.
+LAYOUT_TABLES = {
+    "standard": ["DataSourcePriceObservation"],
+    "compact": ["PriceBar", "CorporateAction"],
+}
+
+
+def split_sql_script(text):
+    """ Split a script written for the mysql client into statements, honouring DELIMITER lines and dropping
+    comment-only lines.
+
+    :return: list of statements, without their delimiters.
+    """
+    statements = []
+    lines = []
+    delimiter = ";"
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not lines and (not stripped or stripped.startswith("--")):
+            continue
+        if stripped.upper().startswith("DELIMITER "):
+            delimiter = stripped.split(None, 1)[1]
+            continue
+        if stripped.endswith(delimiter):
+            lines.append(line.rstrip()[:-len(delimiter)])
+            statement = "\n".join(lines).strip()
+            if statement:
+                statements.append(statement)
+            lines = []
+        else:
+            lines.append(line)
+    if "\n".join(lines).strip():
+        statements.append("\n".join(lines).strip())
+    return statements
+
+
+@contextmanager
+def throwaway_database(logger, host, user, password, intraday=False, port=3306, layout="standard", partitioned=False):
+    """ Create a database named BENCH_DAILY_<pid> (or BENCH_INTRADAY_<pid>, with _COMPACT for the compact layout)
+    from the code_mysql scripts, and drop it when the with block exits.
+
+    :param intraday: build the intraday database; the updater also goes by the name.
+    :param layout: one of STORAGE_LAYOUTS.
+    :param partitioned: partition the price table by year (PARTITIONS_INTRADAY.sql), standard intraday layout only.
+    :return: the database name.
+    """
+    database = "BENCH_{}{}_{}".format(
+        "INTRADAY" if intraday else "DAILY", "_COMPACT" if layout == "compact" else "", os.getpid())
+    skip = {"COMPACT_DAILY.sql", "COMPACT_INTRADAY.sql"}
+    if layout == "compact":
+        skip = {"PARTITIONS_INTRADAY.sql", "COMPACT_DAILY.sql" if intraday else "COMPACT_INTRADAY.sql"}
+    elif not (intraday and partitioned):
+        skip.add("PARTITIONS_INTRADAY.sql")
+    sql_conn = pymysql.connect(host=host, user=user, password=password, port=port, autocommit=True)
+    try:
+        with sql_conn.cursor() as sql_cursor:
+            sql_cursor.execute("DROP DATABASE IF EXISTS {}".format(database))
+            sql_cursor.execute("CREATE DATABASE {}".format(database))
+            sql_cursor.execute("USE {}".format(database))
+            for script in SCHEMA_SCRIPTS:
+                if script in skip:
+                    continue
+                with open(os.path.join(SQL_DIR, script), "r") as f:
+                    for statement in split_sql_script(f.read()):
+                        sql_cursor.execute(statement)
+        logger("Created throwaway database {}".format(database))
+        yield database
+    finally:
+        with sql_conn.cursor() as sql_cursor:
+            sql_cursor.execute("DROP DATABASE IF EXISTS {}".format(database))
+        sql_conn.close()
+        logger("Dropped throwaway database {}".format(database))
+
+
+######################
+##### Benchmarks #####
+######################
+
+
+def peak_rss_mb():
+    """ :return: peak resident set size of this process in MB, or None where the resource module is missing. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def benchmark_parsers(logger, rows=5000, intraday=False, repeat=5):
+    """ Parse one synthetic full payload with each parser, best of `repeat` runs.
+
+    :return: dict of metric -> value: <parser>_parse_rows_per_sec and <parser>_parse_peak_mb.
+    """
+    function = "TIME_SERIES_INTRADAY" if intraday else "TIME_SERIES_DAILY"
+    body = synthetic_time_series(function, "BENCH", rows)
+
+    results = {}
+    for parser in updater.ALPHAVANTAGE_PARSERS:
+        # tracemalloc slows parsing down, so time without it and take the memory peak from a separate run.
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if parser == "columnar":
+                chunks = (body[i:i + updater.PARSE_CHUNK_BYTES]
+                          for i in range(0, len(body), updater.PARSE_CHUNK_BYTES))
+                updater.parse_alphavantage_time_series(chunks, size_hint=len(body))
+            else:
+                updater.parse_alphavantage_json(body, intraday=intraday)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        results["{}_parse_rows_per_sec".format(parser)] = rows / best
+        logger("Parser {}: {:,.0f} rows/sec ({} rows, {:.1f} KB payload)".format(
+            parser, rows / best, rows, len(body) / 1024))
+
+    for parser, measured in updater.profile_alphavantage_parsers(body, intraday=intraday).items():
+        results["{}_parse_peak_mb".format(parser)] = measured["peak_bytes"] / 1024 ** 2
+    return results
+
+
+def benchmark_update(
+        logger,
+        fake,
+        host,
+        user,
+        password,
+        database,
+        tickers,
+        workers=1,
+        writers=1,
+        insert_strategy="multirow",
+        parser="columnar",
+        commit_rows=50000,
+        alphavantage_premium=False,
+        port=3306,
+):
+    """ Seed `database` with `tickers` from the fake server with series ending five sessions ago, run an
+    incremental update to the latest session, then a run with nothing to do, and time all three.
+
+    :return: dict of metric -> value: tickers/min, rows/sec, insert rows/sec and elapsed seconds of the "seed" and
+        "update" passes, and elapsed seconds and API calls of the "noop" pass (see RunMetrics for the underlying
+        phases).
+    """
+    data_source_info = {"AlphaVantage": {
+        "url": "https://www.alphavantage.co",
+        "api_url": fake.url,
+        "api_key": "benchmark",
+        "api_keys": [{"key": "benchmark"}],
+    }}
+    ticker_map = {ticker: "AlphaVantage" for ticker in tickers}
+    intraday = "intraday" in database.lower()
+    if intraday:
+        function = "TIME_SERIES_INTRADAY"
+    else:
+        function = "TIME_SERIES_DAILY_ADJUSTED" if alphavantage_premium else "TIME_SERIES_DAILY"
+    calendar = tradingcalendar.nyse_calendar()
+    last_session = calendar.last_closed_session(settle_minutes=60)
+    seed_end = calendar.sessions[calendar.sessions.get_loc(last_session) - 5]
+
+    results = {}
+    for run, end in [("seed", seed_end), ("update", last_session), ("noop", last_session)]:
+        if end != fake.end:
+            fake.set_end(end)
+            fake.prepare(function, tickers)
+        connection_pool = updater.ConnectionPool(
+            host=host, user=user, password=password, database=database, size=writers + 1, port=port,
+            local_infile=insert_strategy == "infile")
+        try:
+            with connection_pool.connection() as (sql_conn, sql_cursor):
+                metrics = updater.database_update(
+                    logger=logger,
+                    sql_conn=sql_conn,
+                    sql_cursor=sql_cursor,
+                    data_source_info=data_source_info,
+                    wait_seconds=0,
+                    alphavantage_premium=alphavantage_premium,
+                    tickers=ticker_map,
+                    workers=workers,
+                    insert_strategy=insert_strategy,
+                    parser=parser,
+                    writers=writers,
+                    commit_rows=commit_rows,
+                    connection_pool=connection_pool,
+                )
+        finally:
+            connection_pool.close()
+
+        report = metrics.report()
+        elapsed = max(report["elapsed_seconds"], 1e-9)
+        results["{}_seconds".format(run)] = elapsed
+        if run == "noop":
+            results["noop_api_calls"] = report["counters"].get("api_calls", 0)
+            logger("Noop: {} API calls, {} saved, in {:.1f} seconds".format(
+                results["noop_api_calls"], report["counters"].get("api_calls_saved", 0), elapsed))
+            continue
+        done = report["jobs"].get(jobqueue.JobQueue.DONE, 0)
+        rows = report["counters"].get("rows_inserted", 0)
+        insert_seconds = report["phases"].get("insert", {}).get("seconds", 0.0)
+        results["{}_tickers_per_min".format(run)] = 60 * done / elapsed
+        results["{}_rows_per_sec".format(run)] = rows / elapsed
+        if insert_seconds:
+            results["{}_insert_rows_per_sec".format(run)] = rows / insert_seconds
+        logger("{}: {} tickers, {} rows in {:.1f} seconds ({:.1f} tickers/min, {:,.0f} rows/sec)".format(
+            run.capitalize(), done, rows, elapsed, 60 * done / elapsed, rows / elapsed))
+    return results
+
+
+def benchmark_reports(logger, host, user, password, database, length=30, port=3306):
+    """ Time every reporting helper with each engine against `database`.
+
+    :return: dict of metric -> value: report_<report>_<engine>_seconds.
+    """
+    sql_conn = pymysql.connect(host=host, port=port, user=user, password=password, db=database)
+    try:
+        timings = updater.time_reporting_engines(logger, sql_conn, length=length)
+    finally:
+        sql_conn.close()
+    return {"report_{}_{}_seconds".format(row.report, row.engine.replace("+", "_")): row.seconds
+            for row in timings.itertuples()}
+
+
+def benchmark_storage(logger, host, user, password, database, layout="standard", chunk_rows=100000, port=3306):
+    """ Measure the on-disk size of the prices in `database` (data and indexes of the layout's tables, after
+    ANALYZE TABLE refreshes the statistics) and time a full scan of them with streaming.stream_price_observations().
+
+    :param layout: one of STORAGE_LAYOUTS.
+    :param chunk_rows: rows per chunk of the scan.
+    :return: dict of metric -> value: storage_bytes_per_row, storage_mb and scan_rows_per_sec.
+    """
+    tables = LAYOUT_TABLES[layout]
+    sql_conn = pymysql.connect(host=host, port=port, user=user, password=password, db=database)
+    try:
+        with sql_conn.cursor() as sql_cursor:
+            for table in tables:
+                sql_cursor.execute("ANALYZE TABLE {}".format(table))
+                sql_cursor.fetchall()
+            sql_cursor.execute(
+                "SELECT SUM(DATA_LENGTH + INDEX_LENGTH) FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA=%s AND TABLE_NAME IN ({})".format(", ".join(["%s"] * len(tables))),
+                [database] + tables)
+            size = float(sql_cursor.fetchone()[0] or 0)
+
+        rows = 0
+        start = time.perf_counter()
+        for chunk in streaming.stream_price_observations(sql_conn, chunk_rows=chunk_rows):
+            rows += len(chunk)
+        seconds = max(time.perf_counter() - start, 1e-9)
+    finally:
+        sql_conn.close()
+
+    results = {"storage_mb": size / 1024 ** 2, "scan_rows_per_sec": rows / seconds}
+    if rows:
+        results["storage_bytes_per_row"] = size / rows
+    logger("Storage ({}): {:,.1f} MB for {:,} rows ({:,.1f} bytes/row), scanned at {:,.0f} rows/sec".format(
+        layout, size / 1024 ** 2, rows, size / rows if rows else float("nan"), rows / seconds))
+    return results
+
+
+####################################
+##### Comparing Across Commits #####
+####################################
+
+
+def git_commit():
+    """ :return: (commit hash, True if the working tree has uncommitted changes), or (None, None) outside git. """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+        status = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                         stderr=subprocess.DEVNULL).decode()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def resolve_commit(ref):
+    """ :return: the full hash of a git ref such as "master" or "HEAD~3", or ref itself if git can't resolve it. """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--verify", "{}^{{commit}}".format(ref)], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ref
+
+
+def append_result(path, record):
+    with open(path, "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def higher_is_better(metric):
+    """ Throughputs (*_per_sec, *_per_min) should go up; times and memory should go down. """
+    return metric.endswith("_per_sec") or metric.endswith("_per_min")
+
+
+def compare_results(baseline, current, threshold=10.0):
+    """ Compare two result dicts metric by metric.
+
+    :param threshold: change, in percent, in the bad direction beyond which a metric counts as a regression.
+    :return: dataframe with columns metric, baseline, current, change_pct, regression.
+    """
+    rows = []
+    for metric in sorted(set(baseline) & set(current)):
+        before, after = baseline[metric], current[metric]
+        if before is None or after is None or before == 0:
+            continue
+        change = 100.0 * (after - before) / abs(before)
+        worse = -change if higher_is_better(metric) else change
+        rows.append({"metric": metric, "baseline": before, "current": after, "change_pct": change,
+                     "regression": worse > threshold})
+    return pd.DataFrame(rows, columns=["metric", "baseline", "current", "change_pct", "regression"])
+
+
+def find_baseline(records, commit, config):
+    """ :return: the latest record of `commit` (a full hash, or a prefix) run with the same config, or None. """
+    for record in reversed(records):
+        if record.get("commit") and record["commit"].startswith(commit) and record.get("config") == config:
+            return record
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the updater against a fake AlphaVantage server.")
+    parser.add_argument("--host", default=None, help="MySQL/MariaDB host (default: PRICES_DAILY login in creds.yaml)")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default=None)
+    parser.add_argument("--password", default=None)
+    parser.add_argument("--parse-only", action="store_true", default=False, help="skip the database benchmarks")
+    parser.add_argument("--intraday", action="store_true", default=False, help="benchmark the intraday layout")
+    parser.add_argument("--partitioned", action="store_true", default=False,
+                        help="partition the intraday price table by year (PARTITIONS_INTRADAY.sql)")
+    parser.add_argument("--premium", action="store_true", default=False, help="serve TIME_SERIES_DAILY_ADJUSTED")
+    parser.add_argument("--tickers", type=int, default=20, help="number of synthetic tickers")
+    parser.add_argument("--rows", type=int, default=5000, help="bars per full payload")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="delay of each fake API response")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=1)
+    parser.add_argument("--insert-strategy", choices=updater.INSERT_STRATEGIES, default="multirow")
+    parser.add_argument("--parser", choices=updater.ALPHAVANTAGE_PARSERS, default="columnar")
+    parser.add_argument("--commit-rows", type=int, default=50000)
+    parser.add_argument("--layouts", nargs="+", choices=STORAGE_LAYOUTS, default=["standard"],
+                        help="storage layouts to benchmark, each in its own throwaway database")
+    parser.add_argument("--results", default="./benchmark_results.jsonl", help="results file, one run per line")
+    parser.add_argument("--compare", default=None, metavar="REF",
+                        help="compare with the latest result of this git commit/branch run with the same settings")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    parser.add_argument("--verbose", action="store_true", default=False, help="show the updater's log lines")
+    args = parser.parse_args()
+
+    logger = updater.init_logger().info
+    update_logger = logger if args.verbose else (lambda message: None)
+    logging.getLogger("pymysql").setLevel(logging.WARNING)
+
+    config = {key: getattr(args, key) for key in [
+        "intraday", "premium", "tickers", "rows", "latency_ms", "workers", "writers", "insert_strategy", "parser",
+        "commit_rows"]}
+    if args.layouts != ["standard"]:
+        config["layouts"] = args.layouts
+    if args.partitioned:
+        config["partitioned"] = True
+    results = benchmark_parsers(logger, rows=args.rows, intraday=args.intraday)
+
+    if not args.parse_only:
+        host, user, password = args.host, args.user, args.password
+        if host is None:
+            db_info, _ = updater.parse_creds(updater.cred_file, database_name="PRICES_DAILY")
+            host, user, password = db_info["host"], user or db_info["user"], password or db_info["password"]
+        try:
+            pymysql.connect(host=host, user=user, password=password, port=args.port).close()
+        except pymysql.err.Error as e:
+            logger("No database server available ({}): only the parser was benchmarked".format(e))
+            config["parse_only"] = True
+        else:
+            fake = FakeAlphaVantage(full_rows=args.rows, latency=args.latency_ms / 1000.0)
+            tickers = ["T{:04d}".format(i) for i in range(args.tickers)]
+            try:
+                for layout in args.layouts:
+                    # Standard results keep their plain names, so they compare with runs made before --layouts.
+                    prefix = "" if layout == "standard" else "{}_".format(layout)
+                    with throwaway_database(logger, host, user, password, intraday=args.intraday,
+                                            port=args.port, layout=layout,
+                                            partitioned=args.partitioned) as database:
+                        layout_results = benchmark_update(
+                            update_logger, fake, host, user, password, database, tickers,
+                            workers=args.workers,
+                            writers=args.writers,
+                            insert_strategy=args.insert_strategy,
+                            parser=args.parser,
+                            commit_rows=args.commit_rows,
+                            alphavantage_premium=args.premium,
+                            port=args.port)
+                        layout_results.update(benchmark_storage(
+                            logger, host, user, password, database, layout=layout, port=args.port))
+                        layout_results.update(
+                            benchmark_reports(update_logger, host, user, password, database, port=args.port))
+                    results.update((prefix + metric, value) for metric, value in layout_results.items())
+            finally:
+                fake.close()
+    else:
+        config["parse_only"] = True
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    for metric, value in sorted(results.items()):
+        logger("{}: {}".format(metric, "n/a" if value is None else "{:,.3f}".format(value)))
+
+    commit, dirty = git_commit()
+    previous = load_results(args.results)
+    append_result(args.results, {
+        "commit": commit, "dirty": dirty, "timestamp": dt.now().isoformat(), "config": config, "results": results})
+    logger("Appended results for commit {}{} to {}".format(
+        (commit or "unknown")[:10], " (uncommitted changes)" if dirty else "", args.results))
+
+    if args.compare:
+        baseline = find_baseline(previous, resolve_commit(args.compare), config)
+        if baseline is None:
+            logger("No results for {} with these settings in {}".format(args.compare, args.results))
+        else:
+            comparison = compare_results(baseline["results"], results, threshold=args.threshold)
+            with pd.option_context("display.width", 200, "display.max_rows", None):
+                logger("Compared with {} ({}):\n{}".format(
+                    args.compare, baseline["commit"][:10], comparison.to_string(index=False)))
+            regressions = comparison[comparison["regression"]]
+            if len(regressions):
+                logger("REGRESSIONS: {}".format(", ".join(regressions["metric"])))
+                raise SystemExit(1)
@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+
+
+# Adjusted closes derived locally from splits and dividends, the way AlphaVantage computes them, so daily prices
+# can be kept adjusted without refetching every symbol's full history after each corporate action.
+
+
+# Split ratios recognised when splits are inferred from the price series, forward and reverse.
+SPLIT_RATIOS = (2.0, 3.0, 4.0, 5.0, 10.0, 1.5, 1 / 2.0, 1 / 3.0, 1 / 4.0, 1 / 5.0, 1 / 10.0, 1 / 1.5)
+
+ADJUST_MODES = ["reported", "inferred"]
+
+
+def adjustment_factors(close, dividend=None, split=None, prev_close=None):
+    """ Backward adjustment factors of a price series, the way AlphaVantage computes its adjusted close.
+
+    A split or dividend on a bar's ex-date scales every earlier bar: by 1 / split coefficient for a split, and by
+    (1 - dividend / previous close) for a dividend. A bar's factor is the product of those multipliers over all
+    later bars, so the newest bar (and anything after the last event) has a factor of 1.
+
+    :param close: array of raw closes, oldest first.
+    :param dividend: array of dividend amounts, NaN or 0 where there was none.
+    :param split: array of split coefficients, NaN or 1 where there was none.
+    :param prev_close: raw close of the bar before close[0], if known, for a dividend on the first bar.
+    :return: float64 array of factors, one per bar.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    multipliers = np.ones(len(close))
+    if split is not None:
+        split = np.asarray(split, dtype=np.float64)
+        valid = np.isfinite(split) & (split > 0)
+        multipliers[valid] /= split[valid]
+    if dividend is not None and len(close):
+        dividend = np.nan_to_num(np.asarray(dividend, dtype=np.float64))
+        previous = np.r_[np.nan if prev_close is None else prev_close, close[:-1]]
+        paid = (dividend > 0) & np.isfinite(previous) & (previous > 0)
+        multipliers[paid] *= 1.0 - dividend[paid] / previous[paid]
+
+    factors = np.ones(len(close))
+    factors[:-1] = np.cumprod(multipliers[::-1])[::-1][1:]
+    return factors
+
+
+def infer_splits(open_price, close, prev_close=None, tolerance=0.03):
+    """ Guess split coefficients from overnight jumps, for data sources that don't report splits.
+
+    A bar whose open is one of SPLIT_RATIOS times smaller (or larger) than the previous close, to within
+    tolerance, is taken to be a split's ex-date. Big overnight moves near 2x or 0.5x are rare but not impossible,
+    so this is only used when asked for.
+
+    :param open_price: array of raw opens, oldest first.
+    :param close: array of raw closes, oldest first.
+    :param prev_close: raw close of the bar before the first one, if known.
+    :param tolerance: relative distance from a split ratio still taken as a split.
+    :return: float64 array of split coefficients, NaN where there was no split.
+    """
+    split_ratios = np.array(SPLIT_RATIOS)
+    open_price = np.asarray(open_price, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    previous = np.r_[np.nan if prev_close is None else prev_close, close[:-1]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = previous / open_price
+        distance = np.abs(ratios[:, None] / split_ratios[None, :] - 1.0)
+    distance = np.where(np.isfinite(distance), distance, np.inf)
+    nearest = distance.argmin(axis=1)
+    return np.where(distance[np.arange(len(ratios)), nearest] <= tolerance, split_ratios[nearest], np.nan)
+
+
+def corporate_actions(raw_data):
+    """ Bars of an AlphaVantage dataframe that carry a split or dividend.
+
+    :param raw_data: dataframe with updater.ALPHAVANTAGE_COLUMNS.
+    :return: DatetimeIndex of the ex-dates.
+    """
+    if raw_data is None or raw_data.empty:
+        return pd.DatetimeIndex([])
+    dividend = pd.to_numeric(raw_data["dividend amount"], errors="coerce").fillna(0).to_numpy()
+    split = pd.to_numeric(raw_data["split coefficient"], errors="coerce").fillna(1).to_numpy()
+    return raw_data.index[(dividend > 0) | (split != 1)]
+
+
+def derive_adjusted_close(raw_data, prev_close=None, infer=False):
+    """ Fill in a missing adjusted close from the raw closes, splits and dividends, in place.
+
+    The free API tier returns no adjusted close, dividends or split coefficients, so there the adjusted close is
+    the raw close scaled for the splits that infer finds. Rows that already have an adjusted close are kept.
+
+    :param raw_data: dataframe with updater.ALPHAVANTAGE_COLUMNS, oldest bar first.
+    :param prev_close: raw close of the stored bar before raw_data, if any.
+    :param infer: if True, fill missing split coefficients with infer_splits().
+    :return: DatetimeIndex of the corporate actions in raw_data.
+    """
+    close = pd.to_numeric(raw_data["close"], errors="coerce").to_numpy(dtype=np.float64)
+    split = pd.to_numeric(raw_data["split coefficient"], errors="coerce").to_numpy(dtype=np.float64)
+    if infer:
+        open_price = pd.to_numeric(raw_data["open"], errors="coerce").to_numpy(dtype=np.float64)
+        split = np.where(np.isnan(split), infer_splits(open_price, close, prev_close=prev_close), split)
+        raw_data["split coefficient"] = split
+    dividend = pd.to_numeric(raw_data["dividend amount"], errors="coerce").to_numpy(dtype=np.float64)
+
+    adjusted = pd.to_numeric(raw_data["adjusted close"], errors="coerce").to_numpy(dtype=np.float64)
+    missing = np.isnan(adjusted)
+    if missing.any():
+        factors = adjustment_factors(close, dividend=dividend, split=split, prev_close=prev_close)
+        raw_data["adjusted close"] = np.where(missing, close * factors, adjusted)
+    return corporate_actions(raw_data)
+
+
+def readjust_history(sql_cursor, security_metadata_id):
+    """ Recompute AdjustedClosePrice over a security's whole stored history after a split or dividend.
+
+    The raw closes, dividends and split coefficients are read in one pass and the factors computed vectorized.
+    Factors are constant between events, so they are staged as one (FromTime, ToTime, Factor) run per stretch
+    and ApplyAdjustmentFactors rewrites the adjusted closes with a single joined UPDATE, touching only rows whose
+    value changes. Run it in the same transaction as the write that brought in the event.
+
+    :param sql_cursor: a SQL cursor from an active connection.
+    :param security_metadata_id: SecurityMetaDataID of the security.
+    :return: number of factor runs staged.
+    """
+    sql_cursor.execute(
+        "SELECT SampleTime, ClosePrice, DividendAmount, SplitCoefficient FROM DataSourcePriceObservation "
+        "WHERE SecurityMetaDataID=%s ORDER BY SampleTime", (security_metadata_id,))
+    rows = sql_cursor.fetchall()
+    if not rows:
+        return 0
+    sample_times, close, dividend, split = zip(*rows)
+    factors = adjustment_factors(
+        np.array(close, dtype=np.float64),
+        dividend=np.array(dividend, dtype=np.float64),
+        split=np.array(split, dtype=np.float64))
+
+    # One run per stretch of equal factors.
+    starts = np.flatnonzero(np.r_[True, factors[1:] != factors[:-1]])
+    ends = np.r_[starts[1:] - 1, len(factors) - 1]
+    sql_cursor.executemany(
+        "INSERT INTO AdjustmentFactorStaging (SecurityMetaDataID, FromTime, ToTime, Factor) VALUES (%s, %s, %s, %s)",
+        [(security_metadata_id, sample_times[start], sample_times[end], float(factors[start]))
+         for start, end in zip(starts, ends)])
+    sql_cursor.execute("CALL ApplyAdjustmentFactors(%s)", (security_metadata_id,))
+    return len(starts)
@@ -0,0 +1,212 @@
+import cProfile
+import http.server
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime as dt
+
+
+# Per-run timers, counters, profiles and memory traces (RunMetrics), and their export as a JSON report or, over
+# HTTP, in the Prometheus text format.
+
+
+class RunMetrics(object):
+    """ Thread-safe timers and counters for one update run, totalled per phase and per ticker.
+
+    Phases are named stages of the work (e.g. "http", "parse", "insert") whose wall time and number of calls are
+    accumulated; counters are plain totals (e.g. "bytes_downloaded", "rows_inserted"). The run can be exported as a
+    JSON report or in the Prometheus text format. Optionally, every function run through profiled() is profiled with
+    cProfile (one profile per call, merged at the end, since cProfile only sees the thread it runs on) and the
+    run's allocations are traced with tracemalloc.
+    """
+
+    def __init__(self, run_id=None, database=None, profile=False, trace_memory=False):
+        """
+        :param run_id: identifies the run in the report, e.g. "PRICES_DAILY:2020-01-03".
+        :param database: database name, used as a label of the Prometheus metrics.
+        :param profile: if True, profiled() runs functions under cProfile.
+        :param trace_memory: if True, trace allocations with tracemalloc for the length of the run.
+        """
+        self.run_id = run_id
+        self.database = database
+        self.started = time.time()
+        self.finished = None
+        self.phases = {}  # phase -> [seconds, calls]
+        self.counters = {}
+        self.maximums = {}
+        self.tickers = {}  # ticker -> {"phases": {...}, "counters": {...}}
+        self.extra = {}
+        self._lock = threading.Lock()
+        self._profiles = [] if profile else None
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _ticker(self, ticker):
+        return self.tickers.setdefault(ticker, {"phases": {}, "counters": {}})
+
+    def add_time(self, phase, seconds, ticker=None):
+        with self._lock:
+            total = self.phases.setdefault(phase, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+            if ticker is not None:
+                phases = self._ticker(ticker)["phases"]
+                phases[phase] = phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase, ticker=None):
+        """ Time the body of a with block as one call of `phase`. """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start, ticker=ticker)
+
+    def count(self, name, value=1, ticker=None):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if ticker is not None:
+                counters = self._ticker(ticker)["counters"]
+                counters[name] = counters.get(name, 0) + value
+
+    def maximum(self, name, value):
+        """ Keep the largest value seen for `name`, e.g. a peak queue depth. """
+        with self._lock:
+            self.maximums[name] = max(self.maximums.get(name, value), value)
+
+    def profiled(self, function, *args, **kwargs):
+        """ Call function(*args, **kwargs), under cProfile if profiling is on. """
+        if self._profiles is None:
+            return function(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._profiles.append(profiler)
+
+    def finish(self, **extra):
+        """ Mark the run as finished, attaching extra sections (e.g. pipeline stats) to the report. """
+        self.finished = time.time()
+        self.extra.update(extra)
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.maximum("traced_bytes", peak)
+            self.extra["top_allocations"] = [
+                {"line": str(stat.traceback), "bytes": stat.size, "blocks": stat.count}
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[:20]]
+
+    def report(self):
+        """ :return: the run as a JSON-serializable dict. """
+        with self._lock:
+            elapsed = (self.finished or time.time()) - self.started
+            return {
+                "run_id": self.run_id,
+                "database": self.database,
+                "started": dt.fromtimestamp(self.started).isoformat(),
+                "elapsed_seconds": elapsed,
+                "phases": {
+                    phase: {"seconds": seconds, "calls": calls}
+                    for phase, (seconds, calls) in sorted(self.phases.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "maximums": dict(sorted(self.maximums.items())),
+                "tickers": {ticker: self.tickers[ticker] for ticker in sorted(self.tickers)},
+                **self.extra,
+            }
+
+    def samples(self):
+        """ :return: the run totals as (metric, type, help, labels, value) tuples, without per-ticker detail. """
+        labels = {"database": self.database or ""}
+        with self._lock:
+            samples = [
+                ("run_started_seconds", "gauge", "Start of the update run (unix time).", labels, self.started),
+                ("run_elapsed_seconds", "gauge", "Duration of the update run so far.", labels,
+                 (self.finished or time.time()) - self.started),
+            ]
+            for phase, (seconds, calls) in sorted(self.phases.items()):
+                phase_labels = dict(labels, phase=phase)
+                samples.append(("phase_seconds_total", "counter", "Time spent per phase.", phase_labels, seconds))
+                samples.append(("phase_calls_total", "counter", "Calls per phase.", phase_labels, calls))
+            samples += [("{}_total".format(name), "counter", "Run total of {}.".format(name), labels, value)
+                        for name, value in sorted(self.counters.items())]
+            samples += [("{}_max".format(name), "gauge", "Largest {} seen in the run.".format(name), labels, value)
+                        for name, value in sorted(self.maximums.items())]
+        return samples
+
+    def write(self, directory):
+        """ Write <database>_run_report.json, <database>.prom (for the node_exporter textfile collector) and, if
+        profiling, <database>.prof (readable with pstats) into directory. Files are replaced atomically.
+
+        :return: list of the paths written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        name = self.database or "updater"
+        outputs = [
+            (os.path.join(directory, "{}_run_report.json".format(name)),
+             lambda f: json.dump(self.report(), f, indent=2, default=str)),
+            (os.path.join(directory, "{}.prom".format(name)), lambda f: f.write(prometheus_text([self]))),
+        ]
+        written = []
+        for path, dump in outputs:
+            with open(path + ".tmp", "w") as f:
+                dump(f)
+            os.replace(path + ".tmp", path)
+            written.append(path)
+
+        if self._profiles:
+            path = os.path.join(directory, "{}.prof".format(name))
+            with self._lock:
+                profiles = list(self._profiles)
+            pstats.Stats(*profiles).dump_stats(path)
+            written.append(path)
+        return written
+
+
+def prometheus_text(run_metrics, prefix="alphavantage_updater"):
+    """ Render RunMetrics in the Prometheus text exposition format, one HELP/TYPE header per metric.
+
+    :param run_metrics: list of RunMetrics, e.g. one per database.
+    :param prefix: prefix of every metric name.
+    :return: the exposition text.
+    """
+    metrics = OrderedDict()
+    for run in run_metrics:
+        for metric, metric_type, description, labels, value in run.samples():
+            name = "{}_{}".format(prefix, metric)
+            if name not in metrics:
+                metrics[name] = ["# HELP {} {}".format(name, description), "# TYPE {} {}".format(name, metric_type)]
+            metrics[name].append("{}{{{}}} {}".format(
+                name, ",".join('{}="{}"'.format(key, label) for key, label in sorted(labels.items())), value))
+    return "".join(line + "\n" for lines in metrics.values() for line in lines)
+
+
+def serve_metrics(port, run_metrics):
+    """ Serve the Prometheus text of every RunMetrics in run_metrics at http://<host>:port/metrics from a daemon
+    thread, for as long as the process runs.
+
+    :param port: TCP port to listen on.
+    :param run_metrics: list of RunMetrics; it can be appended to after the server starts.
+    :return: the server.
+    """
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus_text(list(run_metrics)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,347 @@
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+
+
+# Durable per-ticker work queues for update runs: JobQueue checkpoints one process's run in a local SQLite file,
+# LeaseQueue shares a run between processes through the TickerLease table of the database being updated.
+
+
+class JobQueue(object):
+    """ Durable per-ticker work queue for an update run, kept in a local SQLite file.
+
+    Each (run, ticker) job records its state, attempt count, next eligible time and last error. A failed job is
+    retried after an exponential backoff with jitter, and is moved to the "dead" state after max_attempts, so one
+    bad symbol or an exhausted API key can't keep a run spinning. Jobs for a run are keyed by run_id (the database
+    and the date being updated through), so a killed process resumes where it stopped instead of starting over.
+    Pass path=":memory:" for a queue that only lives as long as the process.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    DEAD = "dead"
+
+    def __init__(self, path=":memory:", max_attempts=5, base_delay=30.0, max_delay=3600.0, keep_days=7):
+        """
+        :param path: SQLite file holding the jobs, or ":memory:".
+        :param max_attempts: failures after which a job is dead-lettered.
+        :param base_delay: backoff in seconds after the first failure, doubled for each further one.
+        :param max_delay: upper bound on the backoff in seconds.
+        :param keep_days: jobs of runs not touched for this many days are purged.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.keep_days = keep_days
+        self.run_id = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS update_jobs (
+                    run_id TEXT NOT NULL,
+                    ticker TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_eligible REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (run_id, ticker))
+                """)
+
+    def _execute(self, query, args=()):
+        with self._lock, self._conn:
+            return self._conn.execute(query, args).fetchall()
+
+    def seed(self, run_id, tickers):
+        """ Start (or resume) a run over tickers. Jobs a previous process left running are made pending again, and
+        so are finished jobs of tickers that are in the list again (still stale on a same-day rerun). Jobs of tickers
+        missing from the list are kept, so finished work still shows in the counts.
+
+        :param run_id: identifies the run, e.g. "PRICES_DAILY:2020-01-03".
+        :param tickers: list of ticker symbols, in processing order.
+        :return: dict of state -> number of jobs.
+        """
+        now = time.time()
+        self.run_id = run_id
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM update_jobs WHERE updated < ?", (now - self.keep_days * 86400,))
+            self._conn.execute(
+                "UPDATE update_jobs SET state=?, updated=? WHERE run_id=? AND state=?",
+                (self.PENDING, now, run_id, self.RUNNING))
+            existing = set(row[0] for row in self._conn.execute(
+                "SELECT ticker FROM update_jobs WHERE run_id=?", (run_id,)))
+            self._conn.executemany(
+                "UPDATE update_jobs SET state=?, attempts=0, next_eligible=0, last_error=NULL, updated=? "
+                "WHERE run_id=? AND ticker=? AND state=?",
+                [(self.PENDING, now, run_id, ticker, self.DONE) for ticker in tickers if ticker in existing])
+            self._conn.executemany(
+                "INSERT INTO update_jobs (run_id, ticker, state, updated) VALUES (?, ?, ?, ?)",
+                [(run_id, ticker, self.PENDING, now) for ticker in tickers if ticker not in existing])
+        return self.counts()
+
+    def claim(self):
+        """ Take the next pending job whose backoff has elapsed.
+
+        :return: a ticker symbol, or None if no job is eligible right now.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT ticker FROM update_jobs WHERE run_id=? AND state=? AND next_eligible<=? "
+                "ORDER BY next_eligible, rowid LIMIT 1",
+                (self.run_id, self.PENDING, time.time())).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE update_jobs SET state=?, updated=? WHERE run_id=? AND ticker=?",
+                (self.RUNNING, time.time(), self.run_id, row[0]))
+        return row[0]
+
+    def complete(self, ticker):
+        self._execute(
+            "UPDATE update_jobs SET state=?, last_error=NULL, updated=? WHERE run_id=? AND ticker=?",
+            (self.DONE, time.time(), self.run_id, ticker))
+
+    def fail(self, ticker, error):
+        """ Record a failed attempt and schedule a retry, or dead-letter the job once it's out of attempts.
+
+        :param ticker: the ticker symbol that failed.
+        :param error: the exception (or message) to record.
+        :return: seconds until the retry, or None if the job is now dead.
+        """
+        with self._lock, self._conn:
+            attempts = self._conn.execute(
+                "SELECT attempts FROM update_jobs WHERE run_id=? AND ticker=?", (self.run_id, ticker)).fetchone()[0] + 1
+            if attempts >= self.max_attempts:
+                state, delay = self.DEAD, None
+            else:
+                state, delay = self.PENDING, self.retry_delay(attempts)
+            self._conn.execute(
+                "UPDATE update_jobs SET state=?, attempts=?, next_eligible=?, last_error=?, updated=? "
+                "WHERE run_id=? AND ticker=?",
+                (state, attempts, time.time() + (delay or 0), repr(error)[:1000], time.time(), self.run_id, ticker))
+        return delay
+
+    def retry_delay(self, attempts):
+        """ :return: seconds to wait before retrying a job that has failed `attempts` times. """
+        # "equal jitter": half the exponential delay, plus a random amount up to the other half
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+    def seconds_until_next(self):
+        """ :return: seconds until the next pending job becomes eligible (0 if one already is), or None if no jobs
+        are pending. """
+        next_eligible = self._execute(
+            "SELECT MIN(next_eligible) FROM update_jobs WHERE run_id=? AND state=?",
+            (self.run_id, self.PENDING))[0][0]
+        return None if next_eligible is None else max(0.0, next_eligible - time.time())
+
+    def counts(self):
+        """ :return: dict of state -> number of jobs in the current run. """
+        return dict(self._execute(
+            "SELECT state, COUNT(*) FROM update_jobs WHERE run_id=? GROUP BY state", (self.run_id,)))
+
+    def dead_letters(self):
+        """ :return: list of (ticker, attempts, last_error) for dead jobs in the current run. """
+        return self._execute(
+            "SELECT ticker, attempts, last_error FROM update_jobs WHERE run_id=? AND state=? ORDER BY ticker",
+            (self.run_id, self.DEAD))
+
+    def close(self):
+        self._conn.close()
+
+
+class LeaseQueue(JobQueue):
+    """ Per-ticker work queue shared by any number of updater processes, on any number of hosts, kept in the
+    TickerLease table of the database being updated. It has the same interface as JobQueue, so updater.database_update()
+    takes either.
+
+    claim() leases a ticker to this process for lease_seconds with a conditional UPDATE, so two processes never
+    hold the same ticker. A heartbeat thread renews the process's leases while it runs; if the process dies, its
+    leases lapse and another process picks the tickers up, counting a failed attempt. Times come from the database
+    server's clock, so the hosts' clocks don't need to agree.
+    """
+
+    def __init__(
+            self,
+            connection_pool,
+            owner=None,
+            lease_seconds=300,
+            max_attempts=5,
+            base_delay=30.0,
+            max_delay=3600.0,
+            keep_days=7):
+        """
+        :param connection_pool: updater.ConnectionPool of the database holding the TickerLease table.
+        :param owner: name of this process in the lease table, by default hostname:pid.
+        :param lease_seconds: how long a claimed ticker stays leased without a heartbeat.
+        :param max_attempts: failures after which a job is dead-lettered.
+        :param base_delay: backoff in seconds after the first failure, doubled for each further one.
+        :param max_delay: upper bound on the backoff in seconds.
+        :param keep_days: jobs of runs not touched for this many days are purged.
+        """
+        self.owner = owner or "{}:{}".format(socket.gethostname(), os.getpid())
+        self.lease_seconds = int(lease_seconds)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.keep_days = keep_days
+        self.run_id = None
+        self._pool = connection_pool
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _execute(self, query, args=()):
+        # The cursor goes back to the pool (and to other threads) at the end of the with block, so read everything
+        # off it before that.
+        with self._pool.connection(timeout=60) as (sql_conn, sql_cursor):
+            sql_cursor.execute(query, args)
+            rows = sql_cursor.fetchall()
+            rowcount = sql_cursor.rowcount
+            sql_conn.commit()
+            return rows, rowcount
+
+    def seed(self, run_id, tickers):
+        """ Join (or start) a run over tickers. Other processes seeding the same run_id share its jobs.
+
+        Tickers the run doesn't have yet are added; existing jobs are never deleted or reset, since the list comes
+        from this process's own (possibly stale) snapshot and other processes may be running or have finished them.
+
+        :param run_id: identifies the run, e.g. "PRICES_DAILY:2020-01-03".
+        :param tickers: list of ticker symbols.
+        :return: dict of state -> number of jobs.
+        """
+        self.run_id = run_id
+        with self._pool.connection(timeout=60) as (sql_conn, sql_cursor):
+            sql_cursor.execute(
+                "DELETE FROM TickerLease WHERE RunID<>%s AND Updated < NOW() - INTERVAL %s DAY",
+                (run_id, self.keep_days))
+            sql_cursor.executemany(
+                "INSERT IGNORE INTO TickerLease (RunID, SecuritySymbol, State, NextEligible, Updated) "
+                "VALUES (%s, %s, %s, NOW(), NOW())",
+                [(run_id, ticker, self.PENDING) for ticker in tickers])
+            sql_conn.commit()
+
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew_leases, name="lease-heartbeat", daemon=True)
+            self._heartbeat.start()
+        return self.counts()
+
+    # A job is claimable once its backoff has elapsed, or when whoever held it stopped renewing the lease and it
+    # has an attempt left: a lapsed lease means its holder died on the ticker, which counts as a failed attempt.
+    _CLAIMABLE = "((State=%s AND NextEligible<=NOW()) OR (State=%s AND LeaseExpires<NOW() AND Attempts+1<%s))"
+
+    def claim(self):
+        """ Lease the next claimable job to this process. Taking over a lapsed lease counts as a failed attempt of
+        the job, and a job whose attempts that uses up is dead-lettered instead, so a ticker that keeps killing the
+        processes working on it (out of memory, crashes) is not leased forever.
+
+        :return: a ticker symbol, or None if no job is claimable right now.
+        """
+        self._execute(
+            "UPDATE TickerLease SET Attempts=Attempts+1, State=%s, LeaseExpires=NULL, "
+            "LastError=CONCAT('lease of ', Owner, ' expired'), Updated=NOW() "
+            "WHERE RunID=%s AND State=%s AND LeaseExpires<NOW() AND Attempts+1>=%s",
+            (self.DEAD, self.run_id, self.RUNNING, self.max_attempts))
+        claimable = (self.PENDING, self.RUNNING, self.max_attempts)
+        candidates, _ = self._execute(
+            "SELECT SecuritySymbol FROM TickerLease WHERE RunID=%s AND " + self._CLAIMABLE +
+            " ORDER BY NextEligible, SecuritySymbol LIMIT 20",
+            (self.run_id,) + claimable)
+        # Try the candidates in random order so processes claiming at the same moment rarely collide.
+        candidates = [row[0] for row in candidates]
+        random.shuffle(candidates)
+        for ticker in candidates:
+            # MySQL assigns left to right, so Attempts and LastError still see the job's state before the claim.
+            _, claimed = self._execute(
+                "UPDATE TickerLease SET Attempts=Attempts+IF(State=%s, 1, 0), "
+                "LastError=IF(State=%s, CONCAT('lease of ', Owner, ' expired'), LastError), "
+                "State=%s, Owner=%s, LeaseExpires=NOW() + INTERVAL %s SECOND, Updated=NOW() "
+                "WHERE RunID=%s AND SecuritySymbol=%s AND " + self._CLAIMABLE,
+                (self.RUNNING, self.RUNNING, self.RUNNING, self.owner, self.lease_seconds, self.run_id, ticker) +
+                claimable)
+            if claimed:
+                return ticker
+        return None
+
+    def complete(self, ticker):
+        """ Mark a job done. Does nothing if the lease has already passed to another process. """
+        self._execute(
+            "UPDATE TickerLease SET State=%s, LeaseExpires=NULL, LastError=NULL, Updated=NOW() "
+            "WHERE RunID=%s AND SecuritySymbol=%s AND Owner=%s",
+            (self.DONE, self.run_id, ticker, self.owner))
+
+    def fail(self, ticker, error):
+        """ Record a failed attempt and schedule a retry, or dead-letter the job once it's out of attempts. Does
+        nothing if the lease has already passed to another process.
+
+        :param ticker: the ticker symbol that failed.
+        :param error: the exception (or message) to record.
+        :return: seconds until the retry, or None if the job is now dead or no longer held by this process.
+        """
+        held = "RunID=%s AND SecuritySymbol=%s AND State=%s AND Owner=%s"
+        held_args = (self.run_id, ticker, self.RUNNING, self.owner)
+        rows, _ = self._execute("SELECT Attempts FROM TickerLease WHERE " + held, held_args)
+        if not rows:
+            return None
+        attempts = rows[0][0] + 1
+        if attempts >= self.max_attempts:
+            state, delay = self.DEAD, None
+        else:
+            state, delay = self.PENDING, self.retry_delay(attempts)
+        _, updated = self._execute(
+            "UPDATE TickerLease SET State=%s, Attempts=%s, NextEligible=NOW() + INTERVAL %s SECOND, "
+            "LeaseExpires=NULL, LastError=%s, Updated=NOW() "
+            "WHERE " + held + " AND Attempts=%s",
+            (state, attempts, int(round(delay or 0)), repr(error)[:1000]) + held_args + (attempts - 1,))
+        return delay if updated else None
+
+    def seconds_until_next(self):
+        """ :return: seconds until a job becomes claimable (0 if one already is), or None if every job is done or
+        dead. Jobs leased to other processes count, so this process stays around to take over if one of them
+        dies. """
+        rows, _ = self._execute(
+            "SELECT TIMESTAMPDIFF(SECOND, NOW(), MIN(IF(State=%s, NextEligible, LeaseExpires))) "
+            "FROM TickerLease WHERE RunID=%s AND State IN (%s, %s)",
+            (self.PENDING, self.run_id, self.PENDING, self.RUNNING))
+        return None if rows[0][0] is None else max(0.0, float(rows[0][0]))
+
+    def counts(self):
+        """ :return: dict of state -> number of jobs in the current run, across all processes. """
+        rows, _ = self._execute(
+            "SELECT State, COUNT(*) FROM TickerLease WHERE RunID=%s GROUP BY State", (self.run_id,))
+        return dict(rows)
+
+    def dead_letters(self):
+        """ :return: list of (ticker, attempts, last_error) for dead jobs in the current run. """
+        rows, _ = self._execute(
+            "SELECT SecuritySymbol, Attempts, LastError FROM TickerLease WHERE RunID=%s AND State=%s "
+            "ORDER BY SecuritySymbol",
+            (self.run_id, self.DEAD))
+        return list(rows)
+
+    def _renew_leases(self):
+        while not self._stop.wait(max(1, self.lease_seconds // 3)):
+            try:
+                self._execute(
+                    "UPDATE TickerLease SET LeaseExpires=NOW() + INTERVAL %s SECOND "
+                    "WHERE RunID=%s AND Owner=%s AND State=%s",
+                    (self.lease_seconds, self.run_id, self.owner, self.RUNNING))
+            except Exception:
+                pass  # try again on the next beat; the leases only lapse if every renewal fails
+
+    def close(self):
+        """ Stop renewing leases and hand any job this process still holds back to the other processes. """
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        if self.run_id is not None:
+            self._execute(
+                "UPDATE TickerLease SET State=%s, LeaseExpires=NULL, Updated=NOW() "
+                "WHERE RunID=%s AND Owner=%s AND State=%s",
+                (self.PENDING, self.run_id, self.owner, self.RUNNING))
@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+
+# A local, memory-mapped copy of the price tables for analytics reads that don't need to go through the database.
+
+
+class PriceMirror(object):
+    """ Local, column-oriented copy of DataSourcePriceObservation for analytics reads.
+
+    Each symbol gets a directory holding one raw binary file per column (SampleTime as datetime64[ns], prices and
+    volumes as float64) plus a small meta.json with the row count. Loading a symbol memory-maps the files, so it's
+    zero-copy and independent of history length, and a date-aligned multi-symbol panel is assembled with vectorized
+    index arithmetic. updater.database_update() appends the rows it has just written; rows that land before the end
+    of the stored history (re-fetches, backfills) trigger a merge and rewrite of that symbol only.
+    """
+
+    # The price columns of DataSourcePriceObservation, and the same columns as named in the dataframes from
+    # updater.load_data_from_alphavantage() (updater.ALPHAVANTAGE_COLUMNS).
+    COLUMNS = [
+        "OpenPrice", "HighPrice", "LowPrice", "ClosePrice", "AdjustedClosePrice", "Volume", "DividendAmount",
+        "SplitCoefficient"]
+    SOURCE_COLUMNS = [
+        "open", "high", "low", "close", "adjusted close", "volume", "dividend amount", "split coefficient"]
+
+    def __init__(self, root):
+        """
+        :param root: directory of the mirror for one database, e.g. ./mirror/PRICES_DAILY. Created if missing.
+        """
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, symbol, name=None):
+        return os.path.join(self.root, symbol) if name is None else os.path.join(self.root, symbol, name)
+
+    def _rows(self, symbol):
+        try:
+            with open(self._path(symbol, "meta.json")) as f:
+                return json.load(f)["rows"]
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _set_rows(self, symbol, rows):
+        tmp_path = self._path(symbol, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"rows": rows}, f)
+        os.replace(tmp_path, self._path(symbol, "meta.json"))
+
+    def symbols(self):
+        """ :return: sorted list of symbols in the mirror. """
+        return sorted(name for name in os.listdir(self.root) if self._rows(name) > 0)
+
+    def last_sample_time(self, symbol):
+        """ :return: the newest SampleTime mirrored for symbol, or None. """
+        rows = self._rows(symbol)
+        if not rows:
+            return None
+        return pd.Timestamp(self._memmap(symbol, "SampleTime", "datetime64[ns]", rows)[-1]).to_pydatetime()
+
+    def _memmap(self, symbol, column, dtype, rows):
+        if not rows:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._path(symbol, column + ".bin"), dtype=dtype, mode="r", shape=(rows,))
+
+    def load(self, symbol, columns=None):
+        """ Memory-map one symbol's history.
+
+        :param symbol: the ticker symbol.
+        :param columns: subset of PriceMirror.COLUMNS to load, default all.
+        :return: a Pandas dataframe indexed by SampleTime whose columns are read-only views of the mirror files.
+        """
+        columns = self.COLUMNS if columns is None else columns
+        rows = self._rows(symbol)
+        if not rows:
+            return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], name="SampleTime"), dtype=np.float64)
+        times = self._memmap(symbol, "SampleTime", "datetime64[ns]", rows)
+        data = OrderedDict((column, self._memmap(symbol, column, np.float64, rows)) for column in columns)
+        return pd.DataFrame(data, index=pd.DatetimeIndex(times, name="SampleTime", copy=False), copy=False)
+
+    def load_panel(self, symbols=None, column="AdjustedClosePrice", start=None, end=None):
+        """ Load one column for many symbols, aligned on the union of their sample times.
+
+        :param symbols: list of ticker symbols, default every symbol in the mirror.
+        :param column: one of PriceMirror.COLUMNS.
+        :param start: optional first SampleTime to include.
+        :param end: optional last SampleTime to include.
+        :return: a Pandas dataframe indexed by SampleTime with one column per symbol (NaN where a symbol has no bar).
+        """
+        symbols = self.symbols() if symbols is None else symbols
+        series = []
+        for symbol in symbols:
+            rows = self._rows(symbol)
+            times = self._memmap(symbol, "SampleTime", "datetime64[ns]", rows)
+            values = self._memmap(symbol, column, np.float64, rows)
+            lo = 0 if start is None else np.searchsorted(times, np.datetime64(pd.Timestamp(start)), side="left")
+            hi = len(times) if end is None else np.searchsorted(times, np.datetime64(pd.Timestamp(end)), side="right")
+            series.append((times[lo:hi], values[lo:hi]))
+
+        all_times = np.unique(np.concatenate([t for t, _ in series])) if series else np.array([], "datetime64[ns]")
+        panel = np.full((len(all_times), len(symbols)), np.nan)
+        for j, (times, values) in enumerate(series):
+            panel[np.searchsorted(all_times, times), j] = values
+        return pd.DataFrame(panel, index=pd.DatetimeIndex(all_times, name="SampleTime"), columns=symbols, copy=False)
+
+    def update(self, symbol, raw_data):
+        """ Add rows for symbol, appending in place when they are all newer than what is mirrored.
+
+        :param symbol: the ticker symbol.
+        :param raw_data: dataframe indexed by SampleTime with either COLUMNS or SOURCE_COLUMNS.
+        :return: no return value.
+        """
+        if raw_data is None or raw_data.empty:
+            return
+        if list(raw_data.columns[:len(self.SOURCE_COLUMNS)]) == self.SOURCE_COLUMNS:
+            raw_data = raw_data.iloc[:, :len(self.SOURCE_COLUMNS)].set_axis(self.COLUMNS, axis=1)
+        new = raw_data[self.COLUMNS].apply(pd.to_numeric, errors="coerce").astype(np.float64).sort_index()
+        new = new[~new.index.duplicated(keep="last")]
+
+        with self._lock:
+            os.makedirs(self._path(symbol), exist_ok=True)
+            rows = self._rows(symbol)
+            last = self.last_sample_time(symbol)
+            if last is not None and new.index[0] <= pd.Timestamp(last):
+                merged = pd.concat([self.load(symbol).copy(), new])
+                new = merged[~merged.index.duplicated(keep="last")].sort_index()
+                rows, mode = 0, "wb"
+            else:
+                mode = "ab"
+
+            self._write(symbol, "SampleTime", new.index.values.astype("datetime64[ns]"), rows, mode)
+            for column in self.COLUMNS:
+                self._write(symbol, column, new[column].values, rows, mode)
+            self._set_rows(symbol, rows + len(new))
+
+    def _write(self, symbol, column, values, rows, mode):
+        with open(self._path(symbol, column + ".bin"), mode) as f:
+            if mode == "ab":
+                # drop anything past the recorded row count, e.g. left by an interrupted append
+                f.truncate(rows * values.dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+            np.ascontiguousarray(values).tofile(f)
+
+    def remove(self, symbol):
+        """ Delete a symbol from the mirror. """
+        with self._lock:
+            shutil.rmtree(self._path(symbol), ignore_errors=True)
+
+    def sync_from_database(self, logger, sql_conn, symbol, last_sample_time=None):
+        """ Copy rows for symbol that are in the database but not yet in the mirror.
+
+        :param logger: a logging instance, e.g. logger.info or textEdit.append
+        :param sql_conn: active SQL server connection.
+        :param symbol: the ticker symbol.
+        :param last_sample_time: newest SampleTime in the database, if known, to skip symbols already in sync.
+        :return: number of rows copied.
+        """
+        mirrored = self.last_sample_time(symbol)
+        if last_sample_time is not None and mirrored is not None and mirrored >= last_sample_time:
+            return 0
+        sqlstr = """
+            SELECT
+                dspo.SampleTime, {}
+            FROM
+                DataSourcePriceObservation AS dspo
+            JOIN
+                SecurityMetaData AS smd ON dspo.SecurityMetaDataID=smd.SecurityMetaDataID
+            WHERE
+                smd.SecuritySymbol=%(symbol)s
+                AND
+                dspo.SampleTime > %(after)s
+            ORDER BY
+                dspo.SampleTime
+            """.format(", ".join("dspo." + column for column in self.COLUMNS))
+        data = pd.read_sql_query(
+            sql=sqlstr, con=sql_conn, index_col="SampleTime", parse_dates=["SampleTime"],
+            params={"symbol": symbol, "after": mirrored or dt(1900, 1, 1)})
+        if not data.empty:
+            logger("{}: copying {} rows into the local mirror".format(symbol, len(data)))
+            self.update(symbol, data)
+        return len(data)
@@ -0,0 +1,187 @@
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+
+import pymysql
+
+
+# In-memory (and optionally on-disk) cache of reporting results, invalidated by the DataGeneration counter that
+# updater.commit_data() bumps whenever prices or symbols change.
+
+
+class QueryCache(object):
+    """ Read-through cache of reporting results, for GUIs and notebooks that refresh the same reports over and over
+    while the data only changes when an update commits.
+
+    Results are keyed by database, report name and arguments, and stamped with the database's data generation
+    (GetDataGeneration(), bumped by updater.commit_data() in every update transaction). Each lookup costs one indexed
+    query for the generation; once it moves, everything computed before is dropped instead of served.
+
+    The memory tier keeps the most recently used results up to max_bytes (by their estimated size). With cache_dir,
+    results are also pickled to <cache_dir>/<database>/<generation>/, so several processes (or a restarted notebook)
+    share them, up to max_disk_bytes per database. Databases without the DataGeneration table (run MIGRATE_007)
+    are never cached. Callers get a copy of the cached result, so they may modify it.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, cache_dir=None, max_disk_bytes=2 * 1024 ** 3):
+        """
+        :param max_bytes: upper bound on the estimated size of the results held in memory.
+        :param cache_dir: optional directory for the shared on-disk tier. Created if missing.
+        :param max_disk_bytes: upper bound on the size of the pickles of one database in cache_dir.
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self._entries = OrderedDict()  # (database, key) -> (generation, size, result)
+        self._size = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(name, **args):
+        """ Canonical key for a report and its arguments. """
+        return "{}?{}".format(name, "&".join("{}={}".format(k, args[k]) for k in sorted(args)))
+
+    @staticmethod
+    def _sizeof(result):
+        if hasattr(result, "memory_usage"):
+            usage = result.memory_usage(deep=True)
+            return int(usage.sum() if hasattr(usage, "sum") else usage)
+        if isinstance(result, dict):
+            return sys.getsizeof(result) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in result.items())
+        return sys.getsizeof(result)
+
+    def generation(self, sql_conn):
+        """ The data generation of the connected database, or None if it has no DataGeneration counter. Entries of
+        older generations are dropped when a new one is seen.
+
+        :param sql_conn: active SQL server connection.
+        :return: (database name, generation or None).
+        """
+        database = sql_conn.db.decode() if isinstance(sql_conn.db, bytes) else str(sql_conn.db)
+        try:
+            with sql_conn.cursor() as sql_cursor:
+                sql_cursor.execute("SELECT GetDataGeneration()")
+                generation = sql_cursor.fetchone()[0]
+        except pymysql.err.MySQLError:
+            return database, None
+        if generation is None:
+            return database, None
+
+        with self._lock:
+            if self._generations.get(database) == generation:
+                return database, generation
+            self._generations[database] = generation
+            for cache_key in [k for k, entry in self._entries.items() if k[0] == database and entry[0] != generation]:
+                self._size -= self._entries.pop(cache_key)[1]
+        if self.cache_dir is not None:
+            database_dir = os.path.join(self.cache_dir, database)
+            if os.path.isdir(database_dir):
+                for name in os.listdir(database_dir):
+                    if name != str(generation):
+                        shutil.rmtree(os.path.join(database_dir, name), ignore_errors=True)
+        return database, generation
+
+    def _disk_path(self, database, generation, key):
+        return os.path.join(
+            self.cache_dir, database, str(generation), hashlib.sha256(key.encode()).hexdigest() + ".pkl")
+
+    def _load(self, path):
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _save(self, path, result):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        # Evict the least recently written pickles of this database beyond max_disk_bytes.
+        database_dir = os.path.dirname(os.path.dirname(path))
+        files = []
+        for root, _, names in os.walk(database_dir):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        total = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            total -= size
+
+    def _remember(self, database, key, generation, result):
+        size = self._sizeof(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop((database, key), None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[(database, key)] = (generation, size, result)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._size -= self._entries.popitem(last=False)[1][1]
+
+    def get_or_compute(self, sql_conn, name, compute, **args):
+        """ The cached result of a report for the current data generation, computed (and cached) if missing.
+
+        :param sql_conn: active SQL server connection.
+        :param name: report name, e.g. the function's name.
+        :param compute: function without arguments that computes the result.
+        :param args: the arguments that determine the result, part of the key.
+        :return: a copy of the result.
+        """
+        database, generation = self.generation(sql_conn)
+        if generation is None:
+            self.uncached += 1
+            return compute()
+
+        key = self.make_key(name, **args)
+        with self._lock:
+            entry = self._entries.get((database, key))
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end((database, key))
+                self.hits += 1
+                return entry[2].copy()
+
+        result = None
+        path = self._disk_path(database, generation, key) if self.cache_dir is not None else None
+        if path is not None and os.path.exists(path):
+            result = self._load(path)
+        if result is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            result = compute()
+            if path is not None:
+                self._save(path, result)
+        self._remember(database, key, generation, result)
+        return result.copy()
+
+    def clear(self):
+        """ Drop every result held in memory (the on-disk tier is left to the generation check). """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._generations.clear()
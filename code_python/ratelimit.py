@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Client-side API quota: RateLimiter paces the calls of every fetch thread of a run, and ApiKeyPool spreads them
+# over several API keys with quotas of their own.
+
+
+class RateLimiter(object):
+    """ Token-bucket rate limiter shared by every thread that calls a data source's API.
+
+    One bucket is refilled at calls_per_minute / 60 tokens per second and, if calls_per_day is given, a second
+    bucket is refilled at calls_per_day / 86400 tokens per second. A call may proceed once both buckets hold a
+    token. The per-minute bucket only holds `burst` tokens, so the default of 1 spaces calls evenly and never
+    exceeds the quota over any 60 second window. The per-day bucket starts full.
+    """
+
+    def __init__(self, calls_per_minute, calls_per_day=None, burst=1):
+        """
+        :param calls_per_minute: requests per minute allowed by the API plan.
+        :param calls_per_day: requests per day allowed by the API plan, or None if there is no daily quota.
+        :param burst: number of calls that may be made back-to-back before throttling kicks in.
+        """
+        self.calls_per_minute = calls_per_minute
+        self.calls_per_day = calls_per_day
+        # each bucket is [tokens, capacity, tokens added per second]
+        self._buckets = [[float(burst), float(burst), calls_per_minute / 60.0]]
+        if calls_per_day:
+            self._buckets.append([float(calls_per_day), float(calls_per_day), calls_per_day / 86400.0])
+        self._lock = threading.Lock()
+        self._last_refill = time.time()
+        self.started = self._last_refill
+        self.calls = 0
+        self.seconds_waited = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        for bucket in self._buckets:
+            bucket[0] = min(bucket[1], bucket[0] + elapsed * bucket[2])
+
+    def try_acquire(self):
+        """ Consume a token from each bucket if a call is allowed right now, without blocking.
+
+        :return: 0 if the call may proceed, otherwise the seconds until it would be allowed.
+        """
+        with self._lock:
+            self._refill(time.time())
+            shortfall = max((1.0 - tokens) / rate for tokens, _, rate in self._buckets)
+            if shortfall <= 0:
+                for bucket in self._buckets:
+                    bucket[0] -= 1.0
+                self.calls += 1
+                return 0.0
+            return shortfall
+
+    def acquire(self):
+        """ Block until a call is allowed, then consume a token from each bucket.
+
+        :return: the number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            shortfall = self.try_acquire()
+            if shortfall <= 0:
+                with self._lock:
+                    self.seconds_waited += waited
+                return waited
+            time.sleep(shortfall)
+            waited += shortfall
+
+    def requests_per_second(self):
+        elapsed = time.time() - self.started
+        return self.calls / elapsed if elapsed > 0 else 0.0
+
+
+class ApiKeyPool(object):
+    """ Several API keys for one data source, each with its own RateLimiter (and so its own quota).
+
+    acquire_key() hands out whichever key can make a call soonest, so the pool's throughput is the sum of the keys'
+    quotas and a key whose daily quota is used up is simply skipped. It can stand in for a RateLimiter anywhere
+    one is accepted: updater.load_data_from_alphavantage() then takes the key from the pool instead of using its
+    api_key.
+    """
+
+    def __init__(self, limiters):
+        """
+        :param limiters: dict of API key -> RateLimiter.
+        """
+        if not limiters:
+            raise ValueError("ApiKeyPool needs at least one API key")
+        self.limiters = OrderedDict(limiters)
+        self.started = time.time()
+        self.seconds_waited = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, api_keys, calls_per_minute, calls_per_day=None, burst=1):
+        """ Build a pool from the api_keys list returned by updater.parse_creds().
+
+        :param api_keys: list of dicts with a 'key' and optionally its own 'calls_per_minute'/'calls_per_day'.
+        :param calls_per_minute: quota of keys that don't set their own.
+        :param calls_per_day: daily quota of keys that don't set their own, or None.
+        :param burst: see RateLimiter.
+        :return: an ApiKeyPool.
+        """
+        return cls(OrderedDict(
+            (api_key['key'], RateLimiter(
+                calls_per_minute=api_key.get('calls_per_minute') or calls_per_minute,
+                calls_per_day=api_key.get('calls_per_day') or calls_per_day,
+                burst=burst))
+            for api_key in api_keys))
+
+    @property
+    def calls(self):
+        return sum(limiter.calls for limiter in self.limiters.values())
+
+    def _acquire(self):
+        waited = 0.0
+        while True:
+            shortfalls = []
+            for key, limiter in self.limiters.items():
+                shortfall = limiter.try_acquire()
+                if shortfall <= 0:
+                    with self._lock:
+                        self.seconds_waited += waited
+                    return key, waited
+                shortfalls.append(shortfall)
+            time.sleep(min(shortfalls))
+            waited += min(shortfalls)
+
+    def acquire_key(self):
+        """ Block until one of the keys may make a call, and consume a token from it.
+
+        :return: the API key to use.
+        """
+        return self._acquire()[0]
+
+    def acquire(self):
+        """ RateLimiter interface: wait for a call on any key, without saying which.
+
+        :return: the number of seconds spent waiting.
+        """
+        return self._acquire()[1]
+
+    def requests_per_second(self):
+        elapsed = time.time() - self.started
+        return self.calls / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime as dt
+
+from tradingcalendar import next_market_close
+
+
+# On-disk cache of raw data source responses, so a crashed or re-queued run doesn't spend API calls on data it has
+# already downloaded.
+
+
+@contextmanager
+def sqlite_connection(path):
+    """ Open a local SQLite database, commit (or roll back) when the block exits, and always close it.
+
+    :param path: path of the SQLite file.
+    :return: a sqlite3 connection.
+    """
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+
+
+class ResponseCache(object):
+    """ Compressed, content-addressed on-disk cache of raw data source responses.
+
+    Response bodies are gzipped into blobs/<sha256 of body>.gz, so identical payloads are only stored once, and a
+    SQLite index maps each request key (function, symbol, interval, outputsize) to its blob. Entries expire at the
+    next market close after they were fetched, since that is when new bars appear. Once the blobs exceed max_bytes,
+    the least recently used entries are evicted.
+
+    With offline=True, every request is served from the cache regardless of age and nothing goes to the network,
+    so whole update runs can be replayed from earlier payloads at zero API cost.
+    """
+
+    def __init__(self, cache_dir="./cache", max_bytes=2 * 1024 ** 3, offline=False):
+        """
+        :param cache_dir: directory holding the index and blobs. Created if missing.
+        :param max_bytes: upper bound on the compressed size of all blobs.
+        :param offline: if True, ignore expiry and never fetch (see updater.load_data_from_alphavantage()).
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.join(cache_dir, "blobs"), exist_ok=True)
+        with self._index() as index:
+            index.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    fetched REAL NOT NULL,
+                    expires REAL NOT NULL,
+                    last_used REAL NOT NULL)
+                """)
+
+    @staticmethod
+    def make_key(**fields):
+        """ Canonical key for a request. The API key is deliberately not part of it. """
+        return "&".join("{}={}".format(k, fields[k]) for k in sorted(fields) if fields[k] is not None)
+
+    def _index(self):
+        # One short-lived connection per operation keeps the cache safe to share between threads and processes.
+        return sqlite_connection(os.path.join(self.cache_dir, "index.sqlite"))
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.cache_dir, "blobs", content_hash + ".gz")
+
+    def get(self, key):
+        """ Return the cached body for key, or None if there is no fresh entry.
+
+        :param key: a key from make_key().
+        :return: bytes or None.
+        """
+        now = time.time()
+        with self._index() as index:
+            row = index.execute("SELECT content_hash, expires FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None or (row[1] <= now and not self.offline):
+                self.misses += 1
+                return None
+            try:
+                with gzip.open(self._blob_path(row[0]), "rb") as f:
+                    body = f.read()
+            except (IOError, OSError):
+                index.execute("DELETE FROM responses WHERE key=?", (key,))
+                self.misses += 1
+                return None
+            index.execute("UPDATE responses SET last_used=? WHERE key=?", (now, key))
+        self.hits += 1
+        return body
+
+    def put(self, key, body):
+        """ Store body under key and evict old entries if the cache is over its size limit.
+
+        :param key: a key from make_key().
+        :param body: raw response bytes.
+        """
+        now = time.time()
+        content_hash = hashlib.sha256(body).hexdigest()
+        path = self._blob_path(content_hash)
+        if not os.path.exists(path):
+            tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        with self._index() as index:
+            index.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, content_hash, os.path.getsize(path), now, next_market_close(dt.now()).timestamp(), now))
+        self.evict()
+
+    def evict(self):
+        """ Drop least recently used entries until the blobs fit in max_bytes. """
+        with self._index() as index:
+            blobs = index.execute("""
+                SELECT content_hash, MAX(size), MAX(last_used) AS used
+                FROM responses
+                GROUP BY content_hash
+                ORDER BY used ASC
+                """).fetchall()
+            total = sum(size for _, size, _ in blobs)
+            for content_hash, size, _ in blobs:
+                if total <= self.max_bytes:
+                    break
+                index.execute("DELETE FROM responses WHERE content_hash=?", (content_hash,))
+                try:
+                    os.remove(self._blob_path(content_hash))
+                except OSError:
+                    pass
+                total -= size
@@ -0,0 +1,235 @@
+import gzip
+import os
+import time
+from datetime import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pymysql
+
+
+# Reads of query results of any size at constant memory, on unbuffered server-side cursors, and exports of the
+# stored prices to partitioned CSV or Parquet files built on them.
+
+# Price columns of DataSourcePriceObservation, as in updater.PRICE_OBSERVATION_COLUMNS.
+PRICE_COLUMNS = [
+    "OpenPrice",
+    "HighPrice",
+    "LowPrice",
+    "ClosePrice",
+    "AdjustedClosePrice",
+    "Volume",
+    "DividendAmount",
+    "SplitCoefficient",
+]
+
+
+EXPORT_FORMATS = ["csv", "parquet"]
+EXPORT_PARTITIONS = ["symbol", "year", "month"]
+
+
+def stream_query(sql_conn, query, params=None, chunk_rows=100000, dtypes=None, parse_dates=None):
+    """ Run a query on an unbuffered server-side cursor and yield its result in dataframes of chunk_rows rows.
+
+    Rows are pulled from the server as they are consumed, so memory use is bounded by one chunk however large the
+    result. The connection can't run anything else until the generator is exhausted or closed (closing it early
+    makes the server skip the unread rows).
+
+    :param sql_conn: active SQL server connection.
+    :param query: SQL query, with %(name)s or %s placeholders for params.
+    :param params: optional query parameters.
+    :param chunk_rows: rows per yielded dataframe.
+    :param dtypes: optional dict of column -> dtype to cast each chunk to, e.g. np.float64 for price columns so a
+        chunk of NULLs isn't typed as object.
+    :param parse_dates: optional list of columns converted to datetime64.
+    :return: generator of Pandas dataframes.
+    """
+    sql_cursor = sql_conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        sql_cursor.execute(query, params)
+        columns = [column[0] for column in sql_cursor.description]
+        while True:
+            rows = sql_cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            chunk = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            for column in parse_dates or []:
+                chunk[column] = pd.to_datetime(chunk[column])
+            if dtypes:
+                chunk = chunk.astype(dtypes)
+            yield chunk
+    finally:
+        sql_cursor.close()
+
+
+def stream_price_observations(sql_conn, symbols=None, start=None, end=None, chunk_rows=100000):
+    """ Stream stored prices in (SecurityMetaDataID, SampleTime) order, which is the table's primary key order, so
+    the server reads them without sorting. Each symbol's rows are contiguous and in time order, but the symbols
+    come in SecurityMetaDataID order, not alphabetically.
+
+    :param sql_conn: active SQL server connection, used exclusively until the stream ends.
+    :param symbols: optional list of symbols, default all.
+    :param start: optional first SampleTime to include.
+    :param end: optional last SampleTime to include.
+    :param chunk_rows: rows per yielded dataframe.
+    :return: generator of Pandas dataframes with SecuritySymbol, SampleTime and the price columns as float64.
+    """
+    price_columns = PRICE_COLUMNS
+    conditions = ["dspo.SampleTime BETWEEN %(start)s AND %(end)s"]
+    params = {"start": start or dt(1900, 1, 1), "end": end or dt(2100, 1, 1)}
+    if symbols:
+        conditions.append("smd.SecuritySymbol IN %(symbols)s")
+        params["symbols"] = list(symbols)
+    sqlstr = """
+        SELECT
+            smd.SecuritySymbol, dspo.SampleTime, {}
+        FROM
+            DataSourcePriceObservation AS dspo
+        JOIN
+            SecurityMetaData AS smd ON dspo.SecurityMetaDataID=smd.SecurityMetaDataID
+        WHERE
+            {}
+        ORDER BY
+            dspo.SecurityMetaDataID, dspo.SampleTime
+        """.format(", ".join("dspo." + column for column in price_columns), " AND ".join(conditions))
+    return stream_query(
+        sql_conn, sqlstr, params=params, chunk_rows=chunk_rows,
+        dtypes={column: np.float64 for column in price_columns}, parse_dates=["SampleTime"])
+
+
+def _partition_keys(chunk, partition):
+    keys = [chunk["SecuritySymbol"]]
+    if partition in ("year", "month"):
+        keys.append(chunk["SampleTime"].dt.year)
+    if partition == "month":
+        keys.append(chunk["SampleTime"].dt.month)
+    return keys
+
+
+def _partition_path(out_dir, key, partition, fmt, compression):
+    key = key if isinstance(key, tuple) else (key,)
+    parts = ["SecuritySymbol={}".format(key[0])]
+    if partition in ("year", "month"):
+        parts.append("Year={}".format(key[1]))
+    if partition == "month":
+        parts.append("Month={:02d}".format(key[2]))
+    suffix = ".csv.gz" if fmt == "csv" and compression == "gzip" else "." + fmt
+    return os.path.join(out_dir, *parts) + suffix
+
+
+class _PartitionFile(object):
+    """ One export file, written chunk by chunk under a .tmp name and renamed into place by close(). """
+
+    def __init__(self, path, fmt, compression):
+        self.path = path
+        self.fmt = fmt
+        self.compression = compression
+        self._tmp_path = path + ".tmp"
+        self._file = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(self, chunk):
+        if self.fmt == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if self._file is None:
+                self._file = pyarrow.parquet.ParquetWriter(
+                    self._tmp_path, table.schema, compression=self.compression or "none")
+            self._file.write_table(table)
+        else:
+            header = self._file is None
+            if header:
+                self._file = gzip.open(self._tmp_path, "wt", newline="") if self.compression == "gzip" else open(
+                    self._tmp_path, "w", newline="")
+            chunk.to_csv(self._file, header=header, index=False, date_format="%Y-%m-%d %H:%M:%S")
+
+    def close(self):
+        """ :return: size of the finished file in bytes. """
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return os.path.getsize(self.path)
+
+    def abort(self):
+        try:
+            if self._file is not None:
+                self._file.close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+def export_price_observations(
+        logger,
+        sql_conn,
+        out_dir,
+        fmt="csv",
+        partition="year",
+        compression="gzip",
+        chunk_rows=100000,
+        symbols=None,
+        start=None,
+        end=None):
+    """ Dump stored prices to partitioned, compressed files at constant memory.
+
+    Rows are streamed with stream_price_observations() and written to a hive-style tree, e.g.
+    out_dir/SecuritySymbol=SPY/Year=2020.csv.gz. Rows arrive in (SecurityMetaDataID, SampleTime) order, so each
+    symbol's rows are contiguous, each partition is written start to finish and only one file is open at a time;
+    memory use is one chunk whatever the database size. Files are written under a .tmp name and renamed when
+    complete.
+
+    :param logger: a logging instance, e.g. logger.info or textEdit.append
+    :param sql_conn: active SQL server connection, used exclusively until the export ends.
+    :param out_dir: directory to export to. Created if missing.
+    :param fmt: one of EXPORT_FORMATS. "parquet" needs pyarrow.
+    :param partition: one of EXPORT_PARTITIONS: a file per symbol, per symbol and year, or per symbol and month.
+    :param compression: "gzip" or None for CSV; a Parquet codec ("snappy", "zstd", "gzip") or None for Parquet.
+    :param chunk_rows: rows fetched from the server and written at a time.
+    :param symbols: optional list of symbols, default all.
+    :param start: optional first SampleTime to include.
+    :param end: optional last SampleTime to include.
+    :return: dict with the rows, files and bytes written and the elapsed seconds.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("fmt must be one of {}".format(EXPORT_FORMATS))
+    if partition not in EXPORT_PARTITIONS:
+        raise ValueError("partition must be one of {}".format(EXPORT_PARTITIONS))
+    if fmt == "csv" and compression not in ("gzip", None):
+        raise ValueError("CSV exports are gzip compressed or not at all")
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    stats = {"rows": 0, "files": 0, "bytes": 0, "seconds": 0.0}
+    start_time = last_progress = time.time()
+    current = None
+    try:
+        for chunk in stream_price_observations(sql_conn, symbols=symbols, start=start, end=end, chunk_rows=chunk_rows):
+            for key, rows in chunk.groupby(_partition_keys(chunk, partition), sort=False):
+                path = _partition_path(out_dir, key, partition, fmt, compression)
+                if current is None or current.path != path:
+                    if current is not None:
+                        stats["bytes"] += current.close()
+                        stats["files"] += 1
+                    current = _PartitionFile(path, fmt, compression)
+                current.write(rows)
+            stats["rows"] += len(chunk)
+            if time.time() - last_progress > 30:
+                logger("... exported {} rows ({:.0f} rows/sec)".format(
+                    stats["rows"], stats["rows"] / (time.time() - start_time)))
+                last_progress = time.time()
+        if current is not None:
+            stats["bytes"] += current.close()
+            stats["files"] += 1
+            current = None
+    finally:
+        if current is not None:
+            current.abort()  # an incomplete partition is never left under its final name
+
+    stats["seconds"] = time.time() - start_time
+    logger("Exported {} rows to {} files ({:.1f} MB) in {:.1f} seconds ({:.0f} rows/sec)".format(
+        stats["rows"], stats["files"], stats["bytes"] / 1024.0 ** 2, stats["seconds"],
+        stats["rows"] / stats["seconds"] if stats["seconds"] > 0 else float("inf")))
+    return stats
@@ -0,0 +1,205 @@
+import multiprocessing
+import os
+import time
+import unittest
+from contextlib import ExitStack
+
+import benchmark
+import jobqueue
+import updater
+
+
+# Multi-process tests of LeaseQueue against a throwaway database on a local MySQL/MariaDB server (see
+# benchmark.throwaway_database). The server login comes from the MYSQL_HOST / MYSQL_PORT / MYSQL_USER /
+# MYSQL_PASSWORD environment variables, or else the PRICES_DAILY login in creds.yaml; without a reachable server the
+# tests are skipped.
+#
+#     python -m pytest -q test_lease_queue.py
+
+
+def server_login():
+    """ :return: dict of host, port, user and password of the test server, or None if there is none to reach. """
+    login = {
+        "host": os.environ.get("MYSQL_HOST"),
+        "port": int(os.environ.get("MYSQL_PORT", 3306)),
+        "user": os.environ.get("MYSQL_USER"),
+        "password": os.environ.get("MYSQL_PASSWORD", ""),
+    }
+    if login["host"] is None:
+        try:
+            db_info, _ = updater.parse_creds(updater.cred_file, database_name="PRICES_DAILY")
+        except (IOError, KeyError):
+            return None
+        login.update(host=db_info["host"], user=db_info["user"], password=db_info["password"])
+    try:
+        updater.pymysql.connect(**login).close()
+    except updater.pymysql.err.Error:
+        return None
+    return login
+
+
+def lease_queue(login, database, owner, lease_seconds=60, **kwargs):
+    pool = updater.ConnectionPool(database=database, size=2, **login)
+    return jobqueue.LeaseQueue(pool, owner=owner, lease_seconds=lease_seconds, **kwargs)
+
+
+def drain_worker(login, database, owner, run_id, tickers, results):
+    # Join the run and work through it until no job is left, reporting every ticker this process claimed.
+    job_queue = lease_queue(login, database, owner)
+    job_queue.seed(run_id, tickers)
+    while True:
+        ticker = job_queue.claim()
+        if ticker is None:
+            if job_queue.seconds_until_next() is None:
+                break
+            time.sleep(0.1)
+            continue
+        results.put((owner, ticker))
+        time.sleep(0.01)  # the "fetch"
+        job_queue.complete(ticker)
+    job_queue.close()
+
+
+def hold_worker(login, database, owner, run_id, tickers, results):
+    # Claim one ticker and keep the lease alive (heartbeat) until killed.
+    job_queue = lease_queue(login, database, owner, lease_seconds=2)
+    job_queue.seed(run_id, tickers)
+    results.put((owner, job_queue.claim()))
+    time.sleep(3600)
+
+
+class LeaseQueueTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.login = server_login()
+        if cls.login is None:
+            raise unittest.SkipTest("no MySQL/MariaDB server available")
+        cls.resources = ExitStack()
+        cls.database = cls.resources.enter_context(benchmark.throwaway_database(
+            lambda message: None, cls.login["host"], cls.login["user"], cls.login["password"],
+            port=cls.login["port"]))
+        cls.context = multiprocessing.get_context("spawn")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.resources.close()
+
+    def start(self, target, owner, run_id, tickers, results):
+        process = self.context.Process(
+            target=target, args=(self.login, self.database, owner, run_id, tickers, results), daemon=True)
+        process.start()
+        return process
+
+    def test_no_ticker_claimed_twice(self):
+        tickers = ["T{:03d}".format(i) for i in range(60)]
+        results = self.context.Queue()
+        # Every process seeds from its own (partly overlapping) list, as processes with different snapshots would.
+        processes = [self.start(drain_worker, "worker-{}".format(i), "claims", tickers[i * 10:], results)
+                     for i in range(4)]
+        claims = []
+        while len(claims) < len(tickers):
+            claims.append(results.get(timeout=120)[1])
+        for process in processes:
+            process.join(timeout=60)
+            self.assertEqual(process.exitcode, 0)
+
+        self.assertEqual(len(claims), len(set(claims)))
+        self.assertEqual(set(claims), set(tickers))
+        job_queue = lease_queue(self.login, self.database, "checker")
+        job_queue.run_id = "claims"
+        self.assertEqual(job_queue.counts(), {jobqueue.JobQueue.DONE: len(tickers)})
+
+    def test_expired_lease_is_reclaimed(self):
+        results = self.context.Queue()
+        process = self.start(hold_worker, "doomed", "expiry", ["SPY"], results)
+        owner, ticker = results.get(timeout=60)
+        self.assertEqual(ticker, "SPY")
+
+        survivor = lease_queue(self.login, self.database, "survivor")
+        survivor.seed("expiry", ["SPY"])
+        time.sleep(3)
+        self.assertIsNone(survivor.claim(), "a lease kept alive by its heartbeat was taken over")
+
+        process.kill()
+        process.join()
+        deadline = time.time() + 10
+        reclaimed = None
+        while reclaimed is None and time.time() < deadline:
+            reclaimed = survivor.claim()
+            time.sleep(0.5)
+        self.assertEqual(reclaimed, "SPY")
+        survivor.complete("SPY")
+        self.assertEqual(survivor.counts(), {jobqueue.JobQueue.DONE: 1})
+        survivor.close()
+
+    def test_ticker_that_keeps_killing_workers_is_dead_lettered(self):
+        results = self.context.Queue()
+        survivor = lease_queue(self.login, self.database, "survivor", max_attempts=2)
+        survivor.seed("crashes", ["BOOM"])
+        for owner in ["doomed-1", "doomed-2"]:
+            process = self.start(hold_worker, owner, "crashes", ["BOOM"], results)
+            self.assertEqual(results.get(timeout=60), (owner, "BOOM"))
+            process.kill()
+            process.join()
+            time.sleep(3)  # the lease lapses
+
+        # doomed-2's takeover of the lapsed lease was the first failed attempt, its own death the second.
+        self.assertIsNone(survivor.claim())
+        self.assertEqual(survivor.dead_letters(), [("BOOM", 2, "lease of doomed-2 expired")])
+        self.assertIsNone(survivor.seconds_until_next())
+        survivor.close()
+
+    def test_fail_after_losing_the_lease_does_nothing(self):
+        # Never seeded, so no heartbeat keeps the lease alive: the process stalls past it.
+        stalled = lease_queue(self.login, self.database, "stalled", lease_seconds=1)
+        stalled.run_id = "lost"
+        other = lease_queue(self.login, self.database, "other")
+        other.seed("lost", ["LATE"])
+        self.assertEqual(stalled.claim(), "LATE")
+        time.sleep(2.5)
+        self.assertEqual(other.claim(), "LATE")
+
+        self.assertIsNone(stalled.fail("LATE", RuntimeError("too late")))
+        self.assertEqual(other.counts(), {jobqueue.JobQueue.RUNNING: 1})
+        self.assertIsNotNone(other.fail("LATE", RuntimeError("retry")))
+        self.assertEqual(other.counts(), {jobqueue.JobQueue.PENDING: 1})
+        other.close()
+
+    def test_complete_and_seed_leave_other_leases_alone(self):
+        first = lease_queue(self.login, self.database, "first")
+        second = lease_queue(self.login, self.database, "second")
+        first.seed("owners", ["AAA", "BBB"])
+        ticker = first.claim()
+        first.complete(ticker)
+
+        # A later process with a stale list neither drops nor resets the jobs of the run.
+        second.seed("owners", ["BBB"])
+        self.assertEqual(second.counts(), {jobqueue.JobQueue.DONE: 1, jobqueue.JobQueue.PENDING: 1})
+
+        other = second.claim()
+        first.complete(other)
+        self.assertEqual(second.counts(), {jobqueue.JobQueue.DONE: 1, jobqueue.JobQueue.RUNNING: 1})
+        second.complete(other)
+        self.assertEqual(second.counts(), {jobqueue.JobQueue.DONE: 2})
+        first.close()
+        second.close()
+
+    def test_fail_dead_letters_after_max_attempts(self):
+        job_queue = lease_queue(self.login, self.database, "failer", max_attempts=3, base_delay=0, max_delay=0)
+        job_queue.seed("failures", ["BAD"])
+        delays = []
+        for _ in range(3):
+            self.assertEqual(job_queue.claim(), "BAD")
+            delays.append(job_queue.fail("BAD", RuntimeError("boom")))
+        self.assertIsNotNone(delays[0])
+        self.assertIsNotNone(delays[1])
+        self.assertIsNone(delays[2])
+        self.assertIsNone(job_queue.claim())
+        self.assertIsNone(job_queue.seconds_until_next())
+        self.assertEqual([(ticker, attempts) for ticker, attempts, _ in job_queue.dead_letters()], [("BAD", 3)])
+        job_queue.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import pandas as pd
+
+import tradingcalendar
+
+
+# Tests of the AlphaVantage request planner against the NYSE calendar; they need no database or network.
+#
+#     python -m pytest -q test_plan_requests.py
+
+
+def exchange_time(when):
+    return pd.Timestamp(when).tz_localize("America/New_York")
+
+
+def sessions(*days):
+    return pd.DatetimeIndex([pd.Timestamp(day) for day in days])
+
+
+class PlanRequestsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calendar = tradingcalendar.nyse_calendar()
+
+    def plan(self, last_session, missing, interval, now):
+        return tradingcalendar.plan_requests(self.calendar, pd.Timestamp(last_session), missing, interval=interval,
+                                     now=exchange_time(now))
+
+    def test_evening_run_fetches_the_whole_session(self):
+        # By 19:00 the latest 100 5min bars start at 10:45, so a compact response would lose the morning.
+        self.assertEqual(self.calendar.extended_bars("2026-10-16", when=exchange_time("2026-10-16 19:00"),
+                                                     interval="5min"), 180)
+        self.assertEqual(self.plan("2026-10-16", sessions("2026-10-16"), "5min", "2026-10-16 19:00"),
+                         [{'outputsize': "full", 'month': None}])
+
+    def test_evening_run_uses_compact_when_it_reaches_back(self):
+        # 60min bars: 16 for each of the two whole sessions and 15 up to 19:00.
+        self.assertEqual(self.plan("2026-10-16", sessions("2026-10-14", "2026-10-15", "2026-10-16"), "60min",
+                                   "2026-10-16 19:00"),
+                         [{'outputsize': "compact", 'month': None}])
+
+    def test_early_close_ends_post_market_at_17(self):
+        # 52 15min bars on the day after Thanksgiving (04:00 to 17:00) and 44 pre-market and morning bars of the
+        # Monday after fit in one compact response; two whole sessions would not.
+        self.assertEqual(self.calendar.extended_bars("2025-11-28", when=exchange_time("2025-11-29 12:00"),
+                                                     interval="15min"), 52)
+        self.assertEqual(self.plan("2025-11-28", sessions("2025-11-28"), "15min", "2025-12-01 15:00"),
+                         [{'outputsize': "compact", 'month': None}])
+        self.assertEqual(self.plan("2025-11-28", sessions("2025-11-26", "2025-11-28"), "15min",
+                                   "2025-12-01 15:00"),
+                         [{'outputsize': "full", 'month': None}])
+
+    def test_daily_counts_one_bar_per_session(self):
+        self.assertEqual(self.plan("2026-10-16", sessions("2026-10-16"), None, "2026-10-16 19:00"),
+                         [{'outputsize': "compact", 'month': None}])
+        self.assertEqual(self.plan("2026-10-16", sessions("2020-01-02"), None, "2026-10-16 19:00"),
+                         [{'outputsize': "full", 'month': None}])
+
+
+if __name__ == "__main__":
+    unittest.main()
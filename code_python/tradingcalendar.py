@@ -0,0 +1,350 @@
+from datetime import date, timedelta, datetime as dt
+
+import numpy as np
+import pandas as pd
+
+
+# The NYSE trading calendar, computed from the exchange's rules, and the decisions the updater makes with it: which
+# tickers are already current, which sessions each one is missing and which AlphaVantage requests cover them.
+
+
+# Market-wide NYSE closures outside the regular holiday rules (national days of mourning, 9/11, Hurricane Sandy).
+NYSE_SPECIAL_CLOSURES = {
+    date(1994, 4, 27): "National Day of Mourning for Richard Nixon",
+    date(2001, 9, 11): "September 11 attacks",
+    date(2001, 9, 12): "September 11 attacks",
+    date(2001, 9, 13): "September 11 attacks",
+    date(2001, 9, 14): "September 11 attacks",
+    date(2004, 6, 11): "National Day of Mourning for Ronald Reagan",
+    date(2007, 1, 2): "National Day of Mourning for Gerald Ford",
+    date(2012, 10, 29): "Hurricane Sandy",
+    date(2012, 10, 30): "Hurricane Sandy",
+    date(2018, 12, 5): "National Day of Mourning for George H.W. Bush",
+    date(2025, 1, 9): "National Day of Mourning for Jimmy Carter",
+}
+
+
+def easter_sunday(year):
+    """ Date of Easter Sunday in the Gregorian calendar (anonymous Gregorian algorithm). """
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def nth_weekday(year, month, weekday, n):
+    """ Date of the n-th `weekday` (0 is Monday) of a month, or the last one if n is -1. """
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def observed(holiday):
+    """ NYSE observance of a fixed-date holiday: Friday before if it falls on a Saturday, Monday after if Sunday. """
+    if holiday.weekday() == 5:
+        return holiday - timedelta(days=1)
+    if holiday.weekday() == 6:
+        return holiday + timedelta(days=1)
+    return holiday
+
+
+def nyse_holidays(year):
+    """ Full-day NYSE holidays of a year, by the exchange's current rules (plus Juneteenth from 2022).
+
+    :return: dict of date -> holiday name.
+    """
+    holidays = {
+        nth_weekday(year, 1, 0, 3): "Martin Luther King Jr. Day",
+        nth_weekday(year, 2, 0, 3): "Washington's Birthday",
+        easter_sunday(year) - timedelta(days=2): "Good Friday",
+        nth_weekday(year, 5, 0, -1): "Memorial Day",
+        observed(date(year, 7, 4)): "Independence Day",
+        nth_weekday(year, 9, 0, 1): "Labor Day",
+        nth_weekday(year, 11, 3, 4): "Thanksgiving Day",
+        observed(date(year, 12, 25)): "Christmas Day",
+    }
+    # New Year's Day on a Saturday isn't made up on the Friday before, which would fall in the old year.
+    if date(year, 1, 1).weekday() != 5:
+        holidays[observed(date(year, 1, 1))] = "New Year's Day"
+    if year >= 2022:
+        holidays[observed(date(year, 6, 19))] = "Juneteenth"
+    return holidays
+
+
+def nyse_early_closes(year):
+    """ Sessions of a year that close at 13:00: July 3rd and Christmas Eve when they fall on Monday to Thursday,
+    and the day after Thanksgiving.
+
+    :return: set of dates.
+    """
+    early_closes = {nth_weekday(year, 11, 3, 4) + timedelta(days=1)}
+    for day in [date(year, 7, 3), date(year, 12, 24)]:
+        if day.weekday() < 4:
+            early_closes.add(day)
+    return early_closes
+
+
+class TradingCalendar(object):
+    """ NYSE trading sessions, holidays and early closes, computed from the exchange's rules so it needs no network
+    access. Times are in the exchange time zone; naive datetimes passed in are taken to be local time, so the
+    calendar gives the same answer wherever the updater runs.
+    """
+
+    def __init__(self, start_year=1990, end_year=None, tz="America/New_York", open_time="09:30",
+                 close_time="16:00", early_close_time="13:00", extended_open_time="04:00",
+                 extended_close_time="20:00", early_extended_close_time="17:00"):
+        """
+        :param start_year: first year covered.
+        :param end_year: last year covered, five years from now by default.
+        :param tz: exchange time zone.
+        :param open_time: regular session open, exchange time.
+        :param close_time: regular session close, exchange time.
+        :param early_close_time: close of the sessions in nyse_early_closes().
+        :param extended_open_time: start of pre-market trading, exchange time.
+        :param extended_close_time: end of post-market trading, exchange time.
+        :param early_extended_close_time: end of post-market trading on the sessions in nyse_early_closes().
+        """
+        end_year = end_year or dt.now().year + 5
+        self.tz = tz
+        self.holidays = {
+            day: name for day, name in NYSE_SPECIAL_CLOSURES.items() if start_year <= day.year <= end_year}
+        early_closes = set()
+        for year in range(start_year, end_year + 1):
+            self.holidays.update(nyse_holidays(year))
+            early_closes |= nyse_early_closes(year)
+
+        weekdays = pd.bdate_range(date(start_year, 1, 1), date(end_year, 12, 31))
+        self.sessions = weekdays[~weekdays.isin(pd.DatetimeIndex(sorted(self.holidays)))]
+        self.early_closes = self.sessions[self.sessions.isin(pd.DatetimeIndex(sorted(early_closes)))]
+        early = self.sessions.isin(self.early_closes)
+        close = np.where(early, pd.Timedelta(early_close_time + ":00"), pd.Timedelta(close_time + ":00"))
+        extended_close = np.where(early, pd.Timedelta(early_extended_close_time + ":00"),
+                                  pd.Timedelta(extended_close_time + ":00"))
+        self.opens = (self.sessions + pd.Timedelta(open_time + ":00")).tz_localize(tz)
+        self.closes = (self.sessions + pd.TimedeltaIndex(close)).tz_localize(tz)
+        self.extended_opens = (self.sessions + pd.Timedelta(extended_open_time + ":00")).tz_localize(tz)
+        self.extended_closes = (self.sessions + pd.TimedeltaIndex(extended_close)).tz_localize(tz)
+
+    def exchange_time(self, when=None):
+        """ :return: `when` (now by default) as a Timestamp in the exchange time zone. """
+        when = pd.Timestamp(when if when is not None else dt.now())
+        when = when.tz_localize(dt.now().astimezone().tzinfo) if when.tzinfo is None else when
+        return when.tz_convert(self.tz)
+
+    def _session_index(self, i, when):
+        if not 0 <= i < len(self.sessions):
+            raise ValueError("{} is outside the trading calendar ({} to {})".format(
+                when, self.sessions[0].date(), self.sessions[-1].date()))
+        return i
+
+    def is_session(self, day):
+        return pd.Timestamp(day).normalize() in self.sessions
+
+    def session_close(self, session):
+        """ :return: the close of a session date, as a Timestamp in the exchange time zone. """
+        return self.closes[self.sessions.get_loc(pd.Timestamp(session).normalize())]
+
+    def last_closed_session(self, when=None, settle_minutes=0):
+        """ The latest session that closed at least settle_minutes before `when` (now by default).
+
+        :param settle_minutes: time after the close before the data source is expected to have the session's bars.
+        :return: the session date, as a naive Timestamp at midnight.
+        """
+        when = self.exchange_time(when) - pd.Timedelta(minutes=settle_minutes)
+        return self.sessions[self._session_index(self.closes.searchsorted(when, side="right") - 1, when)]
+
+    def next_close(self, when=None):
+        """ :return: the first session close after `when` (now by default), in the exchange time zone. """
+        when = self.exchange_time(when)
+        return self.closes[self._session_index(self.closes.searchsorted(when, side="right"), when)]
+
+    def bars_after(self, session, when=None, interval=None):
+        """ Bars a data source already has of the session following `session`, e.g. of one still in progress:
+        for daily data 1 once it has opened, for intraday data the bars completed since its open.
+
+        :return: int.
+        """
+        when = self.exchange_time(when)
+        i = self.sessions.get_loc(pd.Timestamp(session).normalize()) + 1
+        if i >= len(self.sessions) or when < self.opens[i]:
+            return 0
+        if interval is None:
+            return 1
+        return int((min(when, self.closes[i]) - self.opens[i]) / pd.Timedelta(interval))
+
+    def extended_bars(self, session, when=None, interval="5min"):
+        """ Intraday bars a data source has from the start of `session` up to `when` (now by default), counting the
+        pre- and post-market bars AlphaVantage includes by default: 04:00 to 20:00, or to 17:00 on early closes.
+
+        :return: int.
+        """
+        when = self.exchange_time(when)
+        first = self.sessions.get_loc(pd.Timestamp(session).normalize())
+        stop = self.extended_opens.searchsorted(when, side="right")
+        opens, closes = self.extended_opens[first:stop], self.extended_closes[first:stop]
+        return int(np.sum((closes.where(closes < when, when) - opens) // pd.Timedelta(interval)))
+
+    def expected_last_bar(self, session, interval=None):
+        """ SampleTime of the last bar a data source has for a session: the session date itself for daily data,
+        or the start of the last regular-hours bar for intraday data, e.g. 15:55 (12:55 on early closes) for
+        "5min" bars.
+
+        :param session: a session date, e.g. from last_closed_session().
+        :param interval: intraday bar length such as "5min", or None for daily data.
+        :return: a naive Timestamp in exchange time, comparable with the SampleTimes in the database.
+        """
+        session = pd.Timestamp(session).normalize()
+        if interval is None:
+            return session
+        return self.session_close(session).tz_localize(None) - pd.Timedelta(interval)
+
+
+_NYSE_CALENDAR = None
+
+
+def nyse_calendar():
+    """ :return: the shared TradingCalendar, built on first use. """
+    global _NYSE_CALENDAR
+    if _NYSE_CALENDAR is None:
+        _NYSE_CALENDAR = TradingCalendar()
+    return _NYSE_CALENDAR
+
+
+def next_market_close(when, calendar=None):
+    """ Return the first market close after `when`, skipping holidays and observing early closes.
+
+    :param when: a naive local datetime, or a timezone-aware one.
+    :param calendar: TradingCalendar to use, nyse_calendar() by default.
+    :return: a timezone-aware pandas Timestamp.
+    """
+    return (calendar or nyse_calendar()).next_close(when)
+
+
+def plan_updates(state, tickers, expected_last_bar):
+    """ Split tickers into those that need an API call and those whose last stored bar is already the latest one
+    the data source can have.
+
+    :param state: updater.DatabaseState of the database being updated.
+    :param tickers: list of ticker symbols.
+    :param expected_last_bar: see TradingCalendar.expected_last_bar().
+    :return: (tickers to fetch, tickers already current), each in the order given.
+    """
+    stale, current = [], []
+    for ticker in tickers:
+        last_sample_time = state.last_sample_time(ticker)
+        if last_sample_time is not None and last_sample_time >= expected_last_bar:
+            current.append(ticker)
+        else:
+            stale.append(ticker)
+    return stale, current
+
+
+# Bars in an outputsize=compact response, and calendar days of bars in an outputsize=full intraday response
+# (older intraday bars are only available one month per request).
+COMPACT_BARS = 100
+INTRADAY_FULL_DAYS = 30
+
+
+def scan_gaps(sql_cursor, state, calendar, last_session):
+    """ Find the sessions missing inside each symbol's stored history, with one pass over the price table.
+
+    The distinct (security, day) pairs are read once and every symbol is diffed against the calendar at the same
+    time: days are mapped to session numbers, and consecutive days of one symbol more than one session apart
+    enclose a gap. Sessions after a symbol's last bar aren't reported, since every update fetches those anyway.
+
+    :param sql_cursor: a SQL cursor from an active connection.
+    :param state: updater.DatabaseState of the database, mapping SecurityMetaDataIDs to symbols.
+    :param calendar: TradingCalendar.
+    :param last_session: latest session to consider, e.g. TradingCalendar.last_closed_session().
+    :return: dict of symbol -> DatetimeIndex of missing sessions, for symbols with gaps only.
+    """
+    sql_cursor.execute("SELECT DISTINCT SecurityMetaDataID, DATE(SampleTime) FROM DataSourcePriceObservation")
+    rows = sql_cursor.fetchall()
+    if not rows:
+        return {}
+    ids, days = zip(*rows)
+    ids = np.array(ids)
+    days = pd.DatetimeIndex(pd.to_datetime(list(days)))
+
+    sessions = calendar.sessions[:calendar.sessions.get_loc(last_session) + 1]
+    position = sessions.searchsorted(days)
+    on_session = position < len(sessions)
+    on_session[on_session] = sessions[position[on_session]] == days[on_session]
+    ids, position = ids[on_session], position[on_session]
+
+    order = np.lexsort((position, ids))
+    ids, position = ids[order], position[order]
+    gap = (ids[1:] == ids[:-1]) & (np.diff(position) > 1)
+
+    symbols = {info['security_metadata_id']: symbol for symbol, info in state.symbols.items()}
+    gaps = {}
+    for security_metadata_id, first, end in zip(ids[:-1][gap], position[:-1][gap] + 1, position[1:][gap]):
+        symbol = symbols.get(security_metadata_id)
+        if symbol is not None:
+            gaps.setdefault(symbol, []).append(sessions[first:end])
+    return {symbol: ranges[0].append(ranges[1:]) for symbol, ranges in gaps.items()}
+
+
+def missing_sessions(calendar, last_session, last_sample_time, interval=None):
+    """ Sessions after a symbol's last stored bar, up to last_session, including the session of that bar if it
+    stopped short of the session's last bar.
+
+    :return: DatetimeIndex of sessions.
+    """
+    sessions = calendar.sessions[:calendar.sessions.get_loc(last_session) + 1]
+    if last_sample_time is None:
+        return sessions[:0]
+    if interval is None:
+        return sessions[sessions > pd.Timestamp(last_sample_time)]
+    last_bars = calendar.closes[:len(sessions)].tz_localize(None) - pd.Timedelta(interval)
+    return sessions[last_bars > pd.Timestamp(last_sample_time)]
+
+
+def plan_requests(calendar, last_session, missing, interval=None, now=None):
+    """ Pick the cheapest AlphaVantage requests that cover the missing sessions of a symbol.
+
+    A compact response (the latest COMPACT_BARS bars, including any of a session that hasn't settled yet) is used
+    if it reaches back to the oldest missing session; otherwise a full one, which for daily data holds the whole
+    history and for intraday data the last INTRADAY_FULL_DAYS days. Intraday sessions older than that are fetched
+    one calendar month per request. Intraday responses include pre- and post-market bars, so they are counted too
+    (see TradingCalendar.extended_bars()): an evening run, for example, can't get the whole day's bars compact.
+
+    :param calendar: TradingCalendar.
+    :param last_session: latest session the update runs through.
+    :param missing: DatetimeIndex of missing sessions, e.g. from scan_gaps() and missing_sessions(); empty for a
+        symbol with no data yet, which gets a full request.
+    :param interval: intraday bar length such as "5min", or None for daily data.
+    :param now: time of the requests, now by default.
+    :return: list of {'outputsize', 'month'} dicts, one per request (month is "YYYY-MM" or None).
+    """
+    if len(missing) == 0:
+        return [{'outputsize': "full", 'month': None}]
+
+    last = calendar.sessions.get_loc(last_session)
+    in_progress = calendar.bars_after(last_session, when=now)
+
+    def compact_covers(oldest):
+        if interval is not None:
+            return calendar.extended_bars(oldest, when=now, interval=interval) <= COMPACT_BARS
+        return last - calendar.sessions.get_loc(oldest) + 1 + in_progress <= COMPACT_BARS
+
+    if compact_covers(missing.min()):
+        return [{'outputsize': "compact", 'month': None}]
+    if interval is None:
+        return [{'outputsize': "full", 'month': None}]
+
+    full_start = calendar.exchange_time(now).tz_localize(None).normalize() - pd.Timedelta(days=INTRADAY_FULL_DAYS)
+    older, recent = missing[missing < full_start], missing[missing >= full_start]
+    requests = [{'outputsize': "full", 'month': month} for month in sorted(set(older.strftime("%Y-%m")))]
+    if len(recent):
+        requests.append({'outputsize': "compact" if compact_covers(recent.min()) else "full", 'month': None})
+    return requests
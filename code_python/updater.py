@@ -1,21 +1,57 @@
-import pandas as pd
-import numpy as np
-import urllib.request as urlreq
-import pymysql
-import yaml
-from datetime import timedelta, datetime as dt
+from datetime import date, timedelta, datetime as dt
 import time, json
+import codecs
+import csv
+import importlib
+import tempfile
 import logging
+import threading
 from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
+import queue
+import re
 import sys
+import tracemalloc
 
 
+class _LazyModule(object):
+    """ Stand-in for a module that is only imported when one of its attributes is first used, so importing updater
+    (e.g. from a reporting GUI or notebook) doesn't pay up front for pandas, NumPy and PyMySQL, or for subsystems it
+    never uses.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+pd = _LazyModule("pandas")
+np = _LazyModule("numpy")
+pymysql = _LazyModule("pymysql")
+urlreq = _LazyModule("urllib.request")
+yaml = _LazyModule("yaml")
+
+# The subsystems in their own modules, imported the same way, so a run only loads the ones it uses.
+analytics = _LazyModule("analytics")
+corporateactions = _LazyModule("corporateactions")
+instrumentation = _LazyModule("instrumentation")
+jobqueue = _LazyModule("jobqueue")
+pricemirror = _LazyModule("pricemirror")
+querycache = _LazyModule("querycache")
+ratelimit = _LazyModule("ratelimit")
+responsecache = _LazyModule("responsecache")
+streaming = _LazyModule("streaming")
+tradingcalendar = _LazyModule("tradingcalendar")
+
 # YAML file containing database login credentials (renamed from creds_template.yaml)
 cred_file = "./creds.yaml"
-if not os.path.exists(cred_file):
-    print("creds.yaml not found: did you rename creds_template.yaml?")
-    sys.exit()
 
 
 def init_logger():
@@ -29,14 +65,149 @@ def init_logger():
 #################################
 
 
-def mysql_connect(host, user, password, database):
+def mysql_connect(host, user, password, database, local_infile=False):
     # if using mysql-connector-python (causes problems with pd.read_sql_query for gui).
     # conn = mysql.connector.connect(host=server, user=user, password=password, database=database, use_pure=True)
-    conn = pymysql.connect(host=host, user=user, password=password, db=database)
+    # local_infile=True is required for the "infile" insert strategy in write_price_observations().
+    conn = pymysql.connect(host=host, user=user, password=password, db=database, local_infile=local_infile)
     cursor = conn.cursor()
     return conn, cursor
 
 
+class ConnectionPool(object):
+    """ Thread-safe pool of up to `size` connections to one database, each handed to one thread at a time (a
+    PyMySQL connection must not be shared between threads).
+
+    A connection that has been idle for ping_interval seconds is pinged before it is handed out again, and
+    reconnected if the server dropped it (e.g. after wait_timeout), so long runs survive quiet periods. check()
+    does the same for a connection a caller keeps hold of.
+    """
+
+    def __init__(self, host, user, password, database, size=4, local_infile=False, ping_interval=60.0, port=3306):
+        """
+        :param host: database server.
+        :param user: database user.
+        :param password: database password.
+        :param database: database name, e.g. PRICES_DAILY.
+        :param size: most connections open at once.
+        :param local_infile: enable LOAD DATA LOCAL INFILE, see mysql_connect().
+        :param ping_interval: idle seconds after which a connection is checked before use.
+        :param port: database server port.
+        """
+        self.database = database
+        self.size = max(1, size)
+        self.ping_interval = ping_interval
+        self.reconnects = 0
+        self._connect_args = dict(
+            host=host, port=port, user=user, password=password, db=database, local_infile=local_infile)
+        self._idle = []  # (connection, cursor) pairs ready to hand out
+        self._in_use = 0
+        self._last_used = {}  # id(connection) -> time it was last known to be alive
+        self._cond = threading.Condition()
+        self._closed = False
+
+    @classmethod
+    def from_connection(cls, sql_conn, size=4, ping_interval=60.0):
+        """ Pool of connections with the same server, credentials, database and options as sql_conn. """
+        return cls(
+            host=sql_conn.host,
+            port=sql_conn.port,
+            user=sql_conn.user,
+            password=sql_conn.password,
+            database=sql_conn.db.decode() if isinstance(sql_conn.db, bytes) else sql_conn.db,
+            size=size,
+            local_infile=sql_conn._local_infile,
+            ping_interval=ping_interval)
+
+    def acquire(self, timeout=None):
+        """ Take a connection from the pool, opening one if none is idle and the pool isn't full.
+
+        :param timeout: seconds to wait for a free connection; None waits forever.
+        :return: a (connection, cursor) pair, to be given back with release().
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Connection pool for {} is closed".format(self.database))
+            if not self._cond.wait_for(lambda: self._idle or self._in_use < self.size, timeout):
+                raise RuntimeError("No free connection to {} within {} seconds (pool size {})".format(
+                    self.database, timeout, self.size))
+            self._in_use += 1
+            pair = self._idle.pop() if self._idle else None
+
+        try:
+            if pair is None:
+                sql_conn = pymysql.connect(**self._connect_args)
+                pair = (sql_conn, sql_conn.cursor())
+                self._last_used[id(sql_conn)] = time.time()
+            else:
+                self.check(pair[0])
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return pair
+
+    def release(self, sql_conn, sql_cursor):
+        """ Give a connection back to the pool. Any open transaction is rolled back. """
+        try:
+            sql_conn.rollback()
+            keep = sql_conn.open and not self._closed
+        except Exception:
+            keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._last_used[id(sql_conn)] = time.time()
+                self._idle.append((sql_conn, sql_cursor))
+            else:
+                self._last_used.pop(id(sql_conn), None)
+            self._cond.notify()
+        if not keep:
+            self._close_quietly(sql_conn)
+
+    def check(self, sql_conn):
+        """ Make sure sql_conn is still connected if it has been idle for ping_interval seconds, reconnecting it if
+        not. Cursors of the connection stay valid. Only call this between transactions.
+
+        :param sql_conn: a connection from this pool (or any PyMySQL connection).
+        """
+        now = time.time()
+        if now - self._last_used.get(id(sql_conn), 0) >= self.ping_interval:
+            try:
+                sql_conn.ping(reconnect=False)
+            except pymysql.err.Error:
+                sql_conn.ping(reconnect=True)
+                with self._cond:
+                    self.reconnects += 1
+        self._last_used[id(sql_conn)] = now
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """ Borrow a connection for the duration of a with block. """
+        sql_conn, sql_cursor = self.acquire(timeout=timeout)
+        try:
+            yield sql_conn, sql_cursor
+        finally:
+            self.release(sql_conn, sql_cursor)
+
+    def close(self):
+        """ Close the idle connections. Connections still in use are closed when they are released. """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._closed = True
+        for sql_conn, _ in idle:
+            self._last_used.pop(id(sql_conn), None)
+            self._close_quietly(sql_conn)
+
+    @staticmethod
+    def _close_quietly(sql_conn):
+        try:
+            sql_conn.close()
+        except Exception:
+            pass  # already closed, or the server went away
+
+
 def fetchone(sql_cursor, query):
     """ Calls fetchone() on a query. If the result is empty, the function returns None, otherwise returns the first
     element of the return value tuple.
@@ -53,6 +224,34 @@ def fetchone(sql_cursor, query):
     return answer
 
 
+def price_layout(sql_conn, sql_cursor):
+    """ Storage layout of the connected database's price data, from GetPriceLayout(): "standard" for the
+    DataSourcePriceObservation table of CREATES.sql, or "compact_daily" / "compact_intraday" for the PriceBar and
+    CorporateAction tables of COMPACT_DAILY.sql / COMPACT_INTRADAY.sql. Cached on the connection.
+
+    :param sql_conn: active SQL server connection.
+    :param sql_cursor: a SQL cursor from sql_conn.
+    :return: one of PRICE_LAYOUTS.
+    """
+    layout = getattr(sql_conn, "_price_layout", None)
+    if layout is None:
+        layout = fetchone(sql_cursor, query="SELECT GetPriceLayout()").lower()
+        sql_conn._price_layout = layout
+    return layout
+
+
+def commit_data(sql_conn, sql_cursor):
+    """ Commit a transaction that changed prices or symbols, bumping the DataGeneration counter in it first so
+    QueryCache entries computed from the old data are no longer served.
+
+    :param sql_conn: active SQL server connection.
+    :param sql_cursor: a SQL cursor from sql_conn.
+    :return: no return value.
+    """
+    sql_cursor.execute("CALL BumpDataGeneration()")
+    sql_conn.commit()
+
+
 def npdt2str(a_dt):
     # Convert numpy datetime64 to a string compatible with MySQL datetime
     return pd.to_datetime(str(a_dt)).strftime("%Y-%m-%d %H:%M:%S")
@@ -106,12 +305,197 @@ def get_etf_tickers(inc_stocks=True, inc_bonds=True, inc_commods=True, inc_fx=Tr
     return tickers
 
 
+def get_etf_list():
+    """ :return: sorted list of the ETF tickers of get_etf_tickers(). """
+    return list(get_etf_tickers().keys())
+
+
+# Constituent lists TickerUniverse knows how to fetch, by name. Each returns a list of tickers.
+UNIVERSE_SOURCES = OrderedDict([
+    ("etf", get_etf_list),
+    ("dow30", get_dow30_stocks),
+    ("nasdaq100", get_nasdaq100_stocks),
+    ("sp500", get_sp500_stocks),
+    ("alphavantage", lambda: list(get_alphavantage_tickers().keys())),
+])
+
+
+class TickerUniverse(object):
+    """ Local cache of constituent lists, so the ticker grabbers don't re-download and re-parse their CSV/HTML on
+    every run.
+
+    Each list is kept in <cache_dir>/<name>.json with the time it was fetched and is re-fetched once it is older
+    than ttl_hours. If the source can't be reached, the last cached copy is used whatever its age, so a flaky
+    constituents page never shrinks the universe (and deletes symbols) by accident. With offline=True, only the
+    cache is used.
+    """
+
+    def __init__(self, cache_dir="./universe", ttl_hours=24, offline=False, sources=None, logger=None):
+        """
+        :param cache_dir: directory holding the cached lists. Created if missing.
+        :param ttl_hours: age after which a cached list is re-fetched.
+        :param offline: if True, never fetch; lists must already be cached.
+        :param sources: dict of name -> function returning a list of tickers, default UNIVERSE_SOURCES.
+        :param logger: a logging instance, e.g. logger.info or textEdit.append
+        """
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_hours * 3600
+        self.offline = offline
+        self.sources = UNIVERSE_SOURCES if sources is None else sources
+        self.logger = logger or (lambda message: None)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, "{}.json".format(name))
+
+    def _read(self, name):
+        try:
+            with open(self._path(name)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self, name, tickers):
+        tmp_path = self._path(name) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"name": name, "fetched": time.time(), "tickers": tickers}, f)
+        os.replace(tmp_path, self._path(name))
+
+    def tickers(self, name):
+        """ One constituent list, from the cache while it is fresh.
+
+        :param name: one of the names in sources.
+        :return: sorted list of tickers.
+        """
+        if name not in self.sources:
+            raise ValueError("universe must be one of {}".format(list(self.sources)))
+        cached = self._read(name)
+        if cached is not None and (self.offline or time.time() - cached["fetched"] < self.ttl_seconds):
+            return cached["tickers"]
+        if self.offline:
+            raise KeyError("offline mode: no cached constituents for {}".format(name))
+
+        try:
+            tickers = sorted(set(str(ticker).strip() for ticker in self.sources[name]() if str(ticker).strip()))
+            if not tickers:
+                raise ValueError("empty constituent list")
+        except Exception as e:
+            if cached is None:
+                raise
+            self.logger("Could not refresh the {} constituents ({}); using the list cached {:.1f} hours ago".format(
+                name, e, (time.time() - cached["fetched"]) / 3600.0))
+            return cached["tickers"]
+        self._write(name, tickers)
+        self.logger("Refreshed the {} constituents: {} tickers".format(name, len(tickers)))
+        return tickers
+
+    def load(self, names, data_source_name="AlphaVantage"):
+        """ The union of several constituent lists, in the form database_update() takes.
+
+        :param names: list of names in sources.
+        :param data_source_name: data source every ticker is fetched from.
+        :return: OrderedDict of ticker -> data source name, sorted by ticker.
+        """
+        tickers = set()
+        for name in names:
+            tickers.update(self.tickers(name))
+        return OrderedDict((ticker, data_source_name) for ticker in sorted(tickers))
+
+
 #######################################
 ##### Reporting Support Functions #####
 #######################################
 
 
-def get_price_relative_to_avg(sql_conn, above_or_below, length=30):
+REPORTING_ENGINES = ["python", "sql"]
+
+
+def load_adjusted_closes(sql_conn, start_date=None, end_date=None, last_n=None, price_mirror=None):
+    """ Fetch adjusted closes for every symbol in one pass, in the long format used by the analytics module.
+
+    This is what the reporting functions read with engine="python". Unlike the stored procedures it skips bars
+    without an adjusted close (intraday bars, and daily bars from a free AlphaVantage key unless adjust_prices
+    derived them), and last_n needs ROW_NUMBER(), so MySQL 8.0+ or MariaDB 10.2+.
+
+    :param sql_conn: active SQL server connection (not used if price_mirror is given).
+    :param start_date: optional first SampleTime to include.
+    :param end_date: optional last SampleTime to include.
+    :param last_n: if given, only each symbol's most recent last_n bars (with a close) are returned.
+    :param price_mirror: optional PriceMirror to read from instead of the database.
+    :return: dataframe with columns SecuritySymbol, SampleTime, AdjustedClosePrice, sorted by symbol and time.
+    """
+    if price_mirror is not None:
+        symbols, times, closes = [], [], []
+        for symbol in price_mirror.symbols():
+            data = price_mirror.load(symbol, columns=["AdjustedClosePrice"])[start_date:end_date].dropna()
+            if last_n is not None:
+                data = data.iloc[-last_n:]
+            symbols.append(np.full(len(data), symbol, dtype=object))
+            times.append(data.index.values)
+            closes.append(data["AdjustedClosePrice"].values)
+        if not symbols:
+            return pd.DataFrame(columns=["SecuritySymbol", "SampleTime", "AdjustedClosePrice"])
+        return pd.DataFrame({
+            "SecuritySymbol": np.concatenate(symbols),
+            "SampleTime": np.concatenate(times),
+            "AdjustedClosePrice": np.concatenate(closes),
+        })
+
+    conditions = ["dspo.AdjustedClosePrice IS NOT NULL"]
+    params = {}
+    if start_date is not None:
+        conditions.append("dspo.SampleTime >= %(start_date)s")
+        params["start_date"] = pd.Timestamp(start_date).to_pydatetime()
+    if end_date is not None:
+        conditions.append("dspo.SampleTime <= %(end_date)s")
+        params["end_date"] = pd.Timestamp(end_date).to_pydatetime()
+
+    sqlstr = """
+        SELECT
+            smd.SecuritySymbol,
+            dspo.SampleTime,
+            dspo.AdjustedClosePrice{}
+        FROM
+            DataSourcePriceObservation AS dspo
+        JOIN
+            SecurityMetaData AS smd ON dspo.SecurityMetaDataID=smd.SecurityMetaDataID
+        WHERE
+            {}
+        """.format(
+        ",\n            ROW_NUMBER() OVER (PARTITION BY dspo.SecurityMetaDataID ORDER BY dspo.SampleTime DESC) AS n"
+        if last_n is not None else "",
+        "\n            AND\n            ".join(conditions))
+    if last_n is not None:
+        sqlstr = "SELECT SecuritySymbol, SampleTime, AdjustedClosePrice FROM ({}) AS tmp WHERE n <= %(last_n)s".format(
+            sqlstr)
+        params["last_n"] = int(last_n)
+    sqlstr += " ORDER BY SecuritySymbol, SampleTime"
+
+    return pd.read_sql_query(sql=sqlstr, con=sql_conn, params=params, parse_dates=["SampleTime"])
+
+
+def get_price_relative_to_avg(sql_conn, above_or_below, length=30, engine="sql", price_mirror=None, cache=None):
+    """ Symbols whose latest close is above (or below) their `length` period average.
+
+    :param sql_conn: active SQL server connection.
+    :param above_or_below: "Above" or "Below".
+    :param length: number of periods in the average.
+    :param engine: "sql" calls GetSecurities{Above,Below}Avg, "python" computes it in one pass with analytics.py
+        (see load_adjusted_closes() for how the two differ).
+    :param price_mirror: optional PriceMirror to read prices from (python engine only).
+    :param cache: optional QueryCache to serve repeated calls from (not used with price_mirror).
+    :return: dataframe with columns SecuritySymbol, Price, Avg.
+    """
+    if cache is not None and price_mirror is None:
+        return cache.get_or_compute(
+            sql_conn, "get_price_relative_to_avg",
+            lambda: get_price_relative_to_avg(sql_conn, above_or_below, length=length, engine=engine),
+            above_or_below=above_or_below, length=length, engine=engine)
+
+    if engine == "python":
+        prices = load_adjusted_closes(sql_conn, last_n=length, price_mirror=price_mirror)
+        return analytics.price_relative_to_avg(prices, above_or_below, length=length)
+
     # With mysql-python-connector, pd.read_sql_query() fails, so this can be a workaround but the
     # headers don't get returns properly. Cursor.description is supposed to show the headers, but
     # they aren't as expected for some reason.
@@ -127,22 +511,109 @@ def get_price_relative_to_avg(sql_conn, above_or_below, length=30):
     return data
 
 
-def get_range_summary(sql_conn, start_date=dt.now()-timedelta(days=365), end_date=dt.now()):
+def get_range_summary(
+        sql_conn,
+        start_date=None,
+        end_date=None,
+        engine="sql",
+        price_mirror=None,
+        cache=None):
+    """ Price range and percent range of every symbol between start_date and end_date.
+
+    :param engine: "sql" calls GetPriceRangeOverDateRange, "python" computes it in one pass with analytics.py
+        (see load_adjusted_closes() for how the two differ).
+    :param start_date: first SampleTime to include, by default midnight 365 days ago.
+    :param end_date: last SampleTime to include, by default the latest.
+    :param price_mirror: optional PriceMirror to read prices from (python engine only).
+    :param cache: optional QueryCache to serve repeated calls from (not used with price_mirror).
+    :return: dataframe with columns Symbol, PriceRange, PctRange.
+    """
+    if start_date is None:
+        start_date = dt.combine(date.today() - timedelta(days=365), dt.min.time())
+    if cache is not None and price_mirror is None:
+        return cache.get_or_compute(
+            sql_conn, "get_range_summary",
+            lambda: get_range_summary(sql_conn, start_date=start_date, end_date=end_date, engine=engine),
+            start_date=start_date, end_date=end_date, engine=engine)
+
+    if engine == "python":
+        prices = load_adjusted_closes(sql_conn, start_date=start_date, end_date=end_date, price_mirror=price_mirror)
+        return analytics.range_summary(prices)
+
     sqlstr = "CALL GetPriceRangeOverDateRange('{}', '{}');".format(
-        start_date.strftime("%m/%d/%y"),
-        end_date.strftime("%m/%d/%y"))
+        start_date.strftime("%Y-%m-%d %H:%M:%S"),
+        (end_date or dt.now()).strftime("%Y-%m-%d %H:%M:%S"))
     data = pd.read_sql_query(sql=sqlstr, con=sql_conn)
     return data
 
 
-def get_highest_lowest_close(sql_conn, start_date=dt.now()-timedelta(days=365), end_date=dt.now()):
+def get_highest_lowest_close(
+        sql_conn,
+        start_date=None,
+        end_date=None,
+        engine="sql",
+        price_mirror=None,
+        cache=None):
+    """ Last, lowest and highest close of every symbol between start_date and end_date.
+
+    :param engine: "sql" calls GetTrailingHighestAndLowestClose, "python" computes it in one pass with analytics.py
+        (see load_adjusted_closes() for how the two differ).
+    :param start_date: first SampleTime to include, by default midnight 365 days ago.
+    :param end_date: last SampleTime to include, by default the latest.
+    :param price_mirror: optional PriceMirror to read prices from (python engine only).
+    :param cache: optional QueryCache to serve repeated calls from (not used with price_mirror).
+    :return: dataframe with columns SecuritySymbol, LastPrice, MinPrice, MaxPrice.
+    """
+    if start_date is None:
+        start_date = dt.combine(date.today() - timedelta(days=365), dt.min.time())
+    if cache is not None and price_mirror is None:
+        return cache.get_or_compute(
+            sql_conn, "get_highest_lowest_close",
+            lambda: get_highest_lowest_close(sql_conn, start_date=start_date, end_date=end_date, engine=engine),
+            start_date=start_date, end_date=end_date, engine=engine)
+
+    if engine == "python":
+        prices = load_adjusted_closes(sql_conn, start_date=start_date, end_date=end_date, price_mirror=price_mirror)
+        symbols = price_mirror.symbols() if price_mirror is not None else get_symbols_from_database(sql_conn).keys()
+        return analytics.highest_lowest_close(prices, symbols=symbols)
+
     sqlstr = "CALL GetTrailingHighestAndLowestClose('{}', '{}');".format(
-        start_date.strftime("%m/%d/%y"),
-        end_date.strftime("%m/%d/%y"))
+        start_date.strftime("%Y-%m-%d %H:%M:%S"),
+        (end_date or dt.now()).strftime("%Y-%m-%d %H:%M:%S"))
     data = pd.read_sql_query(sql=sqlstr, con=sql_conn)
     return data
 
 
+def time_reporting_engines(logger, sql_conn, length=30, price_mirror=None):
+    """ Run every report with each engine and log how long each took, to compare analytics.py with the stored
+    procedures.
+
+    :param logger: a logging instance, e.g. logger.info or textEdit.append
+    :param sql_conn: active SQL server connection.
+    :param length: average length for get_price_relative_to_avg().
+    :param price_mirror: optional PriceMirror, timed as an extra "python+mirror" engine.
+    :return: dataframe with columns report, engine, seconds, rows.
+    """
+    reports = [
+        ("price_relative_to_avg", lambda **kw: get_price_relative_to_avg(sql_conn, "Above", length=length, **kw)),
+        ("range_summary", lambda **kw: get_range_summary(sql_conn, **kw)),
+        ("highest_lowest_close", lambda **kw: get_highest_lowest_close(sql_conn, **kw)),
+    ]
+    engines = [(engine, {"engine": engine}) for engine in REPORTING_ENGINES]
+    if price_mirror is not None:
+        engines.append(("python+mirror", {"engine": "python", "price_mirror": price_mirror}))
+
+    results = []
+    for report, run in reports:
+        for engine, kwargs in engines:
+            start = time.time()
+            data = run(**kwargs)
+            seconds = time.time() - start
+            logger("{} ({}): {} rows in {:.3f} seconds".format(report, engine, len(data), seconds))
+            results.append({"report": report, "engine": engine, "seconds": seconds, "rows": len(data)})
+    return pd.DataFrame(results)
+
+
 #########################################
 ##### Data Source Support Functions #####
 #########################################
@@ -153,31 +624,125 @@ def get_alphavantage_id(sql_cursor):
     return data_source_id
 
 
-def load_data_from_alphavantage(logger, ticker, api_key, outputsize="full", intraday=False, interval='5min', premium=False):
-    """ Pull JSON-formatted Security price data from AlphaVantage.
+# Query endpoint of the AlphaVantage API. A data source entry in creds.yaml can point elsewhere with "api_url",
+# e.g. at the fake server in benchmark.py.
+ALPHAVANTAGE_URL = "https://www.alphavantage.co/query"
 
-    :param ticker: the Security symbol.
-    :param api_key: user's API key.
-    :param outputsize: "full" or "compact"
-    :param intraday: bool, if True, grab intraday data, otherwise grab daily data.
-    :param interval: intraday sample frequency in minutes. Only valid when intraday=True.
-    :return: a Pandas dataframe containing the price information.
+# Bar length of the intraday data.
+INTRADAY_INTERVAL = "5min"
+
+# Column order of the dataframes returned by load_data_from_alphavantage() (and expected by the SQL insert).
+ALPHAVANTAGE_COLUMNS = [
+    "open", "high", "low", "close", "adjusted close", "volume", "dividend amount", "split coefficient"]
+
+ALPHAVANTAGE_PARSERS = ["columnar", "pandas"]
+
+# Bytes read from the HTTP response per step when streaming it into the columnar parser.
+PARSE_CHUNK_BYTES = 256 * 1024
+
+_SECTION_RE = re.compile(r'"Time Series[^"]*"\s*:\s*\{')
+_TIMESTAMP_RE = re.compile(r'"(\d{4}-\d\d-\d\d[^"]*)"\s*:\s*\{')
+_FIELD_NAME_RE = re.compile(r'"\d+\.\s*([^"]+)"\s*:')
+_FIELD_VALUE_RE = re.compile(r':\s*"([^"]*)"')
+_SECTION_END_RE = re.compile(r'\}\s*\}')
+
+
+def parse_alphavantage_time_series(chunks, size_hint=0):
+    """ Stream an AlphaVantage JSON payload into preallocated float64/datetime64 NumPy arrays, in
+    ALPHAVANTAGE_COLUMNS order, without building the nested dict that json.loads() would.
+
+    Complete records are cut from the buffer as chunks arrive, and each batch is converted with one regex pass for
+    the timestamps, one for the values and a single vectorized string-to-float conversion, so no Python objects
+    are kept per row.
+
+    :param chunks: iterable of bytes, e.g. successive reads of the HTTP response.
+    :param size_hint: expected payload size in bytes, used to size the arrays up front.
+    :return: a Pandas dataframe indexed by SampleTime, sorted ascending, with float64 columns (NaN if missing).
     """
-    logger("... getting data from AlphaVantage: {}".format(ticker))
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    capacity = max(64, size_hint // 120)  # a daily record is ~150 bytes, an intraday one ~170
+    values = np.full((capacity, len(ALPHAVANTAGE_COLUMNS)), np.nan)
+    times = np.empty(capacity, dtype="datetime64[s]")
+    n_rows = 0
+    column_index = None
+    in_section = False
+    finished = False
+    head = []  # everything before the time series, kept to report API error messages
+    buf = ""
+
+    for chunk in chunks:
+        buf += decoder.decode(chunk)
+
+        if not in_section:
+            match = _SECTION_RE.search(buf)
+            if match is None:
+                continue
+            head.append(buf[:match.start()])
+            buf = buf[match.end():]
+            in_section = True
+
+        # Right after a complete record (or the section header), a "}" closes the time series.
+        if buf.lstrip().startswith("}"):
+            finished = True
+            break
+
+        # Records hold no nested objects, so the last "}" closes the last complete one.
+        end = _SECTION_END_RE.search(buf)
+        cut = end.start() + 1 if end is not None else buf.rfind("}") + 1
+        if cut <= 0:
+            continue
+        region, buf = buf[:cut], buf[cut:]
+
+        batch_times = _TIMESTAMP_RE.findall(region)
+        batch_values = _FIELD_VALUE_RE.findall(region)
+        if column_index is None and batch_times:
+            first_record = region[:region.find("}")]
+            column_index = [ALPHAVANTAGE_COLUMNS.index(name.strip()) for name in _FIELD_NAME_RE.findall(first_record)]
+
+        n = len(batch_times)
+        if n:
+            if len(batch_values) != n * len(column_index):
+                raise ValueError("AlphaVantage records don't all have the fields {}".format(column_index))
+            if n_rows + n > capacity:
+                capacity = max(2 * capacity, n_rows + n)
+                values = np.resize(values, (capacity, len(ALPHAVANTAGE_COLUMNS)))
+                values[n_rows:] = np.nan
+                times = np.resize(times, capacity)
+            times[n_rows:n_rows + n] = np.array(batch_times, dtype="datetime64[s]")
+            values[n_rows:n_rows + n, column_index] = np.array(batch_values, dtype=np.float64).reshape(n, -1)
+            n_rows += n
+
+        if end is not None or buf.lstrip().startswith("}"):
+            finished = True
+            break
+
+    if not finished:
+        text = "".join(head) + buf
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = text[:500]
+        raise ValueError("no time series in AlphaVantage response: {}".format(message))
 
-    base_url = "https://www.alphavantage.co/query?function="
-    if intraday:
-        base_url = "{}TIME_SERIES_INTRADAY&".format(base_url)
-        option_url = "symbol={}&interval={}&outputsize={}&apikey={}".format(ticker, interval, outputsize, api_key)
-    else:
-        if premium:
-            base_url = "{}TIME_SERIES_DAILY_ADJUSTED&".format(base_url)
-        else:
-            base_url = "{}TIME_SERIES_DAILY&".format(base_url)
+    times, values = times[:n_rows], values[:n_rows]
+
+    # AlphaVantage sends newest first; reversing is a view, so only fall back to a sort if that isn't enough.
+    times, values = times[::-1], values[::-1]
+    if n_rows > 1 and not (times[1:] >= times[:-1]).all():
+        order = np.argsort(times, kind="stable")
+        times, values = times[order], values[order]
+
+    return pd.DataFrame(values, index=pd.DatetimeIndex(times), columns=ALPHAVANTAGE_COLUMNS, copy=False)
 
-        option_url = "symbol={}&outputsize={}&apikey={}".format(ticker, outputsize, api_key)
 
-    data = json.loads(urlreq.urlopen(base_url + option_url).read().decode())
+def parse_alphavantage_json(body, intraday=False):
+    """ Original parser: json.loads() the whole payload and build the dataframe from its dict of string rows.
+
+    :param body: raw response bytes.
+    :param intraday: bool, True if the payload holds intraday data.
+    :return: a Pandas dataframe indexed by SampleTime, in ALPHAVANTAGE_COLUMNS order.
+    """
+    data = json.loads(body.decode())
 
     ts_data = data[[i for i in data.keys() if 'Time Series' in i][0]]
 
@@ -192,7 +757,7 @@ def load_data_from_alphavantage(logger, ticker, api_key, outputsize="full", intr
         ts['split coefficient'] = None
 
     # make sure column order is consistent with what our SQL insert expects
-    columns = ["open", "high", "low", "close", "adjusted close", "volume", "dividend amount", "split coefficient"]
+    columns = ALPHAVANTAGE_COLUMNS
 
     missing_columns = set(columns) - set(ts.columns)
     if missing_columns:
@@ -203,125 +768,945 @@ def load_data_from_alphavantage(logger, ticker, api_key, outputsize="full", intr
     return ts
 
 
+def profile_alphavantage_parsers(body, intraday=False):
+    """ Parse one payload with each parser and measure it, to compare the columnar parser with the original.
+
+    :param body: raw response bytes.
+    :param intraday: bool, True if the payload holds intraday data.
+    :return: dict of parser name -> {'rows', 'seconds', 'peak_bytes'}.
+    """
+    results = {}
+    for parser in ALPHAVANTAGE_PARSERS:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        if parser == "columnar":
+            chunks = (body[i:i + PARSE_CHUNK_BYTES] for i in range(0, len(body), PARSE_CHUNK_BYTES))
+            ts = parse_alphavantage_time_series(chunks, size_hint=len(body))
+        else:
+            ts = parse_alphavantage_json(body, intraday=intraday)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        if not was_tracing:
+            tracemalloc.stop()
+        results[parser] = {'rows': len(ts), 'seconds': seconds, 'peak_bytes': peak}
+        del ts
+    return results
+
+
+def load_data_from_alphavantage(
+        logger,
+        ticker,
+        api_key,
+        outputsize="full",
+        intraday=False,
+        interval=INTRADAY_INTERVAL,
+        premium=False,
+        rate_limiter=None,
+        response_cache=None,
+        parser="columnar",
+        metrics=None,
+        base_url=ALPHAVANTAGE_URL,
+        month=None):
+    """ Pull JSON-formatted Security price data from AlphaVantage.
+
+    :param ticker: the Security symbol.
+    :param api_key: user's API key.
+    :param outputsize: "full" or "compact"
+    :param intraday: bool, if True, grab intraday data, otherwise grab daily data.
+    :param interval: intraday sample frequency in minutes. Only valid when intraday=True.
+    :param rate_limiter: optional RateLimiter, acquired immediately before the HTTP call. If it's an ApiKeyPool,
+        the key it hands out is used instead of api_key.
+    :param response_cache: optional ResponseCache consulted before (and filled after) the HTTP call.
+    :param parser: "columnar" streams the response into NumPy arrays, "pandas" is the original json.loads() path.
+    :param metrics: optional RunMetrics, given the time spent rate limiting, waiting for the response ("http"),
+        reading it ("download") and parsing it, and the bytes downloaded.
+    :param base_url: URL of the API's query endpoint.
+    :param month: "YYYY-MM" to get that calendar month of intraday data instead of the latest bars.
+    :return: a Pandas dataframe containing the price information.
+    """
+    if intraday:
+        function = "TIME_SERIES_INTRADAY"
+    elif premium:
+        function = "TIME_SERIES_DAILY_ADJUSTED"
+    else:
+        function = "TIME_SERIES_DAILY"
+
+    if not intraday:
+        interval = None
+        month = None
+
+    cache_key = responsecache.ResponseCache.make_key(
+        function=function, symbol=ticker, interval=interval, outputsize=outputsize, month=month)
+    body = response_cache.get(cache_key) if response_cache is not None else None
+    from_network = body is None
+
+    if body is not None:
+        logger("... using cached AlphaVantage data: {}".format(ticker))
+        if metrics is not None:
+            metrics.count("cache_hits", ticker=ticker)
+    elif response_cache is not None and response_cache.offline:
+        raise KeyError("offline mode: no cached response for {}".format(cache_key))
+    else:
+        logger("... getting data from AlphaVantage: {}{}".format(ticker, " ({})".format(month) if month else ""))
+
+        start = time.time()
+        if isinstance(rate_limiter, ratelimit.ApiKeyPool):
+            api_key = rate_limiter.acquire_key()
+        elif rate_limiter is not None:
+            rate_limiter.acquire()
+        if metrics is not None:
+            metrics.add_time("rate_limit", time.time() - start, ticker=ticker)
+
+        function_url = "{}?function={}&".format(base_url, function)
+        if intraday:
+            option_url = "symbol={}&interval={}&outputsize={}&apikey={}".format(ticker, interval, outputsize, api_key)
+            if month is not None:
+                option_url += "&month={}".format(month)
+        else:
+            option_url = "symbol={}&outputsize={}&apikey={}".format(ticker, outputsize, api_key)
+
+        start = time.time()
+        response = urlreq.urlopen(function_url + option_url)
+        if metrics is not None:
+            metrics.add_time("http", time.time() - start, ticker=ticker)
+            metrics.count("api_calls", ticker=ticker)
+
+    # The body is read lazily inside the parser, so socket reads are timed separately ("download", not "parse").
+    reads = {"seconds": 0.0, "bytes": 0}
+
+    def read_chunk():
+        read_start = time.time()
+        chunk = response.read(PARSE_CHUNK_BYTES)
+        reads["seconds"] += time.time() - read_start
+        reads["bytes"] += len(chunk)
+        return chunk
+
+    if from_network:
+        size_hint = int(response.headers.get("Content-Length") or 0)
+        chunks = iter(read_chunk, b"")
+        if response_cache is not None:
+            received = []
+            chunks = (received.append(chunk) or chunk for chunk in chunks)
+    else:
+        size_hint = len(body)
+        chunks = (body[i:i + PARSE_CHUNK_BYTES] for i in range(0, len(body), PARSE_CHUNK_BYTES))
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    start = time.time()
+
+    if parser == "columnar":
+        ts = parse_alphavantage_time_series(chunks, size_hint=size_hint)
+    else:
+        ts = parse_alphavantage_json(b"".join(chunks), intraday=intraday)
+    parse_seconds = time.time() - start - reads["seconds"]
+
+    logger("... parsed {} rows for {} in {:.1f} ms ({} parser{})".format(
+        len(ts), ticker, 1000 * parse_seconds, parser,
+        ", peak {:.1f} MB traced".format(tracemalloc.get_traced_memory()[1] / 1024 ** 2) if tracing else ""))
+
+    # Only well-formed payloads are cached: error and throttling notes come back with HTTP 200 too.
+    if response_cache is not None and from_network:
+        # drain anything after the time series so the cached body is complete
+        body = b"".join(received) + response.read()
+        response_cache.put(cache_key, body)
+
+    if metrics is not None:
+        metrics.add_time("parse", parse_seconds, ticker=ticker)
+        metrics.count("rows_parsed", len(ts), ticker=ticker)
+        if from_network:
+            metrics.add_time("download", reads["seconds"], ticker=ticker)
+            metrics.count("bytes_downloaded", reads["bytes"], ticker=ticker)
+        if tracing:
+            metrics.maximum("parse_traced_bytes", tracemalloc.get_traced_memory()[1])
+
+    return ts
+
+
+#############################
+##### Price Write Stage #####
+#############################
+
+
+class PriceWriter(object):
+    """ Writer stage of the update pipeline. Fetch workers put() parsed dataframes on a bounded queue and `writers`
+    threads drain it, each on its own pooled connection, writing several tickers per transaction and committing once
+    commit_rows rows are pending or commit_seconds have passed since the first uncommitted write. put() blocks
+    while the queue is full, so fetching can't run ahead of writing by more than queue_size tickers.
+
+    A ticker is handed back by results() only once its transaction has committed. If a group fails, it is rolled
+    back and its tickers are retried in a transaction each, so one bad ticker doesn't fail the others.
+    """
+
+    _STOP = object()
+
+    def __init__(
+            self,
+            connection_pool,
+            writers=1,
+            queue_size=8,
+            commit_rows=50000,
+            commit_seconds=5.0,
+            insert_strategy="multirow",
+            logger=None,
+            metrics=None,
+            adjust_prices=None,
+            rollups=None):
+        """
+        :param connection_pool: ConnectionPool the writer threads take their connections from (one each).
+        :param writers: number of writer threads.
+        :param queue_size: tickers that can wait to be written before put() blocks.
+        :param commit_rows: commit once this many rows are written but uncommitted.
+        :param commit_seconds: commit at the latest this long after the first uncommitted write.
+        :param insert_strategy: how rows are sent to the server, see write_price_observations().
+        :param logger: a logging instance, e.g. logger.info or textEdit.append
+        :param metrics: optional RunMetrics, given the write and commit times and the time fetch workers spend
+            blocked on the queue ("queue_wait").
+        :param adjust_prices: how adjusted closes are maintained, see write_price_observations().
+        :param rollups: PriceRollup intervals to maintain, see write_price_observations().
+        """
+        self.metrics = metrics
+        self.adjust_prices = adjust_prices
+        self.rollups = rollups
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        self.insert_strategy = insert_strategy
+        self.logger = logger or (lambda message: None)
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self.outstanding = 0  # tickers put() but not yet handed back by results()
+        self.max_depth = 0
+        self.put_wait_seconds = 0.0  # time fetch workers spent blocked on a full queue
+        self.tickers_written = 0
+        self.rows_written = 0
+        self.transactions = 0
+        self.write_seconds = 0.0
+
+        # Connect on the calling thread so a bad login fails here rather than inside a writer thread.
+        self._pool = connection_pool
+        self._connections = []
+        try:
+            for _ in range(max(1, writers)):
+                self._connections.append(connection_pool.acquire(timeout=60))
+        except Exception:
+            for connection in self._connections:
+                connection_pool.release(*connection)
+            raise
+        self._threads = [
+            threading.Thread(target=self._run, args=connection, name="price-writer-{}".format(i), daemon=True)
+            for i, connection in enumerate(self._connections)]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, ticker, data_source_id, security_metadata_id, raw_data):
+        """ Queue a ticker's rows for writing, blocking while the queue is full. """
+        with self._lock:
+            self.outstanding += 1
+        start = time.time()
+        self._queue.put((ticker, data_source_id, security_metadata_id, raw_data))
+        waited = time.time() - start
+        with self._lock:
+            self.put_wait_seconds += waited
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        if self.metrics is not None:
+            self.metrics.add_time("queue_wait", waited, ticker=ticker)
+            self.metrics.maximum("write_queue_depth", self._queue.qsize())
+
+    def depth(self):
+        """ Number of tickers waiting to be written. """
+        return self._queue.qsize()
+
+    def results(self, timeout=0):
+        """ Collect tickers whose writes committed or failed.
+
+        :param timeout: seconds to wait for the first result if none is ready.
+        :return: list of (ticker, raw_data, error) tuples, error being None on success.
+        """
+        results = []
+        try:
+            results.append(self._results.get(timeout=timeout) if timeout else self._results.get_nowait())
+            while True:
+                results.append(self._results.get_nowait())
+        except queue.Empty:
+            pass
+        with self._lock:
+            self.outstanding -= len(results)
+        return results
+
+    def stats(self):
+        """ Throughput counters of the write stage. """
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_depth": self.max_depth,
+                "put_wait_seconds": self.put_wait_seconds,
+                "tickers": self.tickers_written,
+                "rows": self.rows_written,
+                "transactions": self.transactions,
+                "write_seconds": self.write_seconds,
+            }
+
+    def close(self):
+        """ Write and commit whatever is queued, then stop the writer threads and return their connections. """
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+        for connection in self._connections:
+            self._pool.release(*connection)
+
+    def _run(self, sql_conn, sql_cursor):
+        batch = []
+        batch_rows = 0
+        batch_started = None
+        while True:
+            try:
+                if batch:
+                    item = self._queue.get(timeout=max(0.0, batch_started + self.commit_seconds - time.time()))
+                else:
+                    item = self._queue.get()
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not self._STOP:
+                start = time.time()
+                try:
+                    if not batch:
+                        # The connection may have sat idle on an empty queue for longer than wait_timeout.
+                        self._pool.check(sql_conn)
+                    batch_rows += self._write(sql_conn, sql_cursor, item)
+                    batch.append(item)
+                except Exception as e:
+                    # Part of the failed ticker may already be written, so undo the group and redo the others.
+                    self._rollback(sql_conn)
+                    self._retry_individually(sql_conn, sql_cursor, batch)
+                    self._results.put((item[0], item[3], e))
+                    batch, batch_rows = [], 0
+                with self._lock:
+                    self.write_seconds += time.time() - start
+                if batch and batch_started is None:
+                    batch_started = time.time()
+
+            due = batch and (
+                item is None or item is self._STOP or batch_rows >= self.commit_rows
+                or time.time() >= batch_started + self.commit_seconds)
+            if due:
+                self._commit(sql_conn, sql_cursor, batch, batch_rows)
+                batch, batch_rows = [], 0
+            if not batch:
+                batch_started = None
+            if item is self._STOP:
+                break
+
+    def _write(self, sql_conn, sql_cursor, item):
+        ticker, data_source_id, security_metadata_id, raw_data = item
+        profiled = self.metrics.profiled if self.metrics is not None else lambda function, **kwargs: function(**kwargs)
+        return profiled(
+            write_price_observations,
+            logger=self.logger,
+            sql_conn=sql_conn,
+            sql_cursor=sql_cursor,
+            ticker=ticker,
+            data_source_id=data_source_id,
+            raw_data=raw_data,
+            security_metadata_id=security_metadata_id,
+            insert_strategy=self.insert_strategy,
+            commit=False,
+            metrics=self.metrics,
+            adjust_prices=self.adjust_prices,
+            rollups=self.rollups,
+        )
+
+    def _commit(self, sql_conn, sql_cursor, batch, batch_rows):
+        start = time.time()
+        try:
+            commit_data(sql_conn, sql_cursor)
+        except Exception:
+            self._rollback(sql_conn)
+            self._retry_individually(sql_conn, sql_cursor, batch)
+            return
+        elapsed = time.time() - start
+        with self._lock:
+            self.transactions += 1
+            self.tickers_written += len(batch)
+            self.rows_written += batch_rows
+            self.write_seconds += elapsed
+        if self.metrics is not None:
+            self.metrics.add_time("commit", elapsed)
+            for ticker, _, _, raw_data in batch:
+                self.metrics.count("rows_inserted", 0 if raw_data is None else len(raw_data), ticker=ticker)
+        self.logger("Committed {} rows for {} tickers in {:.3f} seconds".format(batch_rows, len(batch), elapsed))
+        for ticker, _, _, raw_data in batch:
+            self._results.put((ticker, raw_data, None))
+
+    def _retry_individually(self, sql_conn, sql_cursor, batch):
+        for item in batch:
+            try:
+                rows = self._write(sql_conn, sql_cursor, item)
+                commit_data(sql_conn, sql_cursor)
+            except Exception as e:
+                self._rollback(sql_conn)
+                self._results.put((item[0], item[3], e))
+                continue
+            with self._lock:
+                self.transactions += 1
+                self.tickers_written += 1
+                self.rows_written += rows
+            if self.metrics is not None:
+                self.metrics.count("rows_inserted", rows, ticker=item[0])
+            self._results.put((item[0], item[3], None))
+
+    @staticmethod
+    def _rollback(sql_conn):
+        try:
+            sql_conn.rollback()
+        except Exception:
+            pass  # the connection is gone; the server discards the open transaction
+
+
 #####################################
 ##### Database Update Functions #####
 #####################################
 
 
+class DatabaseState(object):
+    """ In-memory snapshot of the bookkeeping database_update() needs for every symbol: data source IDs,
+    SecurityMetaDataIDs and the last SampleTime stored. It is loaded with a single query against
+    SecurityPriceSummary and kept current as the run writes, replacing several scalar round trips per ticker.
+    """
+
+    def __init__(self):
+        self.data_sources = {}  # DataSourceName -> DataSourceID
+        self.symbols = {}  # SecuritySymbol -> {'security_metadata_id', 'data_source_id', 'last_sample_time'}
+
+    @classmethod
+    def load(cls, sql_cursor):
+        """ Build a snapshot from the database.
+
+        :param sql_cursor: a SQL cursor from an active connection.
+        :return: a DatabaseState instance.
+        """
+        state = cls()
+        sql_cursor.execute("""
+            SELECT
+                ds.DataSourceName,
+                ds.DataSourceID,
+                smd.SecuritySymbol,
+                smd.SecurityMetaDataID,
+                sps.LastSampleTime
+            FROM
+                DataSource AS ds
+            LEFT JOIN
+                SecurityMetaData AS smd ON smd.DataSourceID=ds.DataSourceID
+            LEFT JOIN
+                SecurityPriceSummary AS sps ON sps.SecurityMetaDataID=smd.SecurityMetaDataID
+            """)
+        for data_source_name, data_source_id, symbol, security_metadata_id, last_sample_time in sql_cursor.fetchall():
+            state.data_sources[data_source_name] = data_source_id
+            if symbol is not None:
+                state.add_symbol(symbol, security_metadata_id, data_source_id, last_sample_time)
+        return state
+
+    def data_source_id(self, data_source_name):
+        return self.data_sources.get(data_source_name)
+
+    def security_metadata_id(self, symbol):
+        return self.symbols.get(symbol, {}).get('security_metadata_id')
+
+    def last_sample_time(self, symbol):
+        return self.symbols.get(symbol, {}).get('last_sample_time')
+
+    def add_data_source(self, data_source_name, data_source_id):
+        self.data_sources[data_source_name] = data_source_id
+
+    def add_symbol(self, symbol, security_metadata_id, data_source_id, last_sample_time=None):
+        self.symbols[symbol] = {
+            'security_metadata_id': security_metadata_id,
+            'data_source_id': data_source_id,
+            'last_sample_time': last_sample_time,
+        }
+
+    def remove_symbol(self, symbol):
+        self.symbols.pop(symbol, None)
+
+    def record_write(self, symbol, raw_data):
+        """ Advance the stored last SampleTime for symbol after raw_data has been written. """
+        if raw_data is None or raw_data.empty or symbol not in self.symbols:
+            return
+        newest = raw_data.index.max().to_pydatetime()
+        last_sample_time = self.symbols[symbol]['last_sample_time']
+        if last_sample_time is None or newest > last_sample_time:
+            self.symbols[symbol]['last_sample_time'] = newest
+
+
 def database_update(
         logger,
         sql_conn,
         sql_cursor,
         data_source_info,
         wait_seconds=2,
-        cutoff_hour=17,
+        settle_minutes=60,
         alphavantage_premium=False,
-        tickers=[]
+        tickers=[],
+        workers=1,
+        calls_per_minute=None,
+        calls_per_day=None,
+        rate_limiter=None,
+        insert_strategy="multirow",
+        response_cache=None,
+        parser="columnar",
+        job_queue=None,
+        max_attempts=5,
+        max_runtime_minutes=None,
+        price_mirror=None,
+        writers=1,
+        write_queue_size=8,
+        commit_rows=50000,
+        commit_seconds=5.0,
+        connection_pool=None,
+        metrics=None,
+        calendar=None,
+        backfill=False,
+        adjust_prices=None,
+        rollups=None,
 ):
     """ Main routine to seed and/or update Security price database.
 
+    The update runs as a pipeline: a pool of `workers` threads, sharing one token-bucket RateLimiter, fetch and
+    parse tickers and hand the dataframes to a PriceWriter, whose threads write them over their own connections
+    and group several tickers per commit. The calling thread does the bookkeeping on sql_conn and marks a ticker
+    done once its rows are committed.
+
     :param sql_conn: active SQL server connection.
     :param sql_cursor: a SQL cursor from an active connection.
     :param logger: a logging instance, e.g. logger.info or textEdit.append
-    :param cutoff_hour: only collect today's data if the current hour is > cutoff hour.
-    :param data_source_name: AlphaVantage.
-    :param data_source_url: https://www.alphavantage.co
-    :return: no return value.
+    :param settle_minutes: a session's bars are only expected this many minutes after its close.
+    :param wait_seconds: if no rate limit is given, space API calls wait_seconds apart (0 disables throttling).
+    :param workers: number of threads fetching data from the data source concurrently.
+    :param calls_per_minute: API requests per minute allowed by the data source plan.
+    :param calls_per_day: API requests per day allowed by the data source plan.
+    :param rate_limiter: a RateLimiter to share with other callers. Overrides calls_per_minute/calls_per_day.
+    :param insert_strategy: how rows are sent to the server, see write_price_observations().
+    :param response_cache: optional ResponseCache of raw API responses. In offline mode, the run is replayed from
+        the cache without any API calls.
+    :param parser: AlphaVantage payload parser, one of ALPHAVANTAGE_PARSERS.
+    :param job_queue: a JobQueue tracking per-ticker progress. Pass a file-backed one to resume killed runs; by
+        default an in-memory queue is used.
+    :param max_attempts: failures after which a ticker is given up on, if job_queue isn't given.
+    :param max_runtime_minutes: stop starting new tickers after this long; unfinished ones stay pending.
+    :param price_mirror: optional PriceMirror, brought in sync with the database and then kept current with
+        every write.
+    :param writers: number of writer threads, each with its own connection.
+    :param write_queue_size: fetched tickers that may wait to be written before fetch workers block.
+    :param commit_rows: rows per group commit.
+    :param commit_seconds: longest time written rows wait to be committed.
+    :param connection_pool: ConnectionPool for the writer threads, with room for `writers` connections. By default
+        one is opened with sql_conn's settings and closed at the end. sql_conn is health-checked through it too.
+    :param metrics: RunMetrics collecting per-phase and per-ticker timings and counters. A new one is created if
+        not given; pass one to turn on profiling or memory tracing.
+    :param calendar: TradingCalendar deciding which bars should exist by now, tradingcalendar.nyse_calendar() by
+        default. Tickers that already have them are skipped without an API call.
+    :param backfill: if True, also scan the price table for sessions missing inside each symbol's history (see
+        tradingcalendar.scan_gaps()) and fetch them. Either way, the requests for each ticker are chosen by
+        tradingcalendar.plan_requests() to cover every session missing since its last bar, and the run ends with a
+        report of the gaps repaired.
+    :param adjust_prices: None (the default) to store adjusted closes as the data source gives them, or one of
+        corporateactions.ADJUST_MODES to derive missing ones and keep them current when splits and dividends come
+        in, see write_price_observations(). Ignored for intraday databases.
+    :param rollups: names in ROLLUP_INTERVALS kept current in an intraday database's PriceRollup table, default all
+        of them. Ignored for daily databases.
+    :return: the RunMetrics of the run (see RunMetrics.report()).
     """
 
     if not tickers:
         tickers = get_symbols_from_database(sql_conn)  # or get_dow30_stocks() or ...
 
+    if rate_limiter is None:
+        if calls_per_minute is None and wait_seconds > 0:
+            calls_per_minute = 60.0 / wait_seconds
+        if calls_per_minute:
+            rate_limiter = ratelimit.RateLimiter(calls_per_minute=calls_per_minute, calls_per_day=calls_per_day)
+
     start = time.time()
     ticker_list = list(tickers.keys())
-
-    # If items are removed from the ticker lists, drop them from the database.
-    to_drop = list(set(get_symbols_from_database(sql_conn)) - set(ticker_list))
-    if to_drop:
-        logger("Symbols removed from ticker list that will be deleted: {}".format(" ,".join(to_drop)))
-        [delete_existing_symbol(symbol, sql_conn=sql_conn, sql_cursor=sql_cursor, logger=logger) for symbol in to_drop]
-
-    dtnow = dt.now()
-    if dtnow.hour < cutoff_hour or dtnow.weekday() > 4:
-        update_through_date = dtnow - pd.tseries.offsets.BDay(n=1)
+    database_name = sql_conn.db.decode() if isinstance(sql_conn.db, bytes) else sql_conn.db
+    intraday = "intraday" in str(database_name).lower()
+    if intraday:
+        adjust_prices = None
+        rollups = list(ROLLUP_INTERVALS) if rollups is None else list(rollups)
     else:
-        update_through_date = dt(dtnow.year, dtnow.month, dtnow.day, hour=23, minute=59)
-
-    while ticker_list:
-        ticker = ticker_list.pop(0)
-        data_source_name = tickers[ticker]
-
-        data_source_id = fetchone(sql_cursor, query="SELECT GetDataSourceIDFromDataSourceName('{}')".format(data_source_name))
-
-        if not data_source_id:
-            data_source_id = update_data_source(
-                logger=logger,
-                sql_conn=sql_conn,
-                sql_cursor=sql_cursor,
-                data_source_name=data_source_name,
-                data_source_url=data_source_info[data_source_name]['url'])
-
-        logger("Processing {} ({} remaining)".format(ticker, len(ticker_list)))
-
-        try:
-
-            ########################################
-            # Update SecurityMetaData if necessary #
-            ########################################
-
-            security_metadata_id = fetchone(sql_cursor, query="SELECT GetMetaDataIDForSymbol('{}')".format(ticker))
-
-            if not security_metadata_id:
-                update_metadata(
-                    logger=logger,
-                    sql_conn=sql_conn,
-                    sql_cursor=sql_cursor,
-                    ticker=ticker,
-                    data_source_id=data_source_id)
-
-            #################################################
-            # Update SecurityPriceObservations if necessary #
-            #################################################
-
-            last_dt_in_db = fetchone(sql_cursor, query="SELECT GetLastSampleTimeForSecurity('{}')".format(ticker))
-
-            if (last_dt_in_db is not None) and (last_dt_in_db.date() == update_through_date.date()):
-                logger("... no update required: record is up to date.")
+        rollups = None
+
+    if metrics is None:
+        metrics = instrumentation.RunMetrics()
+    metrics.database = metrics.database or database_name
+
+    # Snapshot of data source IDs, metadata IDs and last sample times, kept current as we write.
+    with metrics.timer("bookkeeping"):
+        state = DatabaseState.load(sql_cursor)
+
+    # Add symbols new to the ticker list and drop the ones removed from it, all in one transaction.
+    with metrics.timer("universe_sync"):
+        added, removed = sync_universe(logger, sql_conn, sql_cursor, tickers, data_source_info)
+    metrics.count("symbols_added", len(added))
+    metrics.count("symbols_removed", len(removed))
+    if added or removed:
+        with metrics.timer("bookkeeping"):
+            state = DatabaseState.load(sql_cursor)
+    if price_mirror is not None:
+        for symbol in removed:
+            price_mirror.remove(symbol)
+
+    # Catch the mirror up with anything written without it (e.g. before it existed).
+    if price_mirror is not None:
+        for symbol in sorted(set(state.symbols) & set(ticker_list)):
+            price_mirror.sync_from_database(logger, sql_conn, symbol, state.last_sample_time(symbol))
+
+    # The last session that has closed (in exchange time, skipping holidays) and the last bar it should have left
+    # in the database. Tickers that already have that bar are skipped before any API call.
+    if calendar is None:
+        calendar = tradingcalendar.nyse_calendar()
+    if rollups:
+        store_trading_sessions(sql_conn, sql_cursor, calendar)
+    last_session = calendar.last_closed_session(settle_minutes=settle_minutes)
+    update_through_date = dt(last_session.year, last_session.month, last_session.day, hour=23, minute=59)
+    interval = INTRADAY_INTERVAL if intraday else None
+    expected_last_bar = calendar.expected_last_bar(last_session, interval=interval)
+    stale_tickers, current_tickers = tradingcalendar.plan_updates(state, ticker_list, expected_last_bar)
+
+    # Sessions missing inside stored histories; tickers with any are fetched even if they are current.
+    gaps = {}
+    if backfill:
+        with metrics.timer("gap_scan"):
+            gaps = tradingcalendar.scan_gaps(sql_cursor, state, calendar, last_session)
+        gaps = {ticker: missing for ticker, missing in gaps.items() if ticker in tickers}
+        logger("Gap scan: {} missing sessions in {} symbols".format(
+            sum(len(missing) for missing in gaps.values()), len(gaps)))
+        stale_tickers += [ticker for ticker in current_tickers if ticker in gaps]
+        current_tickers = [ticker for ticker in current_tickers if ticker not in gaps]
+
+    logger("Updating through the {} session: {} tickers to fetch, {} already current".format(
+        last_session.date(), len(stale_tickers), len(current_tickers)))
+    metrics.count("api_calls_saved", len(current_tickers))
+
+    # Durable per-ticker job states for this run; resumes a run that was killed part way through.
+    if job_queue is None:
+        job_queue = jobqueue.JobQueue(max_attempts=max_attempts)
+    metrics.run_id = "{}:{}".format(database_name, update_through_date.date())
+    counts = job_queue.seed(run_id=metrics.run_id, tickers=stale_tickers)
+    if counts.get(jobqueue.JobQueue.DONE) or counts.get(jobqueue.JobQueue.DEAD):
+        logger("Resuming run: {}".format(counts))
+    # Counted here rather than asked of the queue per ticker, which for a LeaseQueue is a round trip to the server.
+    pending_at_start = counts.get(jobqueue.JobQueue.PENDING, 0)
+    claimed = 0
+
+    deadline = start + max_runtime_minutes * 60 if max_runtime_minutes else None
+
+    own_pool = connection_pool is None
+    if own_pool:
+        connection_pool = ConnectionPool.from_connection(sql_conn, size=writers)
+    writer = PriceWriter(
+        connection_pool=connection_pool,
+        writers=writers,
+        queue_size=write_queue_size,
+        commit_rows=commit_rows,
+        commit_seconds=commit_seconds,
+        insert_strategy=insert_strategy,
+        logger=logger,
+        metrics=metrics,
+        adjust_prices=adjust_prices,
+        rollups=rollups)
+
+    def fetch_stage(ticker, data_source_id, security_metadata_id, **kwargs):
+        # Runs on a fetch worker. Blocks in writer.put() while the write queue is full.
+        fetch_start = time.time()
+        raw_data = metrics.profiled(fetch_price_observations, ticker=ticker, metrics=metrics, **kwargs)
+        fetch_seconds = time.time() - fetch_start
+        writer.put(ticker, data_source_id, security_metadata_id, raw_data)
+        return 0 if raw_data is None else len(raw_data), fetch_seconds
+
+    # Tickers fetched with more than a compact request, or with gaps: ticker -> missing sessions and what was done.
+    repairs = {}
+
+    def record_results(results):
+        for ticker, raw_data, error in results:
+            if error is not None:
+                log_job_failure(logger, job_queue, ticker, error, metrics=metrics)
                 continue
-
-            if last_dt_in_db is None:
-                # Happens if new symbol is added but no data exists.
-                logger("... seeding new data through {}".format(update_through_date.date()))
-                seed_mode = True
-            else:
-                seed_mode = False
-
-            update_price_observations(
-                logger=logger,
-                sql_conn=sql_conn,
-                sql_cursor=sql_cursor,
-                ticker=ticker,
-                data_source_name=data_source_name,
-                data_source_id=data_source_id,
-                data_source_info=data_source_info,
-                last_dt_in_db=last_dt_in_db,
-                update_through_date=update_through_date,
-                seed_mode=seed_mode,
-                alphavantage_premium=alphavantage_premium,
-            )
-
-            if wait_seconds > 0 and len(ticker_list) > 0:
-                logger("... waiting {} seconds so we don't spam the data provider's server.".format(wait_seconds))
-                time.sleep(wait_seconds)
-
-        except:
-            logger("... FAILED!")
-            ticker_list.append(ticker)
-            logger("... waiting {} seconds so we don't spam the data provider's server.".format(wait_seconds))
-            time.sleep(wait_seconds)
+            if ticker in repairs and raw_data is not None:
+                repair = repairs[ticker]
+                filled = repair['missing'].isin(raw_data.index.normalize())
+                repair['sessions_filled'] = int(filled.sum())
+                repair['rows'] = int(raw_data.index.normalize().isin(repair['missing']).sum())
+                metrics.count("sessions_repaired", repair['sessions_filled'], ticker=ticker)
+            # A split, dividend or backfill re-adjusted the stored history, so the mirror copy is stale.
+            readjusted = adjust_prices is not None and raw_data is not None and not raw_data.empty and (
+                len(corporateactions.corporate_actions(raw_data)) > 0
+                or (state.last_sample_time(ticker) is not None
+                    and raw_data.index.min() <= pd.Timestamp(state.last_sample_time(ticker))))
+            state.record_write(ticker, raw_data)
+            if price_mirror is not None:
+                with metrics.timer("mirror", ticker):
+                    if readjusted:
+                        price_mirror.remove(ticker)
+                        price_mirror.sync_from_database(logger, sql_conn, ticker)
+                    else:
+                        price_mirror.update(ticker, raw_data)
+            job_queue.complete(ticker)
+            metrics.count("tickers_updated")
+
+    # Futures that are still fetching, mapped to the ticker they belong to.
+    pending = {}
+    fetch_stats = {"tickers": 0, "rows": 0, "seconds": 0.0}
+    last_progress = time.time()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            while True:
+                out_of_time = deadline is not None and time.time() > deadline
+
+                # Keep every worker busy (plus one queued job each) while tickers remain.
+                while not out_of_time and len(pending) < 2 * max(1, workers):
+                    ticker = job_queue.claim()
+                    if ticker is None:
+                        break
+                    claimed += 1
+                    if ticker not in tickers:
+                        # Left pending by an earlier process, but no longer in the ticker list.
+                        logger("{}: no longer in the ticker list, skipped".format(ticker))
+                        job_queue.complete(ticker)
+                        continue
+                    data_source_name = tickers[ticker]
+
+                    logger("Processing {} (claim {}, {} jobs pending at start)".format(
+                        ticker, claimed, pending_at_start))
+
+                    bookkeeping_start = time.time()
+                    try:
+                        connection_pool.check(sql_conn)
+                        data_source_id = state.data_source_id(data_source_name)
+
+                        if not data_source_id:
+                            data_source_id = update_data_source(
+                                logger=logger,
+                                sql_conn=sql_conn,
+                                sql_cursor=sql_cursor,
+                                data_source_name=data_source_name,
+                                data_source_url=data_source_info[data_source_name]['url'])
+                            state.add_data_source(data_source_name, data_source_id)
+
+                        ########################################
+                        # Update SecurityMetaData if necessary #
+                        ########################################
+
+                        security_metadata_id = state.security_metadata_id(ticker)
+
+                        if not security_metadata_id:
+                            security_metadata_id = update_metadata(
+                                logger=logger,
+                                sql_conn=sql_conn,
+                                sql_cursor=sql_cursor,
+                                ticker=ticker,
+                                data_source_id=data_source_id)
+                            state.add_symbol(ticker, security_metadata_id, data_source_id)
+
+                        #################################################
+                        # Update SecurityPriceObservations if necessary #
+                        #################################################
+
+                        last_dt_in_db = state.last_sample_time(ticker)
+
+                        if (last_dt_in_db is not None) and (last_dt_in_db >= expected_last_bar) and ticker not in gaps:
+                            logger("... no update required: record is up to date.")
+                            job_queue.complete(ticker)
+                            metrics.count("tickers_up_to_date")
+                            metrics.count("api_calls_saved")
+                            continue
+
+                        # The cheapest requests covering every session missing since the last bar, and any gaps.
+                        missing = tradingcalendar.missing_sessions(
+                            calendar, last_session, last_dt_in_db, interval=interval)
+                        backfill_sessions = gaps.get(ticker)
+                        if backfill_sessions is not None:
+                            missing = backfill_sessions.append(missing)
+                        requests = tradingcalendar.plan_requests(calendar, last_session, missing, interval=interval)
+
+                        if last_dt_in_db is None:
+                            # Happens if new symbol is added but no data exists.
+                            logger("... seeding new data through {}".format(update_through_date.date()))
+                        elif backfill_sessions is not None or requests[0]['outputsize'] != "compact":
+                            logger("... {} sessions missing since {}: {}".format(
+                                len(missing), missing.min().date(),
+                                ", ".join(request['month'] or request['outputsize'] for request in requests)))
+                            repairs[ticker] = {
+                                'missing': missing, 'requests': requests, 'sessions_filled': 0, 'rows': 0}
+
+                        future = executor.submit(
+                            fetch_stage,
+                            ticker=ticker,
+                            data_source_id=data_source_id,
+                            security_metadata_id=security_metadata_id,
+                            logger=logger,
+                            data_source_name=data_source_name,
+                            data_source_info=data_source_info,
+                            last_dt_in_db=last_dt_in_db,
+                            update_through_date=update_through_date,
+                            intraday=intraday,
+                            alphavantage_premium=alphavantage_premium,
+                            rate_limiter=rate_limiter,
+                            response_cache=response_cache,
+                            parser=parser,
+                            requests=requests,
+                            backfill_sessions=backfill_sessions,
+                        )
+                        pending[future] = ticker
+
+                    except Exception as e:
+                        log_job_failure(logger, job_queue, ticker, e, metrics=metrics)
+                    finally:
+                        metrics.add_time("bookkeeping", time.time() - bookkeeping_start, ticker=ticker)
+
+                if not pending and not writer.outstanding:
+                    retry_in = job_queue.seconds_until_next()
+                    if retry_in is None or out_of_time:
+                        break
+                    if retry_in > 0:
+                        logger("... waiting {:.0f} seconds for the next retry".format(retry_in))
+                        time.sleep(
+                            max(0, min(retry_in, deadline - time.time())) if deadline is not None else retry_in)
+                    continue
+
+                # Wake up when a fetch finishes, a write commits, or a backed-off job becomes eligible again.
+                retry_in = job_queue.seconds_until_next()
+                poll = min(retry_in, 0.5) if retry_in else 0.5
+                if pending:
+                    done, _ = wait(pending, timeout=poll, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        ticker = pending.pop(future)
+                        try:
+                            rows, seconds = future.result()
+                            fetch_stats["tickers"] += 1
+                            fetch_stats["rows"] += rows
+                            fetch_stats["seconds"] += seconds
+                        except Exception as e:
+                            log_job_failure(logger, job_queue, ticker, e, metrics=metrics)
+
+                # Tickers are only done once their rows are committed.
+                record_results(writer.results(timeout=0 if pending else poll))
+
+                if time.time() - last_progress > 30:
+                    log_pipeline_stats(logger, fetch_stats, writer, start)
+                    last_progress = time.time()
+    finally:
+        writer.close()
+        if own_pool:
+            connection_pool.close()
+
+    # Anything committed by close() is done too.
+    record_results(writer.results())
 
     end = time.time()
     logger("Processing took {:.2f} minutes".format((end - start) / 60.0))
+    counts = job_queue.counts()
+    logger("Jobs: {} done, {} dead, {} left for the next run".format(
+        counts.get(jobqueue.JobQueue.DONE, 0), counts.get(jobqueue.JobQueue.DEAD, 0),
+        counts.get(jobqueue.JobQueue.PENDING, 0)))
+    for ticker, attempts, last_error in job_queue.dead_letters():
+        logger("... {} failed {} times, last error: {}".format(ticker, attempts, last_error))
+    if rate_limiter is not None and rate_limiter.calls:
+        logger("Made {} API requests ({:.3f} requests/sec, {:.1f} seconds spent rate limiting)".format(
+            rate_limiter.calls, rate_limiter.requests_per_second(), rate_limiter.seconds_waited))
+    if response_cache is not None:
+        logger("Response cache: {} hits, {} misses".format(response_cache.hits, response_cache.misses))
+    logger("Skipped {} tickers that were already current, saving as many API calls".format(
+        metrics.counters.get("api_calls_saved", 0)))
+    log_pipeline_stats(logger, fetch_stats, writer, start)
+    repair_report = log_repairs(logger, repairs, dead=[ticker for ticker, _, _ in job_queue.dead_letters()])
+
+    metrics.finish(
+        jobs=counts,
+        dead_letters=[
+            {"ticker": ticker, "attempts": attempts, "last_error": last_error}
+            for ticker, attempts, last_error in job_queue.dead_letters()],
+        fetch_stage=fetch_stats,
+        write_stage=writer.stats(),
+        repairs=repair_report)
+    phases = sorted(metrics.report()["phases"].items(), key=lambda item: -item[1]["seconds"])
+    logger("Time by phase: {}".format(", ".join(
+        "{} {:.1f}s".format(phase, totals["seconds"]) for phase, totals in phases)))
+    return metrics
+
+
+def log_pipeline_stats(logger, fetch_stats, writer, start):
+    """ Log the throughput of the fetch and write stages and the write queue depth. """
+    elapsed = max(time.time() - start, 1e-9)
+    write_stats = writer.stats()
+    logger("Fetch stage: {} tickers ({:.1f}/min), {} rows ({:.0f} rows/sec)".format(
+        fetch_stats["tickers"], 60 * fetch_stats["tickers"] / elapsed, fetch_stats["rows"],
+        fetch_stats["rows"] / elapsed))
+    logger("Write stage: {} tickers in {} commits, {} rows ({:.0f} rows/sec, {:.1f} seconds writing)".format(
+        write_stats["tickers"], write_stats["transactions"], write_stats["rows"], write_stats["rows"] / elapsed,
+        write_stats["write_seconds"]))
+    logger("Write queue: depth {} (max {}), fetch workers blocked for {:.1f} seconds".format(
+        write_stats["depth"], write_stats["max_depth"], write_stats["put_wait_seconds"]))
+
+
+def log_repairs(logger, repairs, dead=()):
+    """ Log which gaps were repaired, and how.
+
+    :param repairs: dict of ticker -> {'missing', 'requests', 'sessions_filled', 'rows'} from database_update().
+    :param dead: tickers that failed for good in this run.
+    :return: the report as a list of JSON-serializable dicts, one per ticker.
+    """
+    report = []
+    for ticker in sorted(repairs):
+        repair = repairs[ticker]
+        missing = len(repair['missing'])
+        if ticker in dead:
+            status = "failed"
+        elif repair['sessions_filled'] == missing:
+            status = "repaired"
+        elif repair['sessions_filled']:
+            status = "partial"
+        else:
+            # committed with nothing for those sessions (e.g. a halt), or not reached before the run stopped
+            status = "not filled"
+        report.append({
+            "ticker": ticker,
+            "status": status,
+            "missing_sessions": missing,
+            "first_missing": str(repair['missing'].min().date()),
+            "last_missing": str(repair['missing'].max().date()),
+            "sessions_filled": repair['sessions_filled'],
+            "rows": repair['rows'],
+            "requests": [request['month'] or request['outputsize'] for request in repair['requests']],
+        })
+    if report:
+        logger("Gap repairs: {} repaired, {} partial, {} not filled, {} failed".format(*[
+            sum(entry["status"] == status for entry in report)
+            for status in ["repaired", "partial", "not filled", "failed"]]))
+        for entry in report:
+            logger("... {ticker}: {status}, {sessions_filled} of {missing_sessions} sessions from {first_missing} to "
+                   "{last_missing} ({rows} rows, requests: {requests})".format(
+                       **dict(entry, requests=", ".join(entry["requests"]))))
+    return report
+
+
+def log_job_failure(logger, job_queue, ticker, error, metrics=None):
+    """ Record a failed attempt for ticker in job_queue (and metrics, if given) and log what happens next. """
+    retry_in = job_queue.fail(ticker, error)
+    if metrics is not None:
+        metrics.count("retries" if retry_in is not None else "tickers_dead", ticker=ticker)
+    if retry_in is None:
+        logger("{}: FAILED! ({}), giving up after {} attempts".format(ticker, error, job_queue.max_attempts))
+    else:
+        logger("{}: FAILED! ({}), will retry in {:.0f} seconds".format(ticker, error, retry_in))
 
 
 def update_data_source(logger, sql_conn, sql_cursor, data_source_name, data_source_url):
@@ -389,9 +1774,14 @@ def  update_metadata(
 
         sql_cursor.callproc('AddNewSymbol', args=[
             ticker, sec_type, sec_tz, sec_contract_size, sec_currency, data_source_id])
-        sql_conn.commit()
+        commit_data(sql_conn, sql_cursor)
+
+        security_metadata_id = fetchone(sql_cursor, query="SELECT GetMetaDataIDForSymbol('{}')".format(ticker))
+        logger("... SecurityMetaDataID={}".format(security_metadata_id))
     else:
-        logger("{} is already defined with SecurityMetaDataID={}".format(ticker, data_source_id))
+        logger("{} is already defined with SecurityMetaDataID={}".format(ticker, security_metadata_id))
+
+    return security_metadata_id
 
 
 def update_price_observations(
@@ -406,8 +1796,11 @@ def update_price_observations(
         update_through_date,
         seed_mode=False,
         alphavantage_premium=False,
+        rate_limiter=None,
+        insert_strategy="multirow",
+        response_cache=None,
     ):
-    """
+    """ Fetch new price data for a ticker and insert it into the database.
 
     :param logger: a logging instance, e.g. logger.info or textEdit.append
     :param sql_conn: active SQL server connection.
@@ -418,74 +1811,489 @@ def update_price_observations(
     :param data_source_info: dict of datasource info paraed from cred file.
     :param update_through_date: date after whuch we should trim raw data.
     :param seed_mode: if True, pull "full" data from source, otherwise pull "compact" data.
+    :param rate_limiter: optional RateLimiter used to throttle the HTTP call.
+    :param insert_strategy: how rows are sent to the server, see write_price_observations().
+    :param response_cache: optional ResponseCache of raw API responses.
     :return: no return value.
     """
+    intraday = "intraday" in str(sql_conn.db).lower()
+    if intraday:
+        store_trading_sessions(sql_conn, sql_cursor)
+    raw_data = fetch_price_observations(
+        logger=logger,
+        ticker=ticker,
+        data_source_name=data_source_name,
+        data_source_info=data_source_info,
+        last_dt_in_db=last_dt_in_db,
+        update_through_date=update_through_date,
+        seed_mode=seed_mode,
+        intraday=intraday,
+        alphavantage_premium=alphavantage_premium,
+        rate_limiter=rate_limiter,
+        response_cache=response_cache,
+    )
+
+    write_price_observations(
+        logger=logger,
+        sql_conn=sql_conn,
+        sql_cursor=sql_cursor,
+        ticker=ticker,
+        data_source_id=data_source_id,
+        raw_data=raw_data,
+        insert_strategy=insert_strategy,
+        rollups=list(ROLLUP_INTERVALS) if intraday else None,
+    )
+
+
+def fetch_price_observations(
+        logger,
+        ticker,
+        data_source_name,
+        data_source_info,
+        last_dt_in_db,
+        update_through_date,
+        seed_mode=False,
+        intraday=False,
+        alphavantage_premium=False,
+        rate_limiter=None,
+        response_cache=None,
+        parser="columnar",
+        metrics=None,
+        requests=None,
+        backfill_sessions=None,
+    ):
+    """ Pull price data for a ticker from its data source, keeping only rows newer than what is in the database
+    (or in backfill_sessions). This makes no database calls, so it is safe to run from a worker thread.
+
+    :param logger: a logging instance, e.g. logger.info or textEdit.append
+    :param ticker: the ticker symbol to process.
+    :param data_source_name: the name of the datasource associated with the ticker.
+    :param data_source_info: dict of datasource info paraed from cred file.
+    :param last_dt_in_db: most recent SampleTime stored for the ticker, or None.
+    :param update_through_date: date after whuch we should trim raw data.
+    :param seed_mode: if True, pull "full" data from source, otherwise pull "compact" data.
+    :param intraday: bool, if True, grab intraday data, otherwise grab daily data.
+    :param rate_limiter: optional RateLimiter used to throttle the HTTP call.
+    :param response_cache: optional ResponseCache of raw API responses.
+    :param parser: AlphaVantage payload parser, one of ALPHAVANTAGE_PARSERS.
+    :param metrics: optional RunMetrics, see load_data_from_alphavantage().
+    :param requests: list of {'outputsize', 'month'} requests to make, see tradingcalendar.plan_requests(). By
+        default one request, "full" in seed mode and "compact" otherwise.
+    :param backfill_sessions: DatetimeIndex of earlier sessions missing from the database, whose rows are kept too.
+    :return: a Pandas dataframe of the rows to insert, or None if the data source is not supported.
+    """
 
     # It seems that "full" pulls tend to have an end date that is a few days old, while
     # "compact" pulls go through the current date. So an initial seed tends to be missing
     # a few recent days, and thus takes a second update pass to pick up the remaining data.
 
     if data_source_name == "AlphaVantage":
-        http_call = {True: "full", False: "compact"}
-        raw_data = load_data_from_alphavantage(
-            logger=logger,
-            ticker=ticker,
-            api_key=data_source_info[data_source_name]['api_key'],
-            outputsize=http_call[seed_mode],
-            intraday="intraday" in str(sql_conn.db).lower(),
-            premium=alphavantage_premium,
-        )
+        if requests is None:
+            requests = [{'outputsize': "full" if seed_mode else "compact", 'month': None}]
+        responses = [
+            load_data_from_alphavantage(
+                logger=logger,
+                ticker=ticker,
+                api_key=data_source_info[data_source_name]['api_key'],
+                outputsize=request['outputsize'],
+                intraday=intraday,
+                premium=alphavantage_premium,
+                rate_limiter=rate_limiter,
+                response_cache=response_cache,
+                parser=parser,
+                metrics=metrics,
+                base_url=data_source_info[data_source_name].get('api_url', ALPHAVANTAGE_URL),
+                month=request.get('month'),
+            )
+            for request in requests]
+        raw_data = responses[0]
+        if len(responses) > 1:
+            raw_data = pd.concat(responses)
+            raw_data = raw_data[~raw_data.index.duplicated(keep="last")].sort_index()
         # isolate the data to update
         if last_dt_in_db is not None:
-            raw_data = raw_data[raw_data.index > last_dt_in_db]
+            keep = raw_data.index > last_dt_in_db
+            if backfill_sessions is not None and len(backfill_sessions):
+                keep |= raw_data.index.normalize().isin(backfill_sessions)
+            raw_data = raw_data[keep]
         raw_data = raw_data[:update_through_date]  # trim
     else:
         logger("Datasource not supported: {}".format(data_source_name))
+        raw_data = None
+
+    return raw_data
+
+
+# Columns written by write_price_observations(), in the order the rows are built.
+PRICE_OBSERVATION_COLUMNS = [
+    "SampleTime",
+    "OpenPrice",
+    "HighPrice",
+    "LowPrice",
+    "ClosePrice",
+    "AdjustedClosePrice",
+    "Volume",
+    "DividendAmount",
+    "SplitCoefficient",
+    "DataSourceID",
+    "SecurityMetaDataID",
+]
+
+INSERT_STRATEGIES = ["executemany", "multirow", "infile"]
+
+PRICE_LAYOUTS = ["standard", "compact_daily", "compact_intraday"]
+
+# Bars already stored for (SecurityMetaDataID, SampleTime) are overwritten, so overlapping re-fetches are safe.
+PRICE_OBSERVATION_UPSERT = " ON DUPLICATE KEY UPDATE " + ", ".join(
+    "{0}=VALUES({0})".format(column) for column in PRICE_OBSERVATION_COLUMNS[1:-1])
+
 
-    # replace NaN with None for SQL compatibility
-    raw_data = raw_data.where(raw_data.notnull(), None)
-
-    raw_data["data_source_id"] = str(data_source_id)
-    raw_data["ticker"] = ticker
-
-    if not raw_data.empty:
-        logger('... inserting into table: DataSourcePriceObservation')
-        stmt = """
-            INSERT INTO
-            DataSourcePriceObservation (
-                SampleTime,
-                OpenPrice,
-                HighPrice,
-                LowPrice,
-                ClosePrice,
-                AdjustedClosePrice,
-                Volume,
-                DividendAmount,
-                SplitCoefficient,
-                DataSourceID,
-                SecurityMetaDataID)
-            VALUES (
-                %s,
-                %s,
-                %s,
-                %s,
-                %s,
-                %s,
-                %s,
-                %s,
-                %s,
-                %s,
-                GetMetaDataIDForSymbol(%s));
-            """
-
-        tuple_data = [tuple(x) for x in raw_data.to_records(index=True)]
-
-        # convert numpy datetime64 to a date string that MySQL can handle
-        for i in range(len(tuple_data)):
-            tuple_data[i] = tuple((npdt2str(x) if type(x) == np.datetime64 else x for x in tuple_data[i]))
-
-        sql_cursor.executemany(stmt, tuple_data)
+def price_observations_to_text(raw_data, data_source_id, security_metadata_id, na_rep, quote_times):
+    """ Render a dataframe from fetch_price_observations() as comma-separated rows in PRICE_OBSERVATION_COLUMNS
+    order. Timestamps are formatted and NaNs replaced in one vectorized pass, with no Python objects per cell.
+
+    :param raw_data: dataframe of price observations indexed by SampleTime.
+    :param data_source_id: DataSourceID to store on every row.
+    :param security_metadata_id: SecurityMetaDataID to store on every row.
+    :param na_rep: text for missing values, e.g. NULL (SQL literal) or \\N (LOAD DATA).
+    :param quote_times: if True, wrap SampleTime in single quotes so each row is a valid SQL tuple body.
+    :return: list of row strings.
+    """
+    sample_times = raw_data.index.strftime("%Y-%m-%d %H:%M:%S")
+    if quote_times:
+        sample_times = "'" + sample_times + "'"
+
+    frame = raw_data.apply(pd.to_numeric, errors="coerce")
+    frame.insert(0, "SampleTime", sample_times)
+    frame["DataSourceID"] = int(data_source_id)
+    frame["SecurityMetaDataID"] = int(security_metadata_id)
+
+    text = frame.to_csv(header=False, index=False, na_rep=na_rep, quoting=csv.QUOTE_NONE)
+    return text.splitlines()
+
+
+def write_price_observations(
+        logger,
+        sql_conn,
+        sql_cursor,
+        ticker,
+        data_source_id,
+        raw_data,
+        security_metadata_id=None,
+        insert_strategy="multirow",
+        chunk_size=1000,
+        commit=True,
+        metrics=None,
+        adjust_prices=None,
+        rollups=None):
+    """ Insert price data returned by fetch_price_observations() into DataSourcePriceObservation.
+
+    insert_strategy selects how rows are sent to the server:
+    - "executemany": parameterized INSERT, which PyMySQL batches into multi-row statements of up to ~1MB.
+    - "multirow": pre-rendered INSERT statements of chunk_size rows each.
+    - "infile": LOAD DATA LOCAL INFILE (needs local_infile enabled on the server and in mysql_connect()).
+
+    Rows that already exist for (SecurityMetaDataID, SampleTime) are updated in place (LOAD DATA ... REPLACE for
+    the "infile" strategy), so re-fetching an overlapping window never creates duplicate bars.
+
+    In a compact layout (see price_layout()) DataSourcePriceObservation is a read-only view, so the rows go to the
+    session's PriceObservationStaging table instead and MergePriceObservations moves them into PriceBar and
+    CorporateAction.
+
+    SecurityPriceSummary and MonthEndCalendar are refreshed by RefreshPriceSummaries in the same transaction, using
+    only the rows in the written window: the window is counted before and after the insert so ObservationCount
+    stays exact when an overlapping fetch updates existing bars.
+
+    With adjust_prices set, missing adjusted closes are derived locally (see
+    corporateactions.derive_adjusted_close()) before the insert, and a split or dividend among the rows, or rows
+    landing inside the stored history, re-adjusts the security's earlier bars with
+    corporateactions.readjust_history() in the same transaction.
+
+    With rollups set, RefreshPriceRollups recomputes the PriceRollup buckets of those intervals that the written
+    window touches, also in the same transaction. The rollups need the TradingSession table filled first, see
+    store_trading_sessions().
+
+    :param logger: a logging instance, e.g. logger.info or textEdit.append
+    :param sql_conn: active SQL server connection.
+    :param sql_cursor: a SQL cursor from an active connection.
+    :param ticker: the ticker symbol to process.
+    :param data_source_id: primary key associated with the data source name (pulled from database).
+    :param raw_data: dataframe of price observations, or None.
+    :param security_metadata_id: SecurityMetaDataID of the ticker. Looked up (once) if not provided.
+    :param insert_strategy: one of INSERT_STRATEGIES.
+    :param chunk_size: rows per INSERT statement for the "multirow" strategy.
+    :param commit: if False, leave the transaction open so the caller can group several tickers into one commit.
+    :param metrics: optional RunMetrics, given the time spent rendering rows ("render"), inserting them ("insert")
+        and maintaining the summary tables ("summary"), adjusted closes ("adjust") and rollups ("rollup"), the rows
+        inserted if commit is True, and the corporate actions seen.
+    :param adjust_prices: None to store adjusted closes as given, or one of corporateactions.ADJUST_MODES:
+        "reported" uses the splits and dividends in raw_data, "inferred" also infers splits the data source doesn't
+        report.
+    :param rollups: names in ROLLUP_INTERVALS to keep current in PriceRollup, for intraday data.
+    :return: number of rows written.
+    """
+    if raw_data is None or raw_data.empty:
+        return 0
+
+    if insert_strategy not in INSERT_STRATEGIES:
+        raise ValueError("insert_strategy must be one of {}".format(INSERT_STRATEGIES))
+    if adjust_prices is not None and adjust_prices not in corporateactions.ADJUST_MODES:
+        raise ValueError("adjust_prices must be one of {}".format(corporateactions.ADJUST_MODES))
+    if rollups and not set(rollups) <= set(ROLLUP_INTERVALS):
+        raise ValueError("rollups must be in {}".format(list(ROLLUP_INTERVALS)))
+
+    timer = metrics.timer if metrics is not None else lambda phase, ticker=None: nullcontext()
+
+    if security_metadata_id is None:
+        with timer("lookup", ticker):
+            security_metadata_id = fetchone(
+                sql_cursor, query="SELECT GetMetaDataIDForSymbol('{}')".format(ticker))
+
+    if price_layout(sql_conn, sql_cursor) == "standard":
+        table = "DataSourcePriceObservation"
+    else:
+        table = "PriceObservationStaging"
+        sql_cursor.execute("CALL PreparePriceObservationStaging()")
+
+    logger('{}: inserting {} rows into table: {}'.format(ticker, len(raw_data), table))
+    start = time.time()
+
+    column_list = ", ".join(PRICE_OBSERVATION_COLUMNS)
+
+    window = (
+        security_metadata_id,
+        raw_data.index.min().strftime("%Y-%m-%d %H:%M:%S"),
+        raw_data.index.max().strftime("%Y-%m-%d %H:%M:%S"))
+    with timer("summary", ticker):
+        sql_cursor.execute(
+            "SELECT COUNT(*) FROM DataSourcePriceObservation "
+            "WHERE SecurityMetaDataID=%s AND SampleTime BETWEEN %s AND %s", window)
+        rows_before = sql_cursor.fetchone()[0]
+
+    readjust = False
+    if adjust_prices is not None:
+        with timer("adjust", ticker):
+            # The latest stored bar, both for the first new bar's previous close and to spot backfilled rows.
+            sql_cursor.execute(
+                "SELECT SampleTime, ClosePrice FROM DataSourcePriceObservation "
+                "WHERE SecurityMetaDataID=%s ORDER BY SampleTime DESC LIMIT 1", (security_metadata_id,))
+            last_stored = sql_cursor.fetchone()
+            appended = last_stored is None or raw_data.index.min() > pd.Timestamp(last_stored[0])
+            events = corporateactions.derive_adjusted_close(
+                raw_data,
+                prev_close=last_stored[1] if last_stored is not None and appended else None,
+                infer=adjust_prices == "inferred")
+        readjust = last_stored is not None and (len(events) > 0 or not appended)
+        if len(events) and metrics is not None:
+            metrics.count("corporate_actions", len(events), ticker=ticker)
+
+    if insert_strategy == "executemany":
+        with timer("render", ticker):
+            sample_times = raw_data.index.strftime("%Y-%m-%d %H:%M:%S")
+            values = raw_data.astype(object).where(raw_data.notnull(), None).to_numpy()
+            rows = [
+                (sample_time,) + tuple(row) + (data_source_id, security_metadata_id)
+                for sample_time, row in zip(sample_times, values)]
+        stmt = "INSERT INTO {} ({}) VALUES ({}){}".format(
+            table, column_list, ", ".join(["%s"] * len(PRICE_OBSERVATION_COLUMNS)), PRICE_OBSERVATION_UPSERT)
+        with timer("insert", ticker):
+            sql_cursor.executemany(stmt, rows)
+
+    elif insert_strategy == "multirow":
+        with timer("render", ticker):
+            rows = price_observations_to_text(
+                raw_data, data_source_id, security_metadata_id, na_rep="NULL", quote_times=True)
+        with timer("insert", ticker):
+            for i in range(0, len(rows), chunk_size):
+                sql_cursor.execute("INSERT INTO {} ({}) VALUES ({}){}".format(
+                    table, column_list, "),(".join(rows[i:i + chunk_size]), PRICE_OBSERVATION_UPSERT))
+
+    else:
+        # PyMySQL streams LOCAL INFILE data from a named file, so the in-memory buffer is spooled to a temp file.
+        with timer("render", ticker):
+            rows = price_observations_to_text(
+                raw_data, data_source_id, security_metadata_id, na_rep="\\N", quote_times=False)
+            with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", newline="", delete=False) as f:
+                f.write("\n".join(rows))
+                f.write("\n")
+        try:
+            with timer("insert", ticker):
+                sql_cursor.execute(
+                    "LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE {} "
+                    "FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n' ({})".format(table, column_list),
+                    (f.name,))
+        finally:
+            os.remove(f.name)
+
+    if table != "DataSourcePriceObservation":
+        with timer("insert", ticker):
+            sql_cursor.execute("CALL MergePriceObservations()")
+
+    with timer("summary", ticker):
+        sql_cursor.execute("CALL RefreshPriceSummaries(%s, %s, %s, %s)", window + (rows_before,))
+    if readjust:
+        with timer("adjust", ticker):
+            runs = corporateactions.readjust_history(sql_cursor, security_metadata_id)
+        logger("{}: re-adjusted stored history in {} factor runs".format(ticker, runs))
+    if rollups:
+        with timer("rollup", ticker):
+            for interval in rollups:
+                sql_cursor.execute(
+                    "CALL RefreshPriceRollups(%s, %s, %s, %s)", window + (ROLLUP_INTERVALS[interval],))
+    if commit:
+        with timer("commit", ticker):
+            commit_data(sql_conn, sql_cursor)
+        if metrics is not None:
+            metrics.count("rows_inserted", len(raw_data), ticker=ticker)
+
+    elapsed = time.time() - start
+    logger("{}: wrote {} rows in {:.3f} seconds ({:.0f} rows/sec, {})".format(
+        ticker, len(raw_data), elapsed, len(raw_data) / elapsed if elapsed > 0 else float("inf"), insert_strategy))
+    return len(raw_data)
+
+
+#########################
+##### Price Rollups #####
+#########################
+
+
+# Bar intervals kept in PriceRollup for the intraday database, in minutes. Buckets cover the regular-hours session
+# only (see store_trading_sessions()), counted from its open, so pre- and post-market bars are left out.
+ROLLUP_INTERVALS = OrderedDict([
+    ("15min", 15),
+    ("60min", 60),
+    ("daily", 1440),
+])
+
+
+def rollup_minutes(interval):
+    """ Length of a bar interval in minutes.
+
+    :param interval: a name in ROLLUP_INTERVALS, "hourly", or "<n>min".
+    :return: int minutes.
+    """
+    if interval in ROLLUP_INTERVALS:
+        return ROLLUP_INTERVALS[interval]
+    if interval == "hourly":
+        return 60
+    match = re.match(r"^(\d+)min$", str(interval))
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError("interval must be one of {}, 'hourly' or '<n>min'".format(list(ROLLUP_INTERVALS)))
+    return int(match.group(1))
+
+
+def store_trading_sessions(sql_conn, sql_cursor, calendar=None):
+    """ Fill the TradingSession table with the regular-hours open and close of every session of the exchange
+    calendar, early closes included, which bucket the rollups (see GetRollupBucketStart()). Skipped when the
+    table already holds every session, and after the first call on a connection.
+
+    :param sql_conn: active SQL server connection.
+    :param sql_cursor: a SQL cursor from sql_conn.
+    :param calendar: TradingCalendar, tradingcalendar.nyse_calendar() by default.
+    :return: number of sessions written.
+    """
+    if getattr(sql_conn, "_trading_sessions_stored", False):
+        return 0
+    calendar = calendar or tradingcalendar.nyse_calendar()
+    written = 0
+    if fetchone(sql_cursor, query="SELECT COUNT(*) FROM TradingSession") != len(calendar.sessions):
+        opens = calendar.opens.tz_localize(None)
+        closes = calendar.closes.tz_localize(None)
+        sql_cursor.executemany(
+            "INSERT INTO TradingSession (SessionDate, OpenTime, CloseTime) VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE OpenTime=VALUES(OpenTime), CloseTime=VALUES(CloseTime)",
+            [(session.date(), open_time.to_pydatetime(), close_time.to_pydatetime())
+             for session, open_time, close_time in zip(calendar.sessions, opens, closes)])
         sql_conn.commit()
+        written = len(calendar.sessions)
+    sql_conn._trading_sessions_stored = True
+    return written
+
+
+def rebuild_price_rollups(logger, sql_conn, sql_cursor, intervals=None):
+    """ Rebuild PriceRollup from the stored intraday bars, one set-based pass per interval.
+
+    :param logger: a logging instance, e.g. logger.info or textEdit.append
+    :param sql_conn: active SQL server connection.
+    :param sql_cursor: a SQL cursor from an active connection.
+    :param intervals: names in ROLLUP_INTERVALS, default all.
+    :return: no return value.
+    """
+    store_trading_sessions(sql_conn, sql_cursor)
+    for interval in ROLLUP_INTERVALS if intervals is None else intervals:
+        start = time.time()
+        sql_cursor.execute("CALL RebuildPriceRollups(%s)", (ROLLUP_INTERVALS[interval],))
+        commit_data(sql_conn, sql_cursor)
+        logger("Rebuilt the {} rollup in {:.1f} seconds".format(interval, time.time() - start))
+
+
+def get_price_bars(sql_conn, ticker, interval="60min", start=None, end=None):
+    """ OHLCV bars of any interval for a security, read from PriceRollup.
+
+    Intervals kept in PriceRollup are one indexed range read. Any other multiple of one of them (e.g. "30min" or
+    "240min"), or "weekly", is aggregated from the longest stored interval that divides it, so only a fraction of
+    the rows are read compared with resampling the raw bars.
+
+    :param sql_conn: active SQL server connection.
+    :param ticker: security to get bars for.
+    :param interval: a name in ROLLUP_INTERVALS, "hourly", "weekly" or "<n>min".
+    :param start: optional first bucket start to include.
+    :param end: optional last bucket start to include.
+    :return: a Pandas dataframe indexed by BucketStart with Open/High/Low/ClosePrice, Volume and BarCount.
+    """
+    minutes = 7 * 1440 if interval == "weekly" else rollup_minutes(interval)
+    stored = [m for m in ROLLUP_INTERVALS.values() if minutes % m == 0]
+    if not stored:
+        raise ValueError("{} is not a multiple of any interval in {}".format(interval, list(ROLLUP_INTERVALS)))
+    source_minutes = max(stored)
+
+    sqlstr = """
+        SELECT
+            pr.BucketStart, pr.OpenPrice, pr.HighPrice, pr.LowPrice, pr.ClosePrice, pr.Volume, pr.BarCount
+        FROM
+            PriceRollup AS pr
+        JOIN
+            SecurityMetaData AS smd ON pr.SecurityMetaDataID=smd.SecurityMetaDataID
+        WHERE
+            smd.SecuritySymbol=%(symbol)s
+            AND
+            pr.IntervalMinutes=%(minutes)s
+            AND
+            pr.BucketStart BETWEEN %(start)s AND %(end)s
+        ORDER BY
+            pr.BucketStart
+        """
+    data = pd.read_sql_query(
+        sql=sqlstr, con=sql_conn, index_col="BucketStart", parse_dates=["BucketStart"],
+        params={
+            "symbol": ticker,
+            "minutes": source_minutes,
+            "start": start or dt(1900, 1, 1),
+            "end": end or dt(2100, 1, 1)})
+    if minutes == source_minutes:
+        return data
+
+    if interval == "weekly":
+        grouper = data.resample("W-MON", label="left", closed="left")
+    elif minutes % 1440 == 0:
+        grouper = data.resample("{}min".format(minutes), origin=pd.Timestamp(2000, 1, 1))
+    else:
+        # Same alignment as the stored buckets: whole intervals from each session's open (see GetRollupBucketStart()).
+        calendar = tradingcalendar.nyse_calendar()
+        opens = pd.Series(calendar.opens.tz_localize(None), index=calendar.sessions)
+        session_open = pd.DatetimeIndex(opens.reindex(data.index.normalize()).values)
+        step = pd.Timedelta(minutes=minutes)
+        grouper = data.groupby(session_open + (data.index - session_open) // step * step)
+    bars = grouper.agg({
+        "OpenPrice": "first",
+        "HighPrice": "max",
+        "LowPrice": "min",
+        "ClosePrice": "last",
+        "Volume": "sum",
+        "BarCount": "sum"})
+    bars = bars[bars["BarCount"] > 0]
+    bars.index.name = "BucketStart"
+    return bars
 
 
 ##########################################
@@ -510,11 +2318,78 @@ def delete_existing_symbol(symbol, sql_conn, sql_cursor, logger):
         logger('Deleting {} and all associated data.'.format(symbol))
         sql_cursor.callproc('DeleteSymbol', args=[symbol])
         logger("... done.")
-        sql_conn.commit()
+        commit_data(sql_conn, sql_cursor)
     else:
         logger("{} not found in database.".format(symbol))
 
 
+def sync_universe(
+        logger,
+        sql_conn,
+        sql_cursor,
+        tickers,
+        data_source_info,
+        sec_type='EQUITY',
+        sec_tz='EST',
+        sec_contract_size=1.0,
+        sec_currency='USD'):
+    """ Bring the symbols in the database in line with a ticker universe in one transaction.
+
+    The symbols in GetSymbolsInDatabase are diffed against tickers, the additions and removals are staged in
+    SymbolSyncStaging with one batched insert, and SyncSymbols applies them with set-based statements and a
+    single commit, instead of an AddNewSymbol or DeleteSymbol call (and commit) per symbol.
+
+    :param logger: a logging instance, e.g. logger.info or textEdit.append
+    :param sql_conn: active SQL server connection.
+    :param sql_cursor: a SQL cursor from an active connection.
+    :param tickers: dict of ticker -> data source name, e.g. from TickerUniverse.load().
+    :param data_source_info: dict of datasource info parsed from cred file, for data sources not yet defined.
+    :param sec_type: security type of added symbols, default EQUITY.
+    :param sec_tz: traded time zones of added symbols, default EST.
+    :param sec_contract_size: contract size of added symbols, default 1.
+    :param sec_currency: denomination currency of added symbols, default USD.
+    :return: tuple of (added, removed) sorted symbol lists.
+    """
+    in_database = get_symbols_from_database(sql_conn)
+    to_add = sorted(set(tickers) - set(in_database))
+    to_remove = sorted(set(in_database) - set(tickers))
+    if not to_add and not to_remove:
+        logger("Universe in sync: {} symbols".format(len(in_database)))
+        return [], []
+
+    data_source_ids = {}
+    for data_source_name in sorted(set(tickers[ticker] for ticker in to_add)):
+        data_source_ids[data_source_name] = update_data_source(
+            logger=logger,
+            sql_conn=sql_conn,
+            sql_cursor=sql_cursor,
+            data_source_name=data_source_name,
+            data_source_url=data_source_info[data_source_name]['url'])
+
+    if to_remove:
+        logger("Symbols removed from ticker list that will be deleted: {}".format(", ".join(to_remove)))
+    if to_add:
+        logger("Adding metadata for {} new symbols: {}".format(len(to_add), ", ".join(to_add)))
+
+    start = time.time()
+    try:
+        sql_cursor.execute("DELETE FROM SymbolSyncStaging WHERE ConnectionID=CONNECTION_ID()")
+        sql_cursor.executemany(
+            "INSERT INTO SymbolSyncStaging (ConnectionID, SecuritySymbol, Action, DataSourceID) "
+            "VALUES (CONNECTION_ID(), %s, %s, %s)",
+            [(ticker, "ADD", data_source_ids[tickers[ticker]]) for ticker in to_add]
+            + [(ticker, "REMOVE", None) for ticker in to_remove])
+        sql_cursor.execute(
+            "CALL SyncSymbols(%s, %s, %s, %s)", (sec_type, sec_tz, sec_contract_size, sec_currency))
+        commit_data(sql_conn, sql_cursor)
+    except Exception:
+        sql_conn.rollback()
+        raise
+    logger("... added {} and removed {} symbols in {:.3f} seconds".format(
+        len(to_add), len(to_remove), time.time() - start))
+    return to_add, to_remove
+
+
 # def get_security_data_from_database(ticker):
 #     """ Get time series data from SQL server.
 #
@@ -528,7 +2403,16 @@ def delete_existing_symbol(symbol, sql_conn, sql_cursor, logger):
 #     return data
 
 
-def get_symbols_from_database(sql_conn):
+def get_symbols_from_database(sql_conn, cache=None):
+    """ Symbols in the database and the name of each one's data source.
+
+    :param sql_conn: active SQL server connection.
+    :param cache: optional QueryCache to serve repeated calls from.
+    :return: OrderedDict of symbol -> data source name, by symbol.
+    """
+    if cache is not None:
+        return cache.get_or_compute(sql_conn, "get_symbols_from_database", lambda: get_symbols_from_database(sql_conn))
+
     sqlstr = "SELECT * FROM GetSymbolsInDatabase ORDER BY SecuritySymbol ASC"
     data = pd.read_sql_query(sql=sqlstr, con=sql_conn, index_col='SecuritySymbol')
     answer = OrderedDict()
@@ -537,7 +2421,23 @@ def get_symbols_from_database(sql_conn):
     return answer
 
 
+def get_security_data(sql_conn, ticker, price_mirror=None):
+    """ Get all stored price data for a security, from the local PriceMirror when it has the symbol.
+
+    :param sql_conn: active SQL server connection (only used if the mirror can't serve the request).
+    :param ticker: security to get data for.
+    :param price_mirror: optional PriceMirror.
+    :return: a Pandas dataframe indexed by SampleTime.
+    """
+    if price_mirror is not None and price_mirror.last_sample_time(ticker) is not None:
+        return price_mirror.load(ticker)
+    sqlstr = "CALL GetSecurityData('{}')".format(ticker)
+    return pd.read_sql_query(sql=sqlstr, con=sql_conn, index_col='SampleTime')
+
+
 def parse_creds(cred_file, database_name):
+    if not os.path.exists(cred_file):
+        raise FileNotFoundError("{} not found: did you rename creds_template.yaml?".format(cred_file))
     with open(cred_file, "r") as f:
         data = yaml.load(f, Loader=yaml.FullLoader)
 
@@ -547,10 +2447,16 @@ def parse_creds(cred_file, database_name):
     db_info['password'] = data['databases'][database_name]['password']
     db_info['host'] = data['databases'][database_name]['host']
 
-    # datasource creds
+    # datasource creds. A data source may list several keys under api_keys, either as plain strings or as
+    # {key, calls_per_minute, calls_per_day} entries; a single api_key is treated as a list of one.
     data_source_info = {}
     for datasource in data['datasources']:
-        data_source_info[datasource] = data['datasources'][datasource]
+        info = dict(data['datasources'][datasource])
+        api_keys = info.get('api_keys') or ([info['api_key']] if info.get('api_key') else [])
+        info['api_keys'] = [api_key if isinstance(api_key, dict) else {'key': api_key} for api_key in api_keys]
+        if info['api_keys'] and not info.get('api_key'):
+            info['api_key'] = info['api_keys'][0]['key']
+        data_source_info[datasource] = info
 
     return db_info, data_source_info
 
@@ -560,8 +2466,61 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-intraday", "--intraday", action="store_true", default=False)
     parser.add_argument("-daily", "--daily", action="store_true", default=False)
+    parser.add_argument("--workers", type=int, default=1, help="number of concurrent API requests")
+    parser.add_argument("--calls-per-minute", type=float, default=None, help="API plan requests per minute")
+    parser.add_argument("--calls-per-day", type=int, default=None, help="API plan requests per day")
+    parser.add_argument("--insert-strategy", choices=INSERT_STRATEGIES, default="multirow")
+    parser.add_argument("--cache-dir", default=None, help="cache raw API responses in this directory")
+    parser.add_argument("--cache-max-mb", type=float, default=2048, help="size limit of the response cache")
+    parser.add_argument("--offline", action="store_true", default=False, help="replay the run from --cache-dir")
+    parser.add_argument("--parser", choices=ALPHAVANTAGE_PARSERS, default="columnar", help="AlphaVantage JSON parser")
+    parser.add_argument("--universe", nargs="+", choices=list(UNIVERSE_SOURCES), default=["etf"],
+                        help="constituent lists making up the ticker universe")
+    parser.add_argument("--universe-dir", default="./universe", help="cache constituent lists in this directory")
+    parser.add_argument("--universe-ttl-hours", type=float, default=24, help="re-fetch cached lists after this")
+    parser.add_argument("--job-file", default="./update_jobs.sqlite", help="checkpoint file for resuming runs")
+    parser.add_argument("--max-attempts", type=int, default=5, help="failures before a ticker is given up on")
+    parser.add_argument("--backfill", action="store_true", default=False,
+                        help="scan the price table for missing sessions and fetch them")
+    parser.add_argument("--adjust-prices", nargs="?", choices=corporateactions.ADJUST_MODES, default=None,
+                        const="reported",
+                        help="derive missing adjusted closes and re-adjust history on splits and dividends")
+    parser.add_argument("--infer-splits", action="store_true", default=False,
+                        help="same as --adjust-prices inferred: also infer splits the data source doesn't report")
+    parser.add_argument("--rollups", nargs="*", choices=list(ROLLUP_INTERVALS), default=None,
+                        help="bar intervals kept in the intraday PriceRollup table (default all, none if empty)")
+    parser.add_argument("--rebuild-rollups", action="store_true", default=False,
+                        help="rebuild the intraday PriceRollup table from the stored bars before updating")
+    parser.add_argument("--max-runtime-minutes", type=float, default=None, help="stop starting tickers after this")
+    parser.add_argument("--mirror-dir", default=None, help="keep a local columnar mirror of prices in this directory")
+    parser.add_argument("--writers", type=int, default=1, help="number of database writer threads")
+    parser.add_argument("--write-queue", type=int, default=8, help="fetched tickers buffered ahead of the writers")
+    parser.add_argument("--commit-rows", type=int, default=50000, help="rows per group commit")
+    parser.add_argument("--commit-seconds", type=float, default=5.0, help="longest wait before committing rows")
+    parser.add_argument("--leases", action="store_true", default=False,
+                        help="share the run with other processes through the database's TickerLease table")
+    parser.add_argument("--lease-seconds", type=int, default=300, help="lease length when running with --leases")
+    parser.add_argument("--export", default=None, metavar="DIR",
+                        help="instead of updating, export the stored prices to partitioned files in DIR")
+    parser.add_argument("--export-format", choices=streaming.EXPORT_FORMATS, default="csv",
+                        help="parquet needs pyarrow")
+    parser.add_argument("--export-partition", choices=streaming.EXPORT_PARTITIONS, default="year",
+                        help="one file per symbol, per symbol and year, or per symbol and month")
+    parser.add_argument("--export-compression", default="gzip",
+                        help="gzip or none for CSV; snappy, zstd, gzip or none for Parquet")
+    parser.add_argument("--chunk-rows", type=int, default=100000, help="rows streamed from the server at a time")
+    parser.add_argument("--metrics-dir", default=None, help="write a JSON run report and Prometheus file here")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port")
+    parser.add_argument("--profile", action="store_true", default=False,
+                        help="profile the fetch and write work with cProfile (written to --metrics-dir)")
+    parser.add_argument("--trace-memory", action="store_true", default=False,
+                        help="trace allocations with tracemalloc and report the top allocation sites")
     args = parser.parse_args()
 
+    if not os.path.exists(cred_file):
+        print("creds.yaml not found: did you rename creds_template.yaml?")
+        sys.exit()
+
     logger = init_logger().info
 
     # AlphaVantage has a premium endpoint, which enables pulling fields like TIME_SERIES_DAILY_ADJUSTED
@@ -570,29 +2529,130 @@ if __name__ == "__main__":
 
     alphavantage_premium = False
 
-    for dbname, truefalse in args._get_kwargs():
-        if truefalse:
-            database_name = "PRICES_{}".format(dbname.upper())
-
-            logger("USING DATABASE: {}".format(database_name))
-
-            db_info, data_source_info = parse_creds(cred_file, database_name=database_name)
-
-            sql_conn, sql_cursor = mysql_connect(
-                host=db_info['host'],
-                user=db_info['user'],
-                password=db_info['password'],
-                database=database_name)
+    response_cache = None
+    if args.cache_dir or args.offline:
+        response_cache = responsecache.ResponseCache(
+            cache_dir=args.cache_dir or "./cache",
+            max_bytes=int(args.cache_max_mb * 1024 ** 2),
+            offline=args.offline)
+
+    # Fetched once for every database, from the local cache while it is fresh (or in any case with --offline).
+    tickers = None
+    if not args.export:
+        tickers = TickerUniverse(
+            cache_dir=args.universe_dir,
+            ttl_hours=args.universe_ttl_hours,
+            offline=args.offline,
+            logger=logger).load(args.universe)
+
+    database_names = [
+        "PRICES_{}".format(dbname.upper())
+        for dbname, truefalse in [("daily", args.daily), ("intraday", args.intraday)] if truefalse]
+
+    # One rate limit per API key, shared by every database. Keys without their own quota in creds.yaml get the
+    # --calls-per-minute/--calls-per-day one.
+    rate_limiter = None
+    if database_names:
+        _, data_source_info = parse_creds(cred_file, database_name=database_names[0])
+        rate_limiter = ratelimit.ApiKeyPool.from_config(
+            data_source_info["AlphaVantage"]["api_keys"],
+            calls_per_minute=args.calls_per_minute or 60.0 / 5,
+            calls_per_day=args.calls_per_day)
+
+    run_metrics = []
+    if args.metrics_port:
+        instrumentation.serve_metrics(args.metrics_port, run_metrics)
+        logger("Serving metrics at http://localhost:{}/metrics".format(args.metrics_port))
+
+    def run_database_update(database_name):
+        db_logger = lambda message: logger("[{}] {}".format(database_name, message))
+        db_logger("USING DATABASE: {}".format(database_name))
+
+        db_info, data_source_info = parse_creds(cred_file, database_name=database_name)
+
+        if args.export:
+            sql_conn, _ = mysql_connect(
+                host=db_info['host'], user=db_info['user'], password=db_info['password'], database=database_name)
+            try:
+                streaming.export_price_observations(
+                    logger=db_logger,
+                    sql_conn=sql_conn,
+                    out_dir=os.path.join(args.export, database_name),
+                    fmt=args.export_format,
+                    partition=args.export_partition,
+                    compression=None if args.export_compression == "none" else args.export_compression,
+                    chunk_rows=args.chunk_rows)
+            finally:
+                sql_conn.close()
+            return
+
+        metrics = instrumentation.RunMetrics(
+            database=database_name, profile=args.profile, trace_memory=args.trace_memory)
+        run_metrics.append(metrics)
+
+        # The main thread's connection, one per writer thread, and two for the lease queue and its heartbeat.
+        connection_pool = ConnectionPool(
+            host=db_info['host'],
+            user=db_info['user'],
+            password=db_info['password'],
+            database=database_name,
+            size=args.writers + 3,
+            local_infile=args.insert_strategy == "infile")
+
+        # Each database tracks its own run, either in the local checkpoint file or, shared with other processes,
+        # in the database itself.
+        if args.leases:
+            job_queue = jobqueue.LeaseQueue(
+                connection_pool, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+        else:
+            job_queue = jobqueue.JobQueue(path=args.job_file, max_attempts=args.max_attempts)
 
-            tickers = get_etf_tickers()
+        try:
+            with connection_pool.connection() as (sql_conn, sql_cursor):
+                if args.rebuild_rollups and "INTRADAY" in database_name:
+                    rebuild_price_rollups(db_logger, sql_conn, sql_cursor, intervals=args.rollups)
 
-            database_update(
-                logger=logger,
-                sql_conn=sql_conn,
-                sql_cursor=sql_cursor,
-                data_source_info=data_source_info,
-                wait_seconds=5,
-                tickers=tickers,
-                alphavantage_premium=alphavantage_premium,
-            )
-            sql_conn.close()
+                database_update(
+                    logger=db_logger,
+                    sql_conn=sql_conn,
+                    sql_cursor=sql_cursor,
+                    data_source_info=data_source_info,
+                    tickers=tickers,
+                    alphavantage_premium=alphavantage_premium,
+                    workers=args.workers,
+                    rate_limiter=rate_limiter,
+                    insert_strategy=args.insert_strategy,
+                    response_cache=response_cache,
+                    parser=args.parser,
+                    job_queue=job_queue,
+                    max_runtime_minutes=args.max_runtime_minutes,
+                    backfill=args.backfill,
+                    adjust_prices="inferred" if args.infer_splits else args.adjust_prices,
+                    rollups=args.rollups,
+                    price_mirror=(pricemirror.PriceMirror(os.path.join(args.mirror_dir, database_name))
+                                  if args.mirror_dir else None),
+                    writers=args.writers,
+                    write_queue_size=args.write_queue,
+                    commit_rows=args.commit_rows,
+                    commit_seconds=args.commit_seconds,
+                    connection_pool=connection_pool,
+                    metrics=metrics,
+                )
+            if connection_pool.reconnects:
+                db_logger("Reconnected to the database {} times".format(connection_pool.reconnects))
+        finally:
+            job_queue.close()
+            connection_pool.close()
+            if args.metrics_dir:
+                for path in metrics.write(args.metrics_dir):
+                    db_logger("Wrote {}".format(path))
+
+    # Daily and intraday updates run side by side; a failure in one doesn't stop the other.
+    with ThreadPoolExecutor(max_workers=max(1, len(database_names))) as executor:
+        futures = {executor.submit(run_database_update, database_name): database_name
+                   for database_name in database_names}
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger("[{}] Update FAILED! ({})".format(futures[future], e))
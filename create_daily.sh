@@ -17,6 +17,10 @@ mysql -u "${dbuser}" --password="${dbuserpw}" -e "CREATE DATABASE ${dbname}"
 echo "Creating tables"
 mysql -u "${dbuser}" --password="${dbuserpw}" "${dbname}" < ./code_mysql/CREATES.sql
 
+# Optional: uncomment to use the compact storage layout (PriceBar + CorporateAction, compressed).
+# echo "Switching to the compact price layout"
+# mysql -u "${dbuser}" --password="${dbuserpw}" "${dbname}" < ./code_mysql/COMPACT_DAILY.sql
+
 echo "Creating Views"
 mysql -u "${dbuser}" --password="${dbuserpw}" "${dbname}" <  ./code_mysql/VIEWS.sql
 
@@ -15,6 +15,14 @@ mysql -u %dbuser% --password=%dbuserpw% -e "CREATE DATABASE %dbname%
 echo "Creating tables"
 mysql -u %dbuser% --password=%dbuserpw% %dbname% < .\code_mysql\CREATES.sql
 
+::Optional: uncomment to partition the price table by year.
+::echo "Partitioning price table by year"
+::mysql -u %dbuser% --password=%dbuserpw% %dbname% < .\code_mysql\PARTITIONS_INTRADAY.sql
+
+::Optional: uncomment (instead of the partitioning above) to use the compact storage layout.
+::echo "Switching to the compact price layout"
+::mysql -u %dbuser% --password=%dbuserpw% %dbname% < .\code_mysql\COMPACT_INTRADAY.sql
+
 echo "Creating Views"
 mysql -u %dbuser% --password=%dbuserpw% %dbname% <  .\code_mysql\VIEWS.sql
 
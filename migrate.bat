@@ -0,0 +1,20 @@
+::Code for migrating an existing database on MySQL/MariaDB Server to the current schema, keeping its data.
+
+@echo off
+set /P dbuser="Enter your MySQL username (and press enter):"
+set /P dbuserpw="Enter your MySQL password (and press enter):"
+set /P dbname="Enter the database to migrate, e.g. PRICES_DAILY or PRICES_INTRADAY (and press enter):"
+
+for %%m in (.\code_mysql\MIGRATE_*.sql) do (
+    echo "Applying %%m"
+    mysql -u %dbuser% --password=%dbuserpw% %dbname% < %%m
+)
+
+echo "Recreating Views"
+mysql -u %dbuser% --password=%dbuserpw% %dbname% <  .\code_mysql\VIEWS.sql
+
+echo "Recreating Functions"
+mysql -u %dbuser% --password=%dbuserpw% %dbname% < .\code_mysql\FUNCTIONS.sql
+
+echo "Recreating Stored Procedures"
+mysql -u %dbuser% --password=%dbuserpw% %dbname% < .\code_mysql\STOREDPROCS.sql
@@ -0,0 +1,25 @@
+# Code for migrating an existing database on MySQL/MariaDB Server to the current schema, keeping its data.
+
+echo "Enter your MySQL username (and press enter):"
+read dbuser
+
+echo "Enter your MySQL password (and press enter):"
+read dbuserpw
+
+echo "Enter the database to migrate, e.g. PRICES_DAILY or PRICES_INTRADAY (and press enter):"
+read dbname
+
+for migration in ./code_mysql/MIGRATE_*.sql
+do
+    echo "Applying ${migration}"
+    mysql -u "${dbuser}" --password="${dbuserpw}" "${dbname}" < "${migration}"
+done
+
+echo "Recreating Views"
+mysql -u "${dbuser}" --password="${dbuserpw}" "${dbname}" <  ./code_mysql/VIEWS.sql
+
+echo "Recreating Functions"
+mysql -u "${dbuser}" --password="${dbuserpw}" "${dbname}" < ./code_mysql/FUNCTIONS.sql
+
+echo "Recreating Stored Procedures"
+mysql -u "${dbuser}" --password="${dbuserpw}" "${dbname}" < ./code_mysql/STOREDPROCS.sql